@@ -1,11 +1,12 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, Response, stream_with_context, make_response
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
-import pandas as pd
-import numpy as np
-import oracledb
 import config
 import google.generativeai as genai
 import os
+import json
+import secrets
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -14,16 +15,82 @@ from utils import (
     hash_password, verify_password, validate_password, 
     generate_verification_code, validate_email, get_code_expiration_time
 )
-from email_utils import mail, send_verification_code_email, send_welcome_email
+from email_utils import mail
+from email_outbox import email_outbox
+from hashing import password_hasher, HashingOverloaded
+from rate_limit import rate_limiter
+from db_utils import db_pool, explain_plan
+from metrics import metrics
+from profiler import query_profiler, ORDENES
+from auth_db import fetch_login_user, record_login_success, record_login_failure
+from dashboard import (
+    parse_filters, filter_key, build_filter_clause, set_filter_input_sizes, FilterError, aggregate_in_db,
+    aggregate_in_pandas, aggregate_in_rollup, aggregate_in_kernel, fetch_keyset_page, stream_export,
+    TABLE_COUNT_QUERY, TABLE_PAGE_QUERY
+)
+from cache_utils import result_cache, data_version
+from rollup import dashboard_rollup
+from snapshot import dashboard_snapshot
+from migrations import schema_migrations
+from lookups import filter_options
+from chat_utils import schema_cache, answer_cache, run_guarded_query, summarize_results, dataframe_rows
+from chat_jobs import chat_jobs, ChatJobError
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config.from_object(config.Config)
 
+# Detrás de PROXY_FIX_X_FOR proxies, remote_addr es la IP real del cliente y no la del proxy
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
 # Inicializar Flask-Mail
 mail.init_app(app)
 
+# Cola de salida de emails (envío en segundo plano)
+email_outbox.init_app(app)
+
+# Hashing de contraseñas en procesos dedicados
+password_hasher.init_app(app)
+
+# Límite de intentos en login y verificación
+rate_limiter.init_app(app)
+
+# Métricas de latencia en formato Prometheus (/metrics)
+metrics.init_app(app)
+
+# Perfil de consultas SQL y log de consultas lentas (/admin/queries)
+query_profiler.init_app(app)
+
+# Inicializar pool de conexiones Oracle
+db_pool.init_app(app)
+
+# Inicializar caché de resultados del dashboard y la versión de datos compartida
+result_cache.init_app(app)
+data_version.init_app(app)
+
+# Tabla resumen del dashboard y sus comandos de refresco
+dashboard_rollup.init_app(app)
+
+# Snapshot columnar local del dashboard (opcional)
+dashboard_snapshot.init_app(app)
+
+# Migraciones del esquema: particiones e índices de la tabla de ingresos
+schema_migrations.init_app(app)
+
+# Opciones de los filtros en memoria
+filter_options.init_app(app)
+
+# Esquema para el prompt del chat en memoria
+schema_cache.init_app(app)
+
+# Caché de respuestas del chat
+answer_cache.init_app(app)
+
+# Ejecución del chat en segundo plano
+chat_jobs.init_app(app)
+
 # Configurar Gemini
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if GOOGLE_API_KEY:
@@ -33,13 +100,8 @@ else:
     gemini_model = None
 
 def get_connection():
-    return oracledb.connect(
-        user=app.config['DB_USER'],
-        password=app.config['DB_PASSWORD'],
-        dsn=app.config['DB_DSN'],
-        wallet_location=app.config['WALLET_LOCATION'],
-        wallet_password=app.config['WALLET_PASSWORD']
-    )
+    """Conexión del pool asociada a la petición (se libera en el teardown)"""
+    return db_pool.get_connection()
 
 def login_required(f):
     @wraps(f)
@@ -50,9 +112,28 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'logged_in' not in session:
+            flash('Por favor, inicia sesión para acceder.', 'warning')
+            return redirect(url_for('login'))
+        if not session.get('is_admin'):
+            return jsonify({'error': 'Acceso restringido a administradores'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # ========== RUTAS DE AUTENTICACIÓN (NUEVAS Y MEJORADAS) ==========
 
+def hashing_unavailable(template, error):
+    """503 con Retry-After cuando bcrypt está saturado o no responde a tiempo"""
+    flash(str(error), 'warning')
+    response = make_response(render_template(template), 503)
+    response.headers['Retry-After'] = str(app.config['BCRYPT_TIMEOUT'])
+    return response
+
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', 'username', template='login.html')
 def login():
     """Login mejorado: soporta tanto admin básico como usuarios de BD"""
     if request.method == 'POST':
@@ -74,13 +155,7 @@ def login():
             conn = get_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id_usuario, email, nombre, password_hash, verificado, bloqueado
-                FROM USUARIOS
-                WHERE email = :1 AND activo = 1
-            """, [email_or_username])
-            
-            user = cursor.fetchone()
+            user = fetch_login_user(cursor, email_or_username)
             
             if user:
                 user_id, email, nombre, password_hash, verificado, bloqueado = user
@@ -89,7 +164,6 @@ def login():
                 if bloqueado == 1:
                     flash('Tu cuenta ha sido bloqueada. Contacta al administrador.', 'danger')
                     cursor.close()
-                    conn.close()
                     return render_template('login.html')
                 
                 # Verificar contraseña
@@ -98,7 +172,6 @@ def login():
                     if verificado == 0:
                         flash('Debes verificar tu email antes de iniciar sesión.', 'warning')
                         cursor.close()
-                        conn.close()
                         return redirect(url_for('verify_email', email=email))
                     
                     # Login exitoso
@@ -108,41 +181,25 @@ def login():
                     session['user_id'] = user_id
                     session['is_admin'] = False
                     
-                    # Actualizar último acceso
-                    cursor.execute("""
-                        UPDATE USUARIOS 
-                        SET ultimo_acceso = CURRENT_TIMESTAMP, intentos_fallidos = 0
-                        WHERE id_usuario = :1
-                    """, [user_id])
-                    conn.commit()
+                    # Último acceso y rehash transparente (si ha cambiado el coste) en un solo viaje
+                    new_hash = hash_password(password) if password_hasher.needs_rehash(password_hash) else None
+                    record_login_success(cursor, user_id, new_hash)
+                    rate_limiter.reset('login', email)
                     
                     flash(f'¡Bienvenido {nombre}!', 'success')
                     cursor.close()
-                    conn.close()
                     return redirect(url_for('index'))
                 else:
-                    # Incrementar intentos fallidos
-                    cursor.execute("""
-                        UPDATE USUARIOS 
-                        SET intentos_fallidos = intentos_fallidos + 1
-                        WHERE id_usuario = :1
-                    """, [user_id])
-                    
-                    # Bloquear si hay más de 5 intentos
-                    cursor.execute("""
-                        UPDATE USUARIOS 
-                        SET bloqueado = 1
-                        WHERE id_usuario = :1 AND intentos_fallidos >= 5
-                    """, [user_id])
-                    
-                    conn.commit()
+                    # Incrementar intentos fallidos y bloquear al llegar al máximo, de forma atómica
+                    record_login_failure(cursor, user_id, app.config['LOGIN_MAX_ATTEMPTS'])
                     flash('Email o contraseña incorrectos', 'danger')
             else:
                 flash('Email o contraseña incorrectos', 'danger')
             
             cursor.close()
-            conn.close()
             
+        except HashingOverloaded as e:
+            return hashing_unavailable('login.html', e)
         except Exception as e:
             flash(f'Error al iniciar sesión: {str(e)}', 'danger')
     
@@ -185,7 +242,6 @@ def register():
             if cursor.fetchone():
                 flash('Este email ya está registrado', 'danger')
                 cursor.close()
-                conn.close()
                 return render_template('register.html')
             
             # Generar código de verificación
@@ -204,16 +260,18 @@ def register():
             
             conn.commit()
             cursor.close()
-            conn.close()
             
             # Enviar email con código
-            if send_verification_code_email(email, nombre, code):
+            if email_outbox.send('verification_code', email, user_name=nombre, code=code):
                 flash('¡Registro exitoso! Te hemos enviado un código de verificación a tu email.', 'success')
                 return redirect(url_for('verify_email', email=email))
             else:
+                # No se pudo encolar: la cuenta existe y el código puede pedirse otra vez al verificar
                 flash('Usuario registrado pero hubo un error al enviar el email. Contacta al administrador.', 'warning')
                 return redirect(url_for('login'))
             
+        except HashingOverloaded as e:
+            return hashing_unavailable('register.html', e)
         except Exception as e:
             flash(f'Error al registrar: {str(e)}', 'danger')
             return render_template('register.html')
@@ -226,6 +284,7 @@ def verify_email(email):
     return render_template('verify.html', email=email)
 
 @app.route('/verify/check', methods=['POST'])
+@rate_limiter.limit('verify_check', 'email')
 def verify_check():
     """Verifica el código ingresado"""
     data = request.get_json()
@@ -267,10 +326,9 @@ def verify_check():
             conn.commit()
             
             cursor.close()
-            conn.close()
             
             # Enviar email de bienvenida
-            send_welcome_email(email, nombre)
+            email_outbox.send('welcome', email, user_name=nombre)
             
             return jsonify({'success': True, 'message': '¡Cuenta verificada exitosamente!'})
         else:
@@ -280,6 +338,7 @@ def verify_check():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/verify/resend', methods=['POST'])
+@rate_limiter.limit('verify_resend', 'email')
 def verify_resend():
     """Reenvía un nuevo código de verificación"""
     data = request.get_json()
@@ -318,10 +377,9 @@ def verify_resend():
         
         conn.commit()
         cursor.close()
-        conn.close()
         
         # Enviar email
-        if send_verification_code_email(email, nombre, code):
+        if email_outbox.send('verification_code', email, user_name=nombre, code=code):
             return jsonify({'success': True, 'message': 'Nuevo código enviado a tu email'})
         else:
             return jsonify({'success': False, 'message': 'Error al enviar el email'}), 500
@@ -340,121 +398,44 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT nombre_comunidad FROM COMUNIDADES ORDER BY nombre_comunidad')
-        comunidades = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT DISTINCT sexo FROM INGRESOS WHERE sexo IS NOT NULL ORDER BY sexo')
-        sexos = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT nombre_categoria FROM CATEGORIAS_DIAGNOSTICO ORDER BY nombre_categoria')
-        categorias = [row[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
-        
-        return render_template('index.html', comunidades=comunidades, sexos=sexos, categorias=categorias)
-    except Exception as e:
-        return f"Error: {str(e)}", 500
+    # Las opciones de los filtros se cargan desde /api/filtros (sin tocar la BD al renderizar)
+    return render_template('index.html')
 
 @app.route('/api/data')
 @login_required
 def get_data():
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = 'SELECT * FROM VISTA_DASHBOARD WHERE 1=1'
-        params = []
-        
-        comunidad = request.args.get('comunidad')
-        if comunidad:
-            query += ' AND comunidad_atencion = :1'
-            params.append(comunidad)
-        
-        sexo = request.args.get('sexo')
-        if sexo:
-            query += f' AND sexo = :{len(params) + 1}'
-            params.append(sexo)
-        
-        categoria = request.args.get('categoria')
-        if categoria:
-            query += f' AND categoria_diagnostico = :{len(params) + 1}'
-            params.append(categoria)
-        
-        fecha_inicio = request.args.get('fecha_inicio')
-        if fecha_inicio:
-            query += f' AND fecha_ingreso >= :{len(params) + 1}'
-            params.append(fecha_inicio)
+        filters = parse_filters(request.args)
         
-        fecha_fin = request.args.get('fecha_fin')
-        if fecha_fin:
-            query += f' AND fecha_ingreso <= :{len(params) + 1}'
-            params.append(fecha_fin)
-        
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        def compute():
+            # Con snapshot local disponible no se consulta Oracle
+            tabla = dashboard_snapshot.get_table()
+            if tabla is not None and dashboard_snapshot.can_serve(filters):
+                return dashboard_snapshot.aggregate(tabla, filters)
+            
+            cursor = get_connection().cursor()
+            # Por defecto se agrega en Oracle; 'pandas' mantiene el camino original
+            modo = app.config['DASHBOARD_AGGREGATION']
+            if modo == 'pandas':
+                result = aggregate_in_pandas(cursor, filters, app.config['EXPORT_ARRAYSIZE'], app.config['DB_FETCH_ARROW'])
+            elif modo == 'kernel':
+                result = aggregate_in_kernel(cursor, filters, app.config['EXPORT_ARRAYSIZE'], app.config['DB_FETCH_ARROW'])
+            elif modo == 'rollup' and dashboard_rollup.can_serve(filters):
+                result = aggregate_in_rollup(cursor, filters, dashboard_rollup.table)
+            else:
+                result = aggregate_in_db(cursor, filters)
+            cursor.close()
+            return result
         
-        cursor.close()
-        conn.close()
+        result = result_cache.get_or_set('dashboard', filter_key(filters), compute)
         
-        if df.empty:
+        if result is None:
             return jsonify({'error': 'No se encontraron datos con los filtros seleccionados'})
         
-        pacientes_uci = 0
-        dias_uci_promedio = 0
-        ingresos_uci_dict = {}
-        
-        if 'DIAS_UCI' in df.columns:
-            df['DIAS_UCI_NUM'] = pd.to_numeric(df['DIAS_UCI'], errors='coerce')
-            df_con_uci = df[df['DIAS_UCI_NUM'] > 0]
-            pacientes_uci = len(df_con_uci)
-            
-            if pacientes_uci > 0:
-                dias_uci_promedio = float(df_con_uci['DIAS_UCI_NUM'].mean())
-                if pd.isna(dias_uci_promedio):
-                    dias_uci_promedio = 0
-            
-            sin_uci = len(df) - pacientes_uci
-            ingresos_uci_dict = {'Sin UCI': sin_uci, 'Con UCI': pacientes_uci}
-        
-        estancia_promedio = 0
-        if 'ESTANCIA_DIAS' in df.columns:
-            estancia = pd.to_numeric(df['ESTANCIA_DIAS'], errors='coerce')
-            estancia_promedio = float(estancia.mean())
-            if pd.isna(estancia_promedio):
-                estancia_promedio = 0
-        
-        coste_total = 0
-        if 'COSTE_APR' in df.columns:
-            coste = pd.to_numeric(df['COSTE_APR'], errors='coerce')
-            coste_total = float(coste.sum())
-            if pd.isna(coste_total):
-                coste_total = 0
-        
-        result = {
-            'comunidades': df['COMUNIDAD_ATENCION'].value_counts().to_dict() if 'COMUNIDAD_ATENCION' in df.columns else {},
-            'sexos': df['SEXO'].value_counts().to_dict() if 'SEXO' in df.columns else {},
-            'categorias': df['CATEGORIA_DIAGNOSTICO'].value_counts().to_dict() if 'CATEGORIA_DIAGNOSTICO' in df.columns else {},
-            'ingresos_por_mes': df['MES_INGRESO'].value_counts().sort_index().to_dict() if 'MES_INGRESO' in df.columns else {},
-            'estancia_promedio': estancia_promedio,
-            'coste_total': coste_total,
-            'ingresos_uci': ingresos_uci_dict,
-            'pacientes_uci': pacientes_uci,
-            'dias_uci_promedio': dias_uci_promedio
-        }
-        
         return jsonify(result)
         
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -462,56 +443,78 @@ def get_data():
 @login_required
 def get_table_data():
     try:
-        page = int(request.args.get('page', 1))
+        page = max(int(request.args.get('page', 1)), 1)
         per_page = int(request.args.get('per_page', 10))
+        per_page = min(max(per_page, 1), app.config['TABLE_MAX_PER_PAGE'])
+        
+        filters = parse_filters(request.args)
+        token = request.args.get('cursor')
+        keyset = bool(token) or request.args.get('mode') == 'keyset'
+        
+        # Snapshot local: misma respuesta sin pasar por Oracle
+        tabla = dashboard_snapshot.get_table()
+        if tabla is not None and dashboard_snapshot.can_serve(filters):
+            if keyset:
+                try:
+                    items, next_cursor, prev_cursor = dashboard_snapshot.keyset_page(tabla, filters, per_page, token)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                result = {'items': items, 'per_page': per_page, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+                if request.args.get('total', 'none') != 'none':
+                    result['total'] = dashboard_snapshot.count(tabla, filters)
+                    result['total_approx'] = False
+                return jsonify(result)
+            
+            items, total = dashboard_snapshot.page(tabla, filters, page, per_page)
+            return jsonify({
+                'items': items,
+                'total': total,
+                'pages': (total + per_page - 1) // per_page,
+                'current_page': page
+            })
         
         conn = get_connection()
         cursor = conn.cursor()
         
-        count_query = 'SELECT COUNT(*) FROM VISTA_DASHBOARD WHERE 1=1'
-        data_query = 'SELECT * FROM (SELECT a.*, ROWNUM rnum FROM (SELECT * FROM VISTA_DASHBOARD WHERE 1=1'
-        params = []
-        
-        filter_clause = ''
-        comunidad = request.args.get('comunidad')
-        if comunidad:
-            filter_clause += ' AND comunidad_atencion = :1'
-            params.append(comunidad)
-        
-        sexo = request.args.get('sexo')
-        if sexo:
-            filter_clause += f' AND sexo = :{len(params) + 1}'
-            params.append(sexo)
-        
-        categoria = request.args.get('categoria')
-        if categoria:
-            filter_clause += f' AND categoria_diagnostico = :{len(params) + 1}'
-            params.append(categoria)
-        
-        fecha_inicio = request.args.get('fecha_inicio')
-        if fecha_inicio:
-            filter_clause += f' AND fecha_ingreso >= :{len(params) + 1}'
-            params.append(fecha_inicio)
-        
-        fecha_fin = request.args.get('fecha_fin')
-        if fecha_fin:
-            filter_clause += f' AND fecha_ingreso <= :{len(params) + 1}'
-            params.append(fecha_fin)
-        
-        count_query += filter_clause
-        if params:
+        filter_clause, params = build_filter_clause(filters)
+        count_query = TABLE_COUNT_QUERY.format(filtros=filter_clause)
+        
+        def count():
+            set_filter_input_sizes(cursor, params)
             cursor.execute(count_query, params)
-        else:
-            cursor.execute(count_query)
-        total = cursor.fetchone()[0]
+            return cursor.fetchone()[0]
+        
+        # Modo keyset: paginación por cursor, el total es opcional ('exact', 'approx' o 'none')
+        if keyset:
+            try:
+                columns, rows, next_cursor, prev_cursor = fetch_keyset_page(cursor, filters, per_page, token)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            result = {
+                'items': [dict(zip(columns, row)) for row in rows],
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor
+            }
+            
+            total_mode = request.args.get('total', 'none')
+            if total_mode == 'exact':
+                result['total'] = result_cache.get_or_set('table_count', filter_key(filters), count)
+                result['total_approx'] = False
+            elif total_mode == 'approx':
+                result['total'] = explain_plan(cursor, count_query.replace('COUNT(*)', '*', 1), params)['cardinality']
+                result['total_approx'] = True
+            
+            cursor.close()
+            return jsonify(result)
         
-        offset = (page - 1) * per_page
-        data_query += filter_clause + f') a WHERE ROWNUM <= {offset + per_page}) WHERE rnum > {offset}'
+        total = result_cache.get_or_set('table_count', filter_key(filters), count)
         
-        if params:
-            cursor.execute(data_query, params)
-        else:
-            cursor.execute(data_query)
+        offset = (page - 1) * per_page
+        set_filter_input_sizes(cursor, params)
+        cursor.execute(TABLE_PAGE_QUERY.format(filtros=filter_clause),
+                       dict(params, max_fila=offset + per_page, min_fila=offset))
         
         columns = [desc[0] for desc in cursor.description if desc[0] != 'RNUM']
         rows = cursor.fetchall()
@@ -522,7 +525,6 @@ def get_table_data():
             items.append(item)
         
         cursor.close()
-        conn.close()
         
         result = {
             'items': items,
@@ -532,73 +534,75 @@ def get_table_data():
         }
         
         return jsonify(result)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/export')
+@login_required
+def export_data():
+    """Exporta los datos filtrados en streaming (CSV o NDJSON)"""
+    formato = request.args.get('format', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Formato no soportado (usa csv o ndjson)'}), 400
+    
+    try:
+        cursor = get_connection().cursor()
+        filters = parse_filters(request.args)
+        chunks = stream_export(cursor, filters, formato, app.config['EXPORT_ARRAYSIZE'])
+        # Ejecuta la consulta antes de enviar cabeceras para poder devolver un 500 limpio
+        first_chunk = next(chunks, '')
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        yield first_chunk
+        yield from chunks
+    
+    if formato == 'csv':
+        mimetype = 'text/csv'
+        filename = 'datos_salud_mental.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = 'datos_salud_mental.ndjson'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @app.route('/table')
 @login_required
 def table_view():
+    return render_template('data_table.html')
+
+@app.route('/api/filtros')
+@login_required
+def filter_options_api():
+    """Opciones de los filtros, cacheadas en memoria y en el navegador (ETag/Cache-Control)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT nombre_comunidad FROM COMUNIDADES ORDER BY nombre_comunidad')
-        comunidades = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT DISTINCT sexo FROM INGRESOS WHERE sexo IS NOT NULL ORDER BY sexo')
-        sexos = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute('SELECT nombre_categoria FROM CATEGORIAS_DIAGNOSTICO ORDER BY nombre_categoria')
-        categorias = [row[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
-        
-        return render_template('data_table.html', comunidades=comunidades, sexos=sexos, categorias=categorias)
+        options, etag = filter_options.get(get_connection)
     except Exception as e:
-        return f"Error: {str(e)}", 500
+        return jsonify({'error': str(e)}), 500
+    
+    response = jsonify(options)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['LOOKUP_BROWSER_MAX_AGE']
+    return response.make_conditional(request)
 
 @app.route('/chat')
 @login_required
 def chat_view():
-    return render_template('chat.html')
+    return render_template('chat.html', chat_mode=app.config['CHAT_MODE'])
 
-@app.route('/api/chat', methods=['POST'])
-@login_required
-def chat_api():
-    try:
-        if not gemini_model:
-            return jsonify({'error': 'El servicio de IA no está configurado. Por favor, configura GOOGLE_API_KEY.'}), 500
-        
-        data = request.get_json()
-        question = data.get('question', '')
-        
-        if not question:
-            return jsonify({'error': 'Por favor, proporciona una pregunta.'}), 400
-        
-        # Obtener el esquema de la base de datos
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        ORACLE_USER = app.config['DB_USER']
-        
-        cursor.execute(f"""
-            SELECT table_name, column_name
-            FROM all_tab_columns
-            WHERE owner = UPPER('{ORACLE_USER}')
-            ORDER BY table_name, column_id
-        """)
-        
-        esquema = {}
-        for table, column in cursor:
-            esquema.setdefault(table, []).append(column)
-        
-        esquema_texto = "\n".join(
-            f"{tabla}({', '.join(columnas)})" for tabla, columnas in esquema.items()
-        )
-        
-        # Generar SQL con Gemini
-        prompt_sql = f"""
+def generate_sql(question, esquema_texto):
+    """Pide a Gemini la consulta SQL para la pregunta"""
+    prompt_sql = f"""
 Eres un asistente experto en SQL para Oracle. Genera solo la consulta SQL compatible con Oracle.
 Usa este esquema de base de datos:
 {esquema_texto}
@@ -615,25 +619,41 @@ IMPORTANTE:
 Pregunta del usuario:
 {question}
 """
-        
+    
+    with metrics.span('llm_sql'):
         raw_sql = gemini_model.generate_content(prompt_sql)
-        sql_generado = raw_sql.text.strip().strip("```sql").strip("```").strip()
-        sql_generado = sql_generado.replace(";", "")
-        sql_generado = sql_generado.replace("\n", " ").replace("\t", " ")
-        
-        # Ejecutar SQL
-        cursor.execute(sql_generado)
-        resultados = cursor.fetchall()
-        columnas = [col[0] for col in cursor.description]
-        
-        df = pd.DataFrame(resultados, columns=columnas)
-        texto_resultado = df.to_markdown(index=False)
-        
-        cursor.close()
-        conn.close()
-        
-        # Interpretar resultados con Gemini
-        prompt_explicacion = f"""
+    sql_generado = raw_sql.text.strip().strip("```sql").strip("```").strip()
+    sql_generado = sql_generado.replace(";", "")
+    sql_generado = sql_generado.replace("\n", " ").replace("\t", " ")
+    return sql_generado
+
+def run_chat_query(sql_generado):
+    """
+    Ejecuta el SQL generado con límite de coste, filas y tiempo. Dentro de un
+    trabajo en segundo plano el tiempo no supera lo que le queda de plazo.
+    Returns: (DataFrame de resultados, resultados resumidos en markdown para el prompt)
+    """
+    chat_jobs.check_deadline()
+    timeout_ms = app.config['CHAT_SQL_TIMEOUT_MS']
+    restante = chat_jobs.remaining()
+    if restante is not None:
+        plazo_ms = max(1, int(restante * 1000))
+        timeout_ms = min(timeout_ms, plazo_ms) if timeout_ms else plazo_ms
+    
+    df, truncado, _ = run_guarded_query(
+        get_connection(),
+        sql_generado,
+        max_rows=app.config['CHAT_SQL_MAX_ROWS'],
+        max_cost=app.config['CHAT_SQL_MAX_COST'],
+        timeout_ms=timeout_ms
+    )
+    
+    texto_resultado = summarize_results(df, app.config['CHAT_PROMPT_MAX_ROWS'], truncado)
+    
+    return df, texto_resultado
+
+def build_explanation_prompt(question, texto_resultado):
+    return f"""
 Eres un analista especializado en salud mental que presenta datos a investigadores del sector sanitario.
 
 Pregunta original: {question}
@@ -651,17 +671,244 @@ Formato de respuesta:
 📊 DATOS: [Cifras principales]
 � ANÁLISIS: [Interpretación breve de los resultados]
 """
+
+def prepare_question(question):
+    """
+    Pasos previos a la explicación: esquema, caché y SQL.
+    Returns: (sql, schema_version, respuesta cacheada o None)
+    """
+    # Esquema de la base de datos (cacheado en memoria, solo tablas relevantes)
+    esquema_texto, schema_version = schema_cache.get_prompt_fragment(get_connection)
+    
+    # Respuesta (o SQL) ya calculada para la misma pregunta
+    cached = answer_cache.lookup(question, schema_version)
+    if cached:
+        return cached['sql'], schema_version, cached['answer']
+    
+    return generate_sql(question, esquema_texto), schema_version, None
+
+def answer_question(question):
+    """
+    Pipeline del chat: pregunta -> SQL generado -> resultados -> explicación.
+    Solo necesita un contexto de aplicación, así que sirve tanto para la ruta
+    síncrona como para los trabajos en segundo plano.
+    """
+    sql_generado, schema_version, cached_answer = prepare_question(question)
+    if cached_answer is not None:
+        return {
+            'answer': cached_answer,
+            'sql_query': sql_generado,
+            'cached': True
+        }
+    
+    _, texto_resultado = run_chat_query(sql_generado)
+    
+    # Interpretar resultados con Gemini
+    chat_jobs.check_deadline()
+    with metrics.span('llm_answer'):
+        response = gemini_model.generate_content(build_explanation_prompt(question, texto_resultado))
+    answer = response.text.strip()
+    
+    answer_cache.store(question, sql_generado, answer, schema_version)
+    
+    return {
+        'answer': answer,
+        'sql_query': sql_generado
+    }
+
+def sse_event(event, data):
+    """Formatea un evento server-sent events con datos JSON"""
+    payload = json.dumps(data, default=str, ensure_ascii=False)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+def stream_answer(question):
+    """
+    Versión en streaming del pipeline: emite el SQL y la tabla en cuanto están
+    disponibles y después los tokens de la explicación según llegan de Gemini.
+    """
+    try:
+        sql_generado, schema_version, cached_answer = prepare_question(question)
+        yield sse_event('sql', {'sql_query': sql_generado})
+        
+        if cached_answer is not None:
+            yield sse_event('done', {'answer': cached_answer, 'cached': True})
+            return
+        
+        df, texto_resultado = run_chat_query(sql_generado)
+        yield sse_event('table', {
+            'columns': list(df.columns),
+            'rows': dataframe_rows(df, app.config['CHAT_STREAM_TABLE_ROWS']),
+            'total_rows': len(df)
+        })
         
-        response = gemini_model.generate_content(prompt_explicacion)
-        answer = response.text.strip()
+        partes = []
+        inicio_llm = time.perf_counter()
+        response = gemini_model.generate_content(
+            build_explanation_prompt(question, texto_resultado), stream=True
+        )
+        for chunk in response:
+            if chunk.text:
+                partes.append(chunk.text)
+                yield sse_event('token', {'text': chunk.text})
+        
+        metrics.observe('llm_stream', time.perf_counter() - inicio_llm)
+        answer = ''.join(partes).strip()
+        answer_cache.store(question, sql_generado, answer, schema_version)
+        yield sse_event('done', {'answer': answer})
+    except Exception as e:
+        yield sse_event('error', {'error': str(e)})
+
+@app.route('/api/chat', methods=['POST'])
+@login_required
+def chat_api():
+    try:
+        if not gemini_model:
+            return jsonify({'error': 'El servicio de IA no está configurado. Por favor, configura GOOGLE_API_KEY.'}), 500
         
-        return jsonify({
-            'answer': answer,
-            'sql_query': sql_generado
-        })
+        data = request.get_json()
+        question = data.get('question', '')
         
+        if not question:
+            return jsonify({'error': 'Por favor, proporciona una pregunta.'}), 400
+        
+        return jsonify(answer_question(question))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Chat en streaming (text/event-stream): sql -> table -> token* -> done"""
+    if not gemini_model:
+        return jsonify({'error': 'El servicio de IA no está configurado. Por favor, configura GOOGLE_API_KEY.'}), 500
+    
+    data = request.get_json(silent=True) or {}
+    question = data.get('question', '')
+    
+    if not question:
+        return jsonify({'error': 'Por favor, proporciona una pregunta.'}), 400
+    
+    return Response(
+        stream_with_context(stream_answer(question)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/chat/jobs', methods=['POST'])
+@login_required
+def chat_job_submit():
+    """Encola una pregunta; el resultado se consulta en /api/chat/jobs/<job_id>"""
+    if not gemini_model:
+        return jsonify({'error': 'El servicio de IA no está configurado. Por favor, configura GOOGLE_API_KEY.'}), 500
+    
+    data = request.get_json(silent=True) or {}
+    question = data.get('question', '')
+    
+    if not question:
+        return jsonify({'error': 'Por favor, proporciona una pregunta.'}), 400
+    
+    try:
+        job_id = chat_jobs.submit(session.get('user_id'), answer_question, question)
+    except ChatJobError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+@app.route('/api/chat/jobs/<job_id>')
+@login_required
+def chat_job_status(job_id):
+    job = chat_jobs.get(job_id, session.get('user_id'))
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job)
+
+@app.route('/api/cache/stats')
+@admin_required
+def cache_stats():
+    return jsonify(result_cache.get_stats())
+
+@app.route('/api/chat/cache/stats')
+@admin_required
+def chat_cache_stats():
+    return jsonify(answer_cache.get_stats())
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+@admin_required
+def cache_invalidate():
+    """Invalida la caché tras una recarga de datos (opcionalmente solo un namespace)"""
+    data = request.get_json(silent=True) or {}
+    result_cache.invalidate(data.get('namespace'))
+    if data.get('namespace') is None:
+        filter_options.invalidate()
+        schema_cache.invalidate()
+        answer_cache.invalidate()
+        # El resto de workers lo ven al comparar la versión de datos
+        data_version.bump()
+    return jsonify({'success': True})
+
+@app.route('/api/hashing/stats')
+@admin_required
+def hashing_stats():
+    return jsonify(password_hasher.get_stats())
+
+@app.route('/api/email/stats')
+@admin_required
+def email_stats():
+    return jsonify(email_outbox.get_stats())
+
+@app.route('/api/ratelimit/stats')
+@admin_required
+def ratelimit_stats():
+    return jsonify(rate_limiter.get_stats())
+
+@app.route('/api/rollup/stats')
+@admin_required
+def rollup_stats():
+    try:
+        return jsonify(dashboard_rollup.get_stats(get_connection()))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/snapshot/stats')
+@admin_required
+def snapshot_stats():
+    return jsonify(dashboard_snapshot.get_stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus (protegidas con METRICS_TOKEN si está definido)"""
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('No autorizado\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/queries')
+@admin_required
+def slow_queries_view():
+    """Sentencias SQL más costosas y últimas consultas lentas con su plan"""
+    orden = request.args.get('orden', 'total_ms')
+    if orden not in ORDENES:
+        orden = 'total_ms'
+    return render_template(
+        'slow_queries.html',
+        stats=query_profiler.get_stats(orden, 100),
+        orden=orden,
+        ordenes=ORDENES
+    )
+
+@app.route('/api/queries/stats')
+@admin_required
+def slow_queries_stats():
+    orden = request.args.get('orden', 'total_ms')
+    if orden not in ORDENES:
+        return jsonify({'error': f'Orden no válido (usa {", ".join(ORDENES)})'}), 400
+    return jsonify(query_profiler.get_stats(orden))
+
+@app.route('/api/pool/stats')
+@admin_required
+def pool_stats():
+    return jsonify(db_pool.get_stats())
+
 if __name__ == '__main__':
     app.run(debug=True)
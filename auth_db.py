@@ -0,0 +1,56 @@
+import oracledb
+
+LOGIN_USER_QUERY = """
+    SELECT id_usuario, email, nombre, password_hash, verificado, bloqueado
+    FROM USUARIOS
+    WHERE email = :email AND activo = 1
+"""
+
+# Tras verificar el bcrypt en Python, cada resultado del login se resuelve en un único
+# bloque PL/SQL que actualiza y confirma en el mismo viaje de ida y vuelta.
+
+# Éxito: último acceso, reinicio de intentos y rehash opcional en una sola sentencia
+LOGIN_SUCCESS_BLOCK = """
+    BEGIN
+        UPDATE USUARIOS
+        SET ultimo_acceso = CURRENT_TIMESTAMP,
+            intentos_fallidos = 0,
+            password_hash = NVL(:new_hash, password_hash)
+        WHERE id_usuario = :id_usuario;
+        COMMIT;
+    END;
+"""
+
+# Fallo: incremento y bloqueo atómicos (la fila queda bloqueada durante el UPDATE)
+LOGIN_FAILURE_BLOCK = """
+    BEGIN
+        UPDATE USUARIOS
+        SET intentos_fallidos = intentos_fallidos + 1,
+            bloqueado = CASE WHEN intentos_fallidos + 1 >= :max_intentos THEN 1 ELSE bloqueado END
+        WHERE id_usuario = :id_usuario
+        RETURNING intentos_fallidos, bloqueado INTO :intentos, :bloqueado;
+        COMMIT;
+    END;
+"""
+
+def fetch_login_user(cursor, email):
+    """Returns: tuple|None - (id_usuario, email, nombre, password_hash, verificado, bloqueado)"""
+    cursor.execute(LOGIN_USER_QUERY, email=email)
+    return cursor.fetchone()
+
+def record_login_success(cursor, user_id, new_hash=None):
+    """Registra el acceso (y el nuevo hash si se ha recalculado) y confirma"""
+    cursor.execute(LOGIN_SUCCESS_BLOCK, new_hash=new_hash, id_usuario=user_id)
+
+def record_login_failure(cursor, user_id, max_attempts=5):
+    """
+    Suma un intento fallido y bloquea la cuenta al alcanzar max_attempts, y confirma.
+    Returns: (int, bool) - (intentos fallidos, bloqueado)
+    """
+    intentos = cursor.var(oracledb.DB_TYPE_NUMBER)
+    bloqueado = cursor.var(oracledb.DB_TYPE_NUMBER)
+    cursor.execute(
+        LOGIN_FAILURE_BLOCK,
+        max_intentos=max_attempts, id_usuario=user_id, intentos=intentos, bloqueado=bloqueado
+    )
+    return int(intentos.getvalue() or 0), bool(bloqueado.getvalue())
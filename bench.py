@@ -0,0 +1,936 @@
+"""
+Banco de pruebas de rendimiento de la aplicación.
+
+Arranca la app Flask en proceso con sustitutos locales de sus dependencias
+externas y mide throughput y latencias (p50/p99) de /api/data, /api/table,
+/api/chat, login y registro con varios hilos concurrentes. El escenario mixed
+mide /api/data mientras --chat-load hilos encadenan preguntas por /api/chat/jobs,
+abuse lanza fuerza bruta contra /login con el limitador activo y cuenta las
+sentencias SQL que cuesta cada intento rechazado, y replay repite preguntas del
+chat con la caché de respuestas activa y mide su tasa de aciertos:
+
+- Base de datos: DuckDB con el esquema que usa la app (VISTA_DASHBOARD,
+  USUARIOS) e ingresos sintéticos deterministas, detrás de un adaptador con la
+  interfaz de python-oracledb que traduce el dialecto Oracle de las consultas.
+  Con --backend oracle se usa la base configurada en .env (p. ej. un contenedor
+  Oracle Free ya cargado) y solo se crean los usuarios de prueba.
+  Por escenario se cuentan las sentencias SQL distintas (DuckDB) o los parses
+  de v$sysstat (Oracle, requiere SELECT sobre v$sysstat).
+- Gemini: modelo que devuelve un SQL y una explicación fijos con latencia configurable.
+- SMTP: servidor local que acepta y descarta los mensajes.
+
+Uso:
+    python bench.py --rows 10k,1m,10m --requests 200 --concurrency 8
+    python bench.py --rows 1m --db-dir /tmp/bench --json resultados.json
+    python bench.py --rows 1m --db-dir /tmp/bench --baseline resultados.json  # sale con 1 si hay regresión
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DOMAIN = 'bench.local'
+BENCH_PASSWORD = 'Bench#2024pass'
+
+COMUNIDADES = [
+    'Andalucía', 'Aragón', 'Asturias', 'Baleares', 'Canarias', 'Cantabria', 'Castilla y León',
+    'Castilla-La Mancha', 'Cataluña', 'Comunidad Valenciana', 'Extremadura', 'Galicia', 'Madrid',
+    'Murcia', 'Navarra', 'País Vasco', 'La Rioja'
+]
+CATEGORIAS = [
+    'Trastornos del estado de ánimo', 'Esquizofrenia y trastornos psicóticos', 'Trastornos de ansiedad',
+    'Trastornos por consumo de sustancias', 'Trastornos de la personalidad',
+    'Trastornos de la conducta alimentaria'
+]
+
+# Filtros que rotan las peticiones del dashboard y de la tabla
+FILTROS_BENCH = [
+    {},
+    {'comunidad': 'Madrid'},
+    {'sexo': 'M', 'categoria': 'Trastornos de ansiedad'},
+    {'fecha_inicio': '2021-01-01', 'fecha_fin': '2021-12-31'},
+    {'comunidad': 'Andalucía', 'fecha_inicio': '2023-06-01'},
+]
+
+# ========== DuckDB con la interfaz de python-oracledb ==========
+
+# Ingresos sintéticos: h(i, semilla, n) da valores reproducibles e independientes entre columnas
+# (hash(i, semilla) no sirve: su bit bajo está correlacionado entre semillas)
+GENERAR_INGRESOS = """
+    CREATE TABLE VISTA_DASHBOARD AS
+    SELECT id, comunidad_atencion, sexo, categoria_diagnostico, fecha_ingreso,
+           strftime(fecha_ingreso, '%Y-%m') AS mes_ingreso, estancia_dias, coste_apr, dias_uci
+    FROM (
+        SELECT i AS id,
+               CASE WHEN h(i, 1, 50) = 0 THEN NULL
+                    ELSE {comunidades}[1 + h(i, 2, {n_comunidades})] END AS comunidad_atencion,
+               CASE WHEN h(i, 3, 100) = 0 THEN NULL WHEN h(i, 4, 2) = 0 THEN 'H' ELSE 'M' END AS sexo,
+               {categorias}[1 + h(i, 5, {n_categorias})] AS categoria_diagnostico,
+               CASE WHEN h(i, 6, 50) = 0 THEN NULL
+                    ELSE TIMESTAMP '2018-01-01' + to_days(CAST(h(i, 7, 2557) AS INTEGER)) END AS fecha_ingreso,
+               CASE WHEN h(i, 8, 20) = 0 THEN NULL ELSE CAST(1 + h(i, 9, 60) AS DOUBLE) END AS estancia_dias,
+               CASE WHEN h(i, 10, 10) = 0 THEN NULL ELSE h(i, 11, 1000000) / 100.0 END AS coste_apr,
+               CASE WHEN h(i, 12, 10) = 0 THEN CAST(1 + h(i, 13, 20) AS DOUBLE) ELSE 0 END AS dias_uci
+        FROM range({filas}) t(i)
+    )
+"""
+
+ESQUEMA_DUCKDB = [
+    'CREATE MACRO nvl(a, b) AS coalesce(a, b)',
+    'CREATE MACRO h(i, semilla, n) AS CAST(hash(i * 16 + semilla) % n AS BIGINT)',
+    'CREATE SEQUENCE usuarios_seq',
+    """CREATE TABLE USUARIOS (
+        id_usuario INTEGER DEFAULT nextval('usuarios_seq') PRIMARY KEY,
+        email VARCHAR UNIQUE, nombre VARCHAR, apellidos VARCHAR, password_hash VARCHAR,
+        verificado INTEGER DEFAULT 0, token_verificacion VARCHAR, token_expiracion TIMESTAMP,
+        ultimo_acceso TIMESTAMP, intentos_fallidos INTEGER DEFAULT 0, bloqueado INTEGER DEFAULT 0,
+        activo INTEGER DEFAULT 1
+    )""",
+    'CREATE TABLE plan_table (statement_id VARCHAR, id INTEGER, cost DOUBLE, cardinality DOUBLE, bytes DOUBLE)',
+    # Diccionario de datos mínimo para el esquema del prompt del chat (owner = DB_USER)
+    """CREATE VIEW all_tab_columns AS
+       SELECT 'BENCH' AS owner, upper(table_name) AS table_name, upper(column_name) AS column_name,
+              ordinal_position AS column_id
+       FROM information_schema.columns""",
+]
+
+_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_BIND = re.compile(r'(?<![\w:]):(\w+)')
+_DOLLAR = re.compile(r'\$(\w+)')
+_TRUNC = re.compile(r"TRUNC\(([^,()]+),\s*'(DD|MM)'\)", re.IGNORECASE)
+_ROWNUM_LIMIT = re.compile(r'WHERE\s+ROWNUM\s*<=\s*(\d+|\$\w+)', re.IGNORECASE)
+_ROWNUM_COLUMN = re.compile(r'\bROWNUM\s+(\w+)', re.IGNORECASE)
+_SYSTIMESTAMP = re.compile(r'\bSYSTIMESTAMP\b', re.IGNORECASE)
+_EXPLAIN = re.compile(r"^\s*EXPLAIN PLAN SET STATEMENT_ID = '(\w+)' FOR ", re.IGNORECASE)
+_RETURNING = re.compile(r'\bRETURNING\s+(.+?)\s+INTO\s+(.+)$', re.IGNORECASE | re.DOTALL)
+_DML = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+def oracle_to_duckdb(sql):
+    """Traduce el dialecto Oracle de la app: binds :n/:nombre, ROWNUM, TRUNC de fechas y SYSTIMESTAMP"""
+    sql = _TRUNC.sub(
+        lambda m: f"date_trunc('{'day' if m.group(2).upper() == 'DD' else 'month'}', {m.group(1)})", sql
+    )
+    partes = _LITERAL.split(sql)
+    for i in range(0, len(partes), 2):  # Los índices impares son literales entre comillas
+        parte = _BIND.sub(r'$\1', partes[i])
+        parte = _ROWNUM_LIMIT.sub(r'LIMIT \1', parte)
+        parte = _ROWNUM_COLUMN.sub(r'row_number() OVER () AS \1', parte)
+        partes[i] = _SYSTIMESTAMP.sub('current_timestamp', parte)
+    return ''.join(partes)
+
+class DuckDBVar:
+    """Variable de salida (cursor.var) para los RETURNING ... INTO de los bloques PL/SQL"""
+
+    def __init__(self):
+        self.value = None
+
+    def getvalue(self, pos=0):
+        return self.value
+
+    def setvalue(self, pos, value):
+        self.value = value
+
+class ArrowFrame:
+    """Imita el DataFrame de python-oracledb 3: num_rows() y la interfaz PyCapsule de Arrow"""
+
+    def __init__(self, tabla):
+        self._tabla = tabla
+
+    def num_rows(self):
+        return self._tabla.num_rows
+
+    def column_names(self):
+        return self._tabla.column_names
+
+    def __arrow_c_stream__(self, requested_schema=None):
+        return self._tabla.__arrow_c_stream__(requested_schema)
+
+# Tipos de DuckDB -> (tipo de oracledb, precisión, escala) de cursor.description
+TIPOS_ORACLE = {
+    'BIGINT': ('DB_TYPE_NUMBER', 18, 0),
+    'INTEGER': ('DB_TYPE_NUMBER', 10, 0),
+    'SMALLINT': ('DB_TYPE_NUMBER', 5, 0),
+    'DOUBLE': ('DB_TYPE_NUMBER', 0, -127),  # NUMBER sin precisión, como las medidas de la vista
+    'FLOAT': ('DB_TYPE_NUMBER', 0, -127),
+    'VARCHAR': ('DB_TYPE_VARCHAR', None, None),
+    'DATE': ('DB_TYPE_DATE', None, None),
+    'TIMESTAMP': ('DB_TYPE_TIMESTAMP', None, None),
+    'BOOLEAN': ('DB_TYPE_BOOLEAN', None, None),
+}
+
+def oracle_description(columna):
+    """Entrada de cursor.description con nombre en mayúsculas y tipo de oracledb"""
+    import oracledb
+    nombre, tipo = columna[0].upper(), str(columna[1])
+    if tipo not in TIPOS_ORACLE:
+        return (nombre,) + tuple(columna[1:])
+    tipo_oracle, precision, escala = TIPOS_ORACLE[tipo]
+    return (nombre, getattr(oracledb, tipo_oracle), None, None, precision, escala, True)
+
+class DuckDBCursor:
+    """Cursor con la interfaz de oracledb; cada uno usa su propia conexión DuckDB (autocommit)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 100
+        self.prefetchrows = 2
+        self.outputtypehandler = None
+        self.description = None
+        self.rowcount = 0
+        self._con = connection._db.cursor()
+
+    def var(self, tipo, arraysize=None):
+        return DuckDBVar()
+
+    def setinputsizes(self, *args, **kwargs):
+        pass  # DuckDB deduce el tipo de cada parámetro del valor enlazado
+
+    def execute(self, statement, parameters=None, **kwargs):
+        parameters = kwargs or parameters
+        if statement.lstrip().upper().startswith('BEGIN'):
+            return self._execute_block(statement, parameters)
+        explain = _EXPLAIN.match(statement)
+        if explain:
+            # Sin optimizador de Oracle: el plan queda sin coste ni cardinalidad estimados
+            return self._run('INSERT INTO plan_table VALUES (:1, 0, NULL, NULL, NULL)', [explain.group(1)])
+        return self._run(statement, parameters)
+
+    def executemany(self, statement, parameters):
+        self.connection.count_statement(statement)
+        self._con.executemany(oracle_to_duckdb(statement), parameters)
+        self.rowcount = len(parameters)
+        self.description = None
+
+    def _run(self, statement, parameters):
+        self.connection.count_statement(statement)
+        sql = oracle_to_duckdb(statement)
+        if isinstance(parameters, dict):
+            usados = set(_DOLLAR.findall(sql))
+            parameters = {
+                nombre: valor.getvalue() if isinstance(valor, DuckDBVar) else valor
+                for nombre, valor in parameters.items() if nombre in usados
+            }
+        self._con.execute(sql, parameters or [])
+        if _DML.match(sql) and not _RETURNING.search(statement):
+            self.rowcount = self._con.fetchone()[0]
+            self.description = None
+        else:
+            self.rowcount = 0
+            self.description = [oracle_description(d) for d in self._con.description or []] or None
+
+    def _execute_block(self, statement, parameters):
+        """BEGIN ... END; de auth_db: ejecuta cada sentencia y vuelca RETURNING ... INTO en las variables"""
+        cuerpo = re.sub(r'^\s*BEGIN|END;\s*$', '', statement.strip(), flags=re.IGNORECASE)
+        for sentencia in cuerpo.split(';'):
+            sentencia = sentencia.strip()
+            if not sentencia or sentencia.upper() == 'COMMIT':
+                continue
+            returning = _RETURNING.search(sentencia)
+            if returning is None:
+                self._run(sentencia, parameters)
+                continue
+            self._run(f'{sentencia[:returning.start()]} RETURNING {returning.group(1)}', parameters)
+            fila = self._con.fetchone()
+            for destino, valor in zip(returning.group(2).split(','), fila or itertools.repeat(None)):
+                parameters[destino.strip().lstrip(':')].setvalue(0, valor)
+
+    def fetchone(self):
+        return self._con.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._con.fetchmany(size or self.arraysize)
+
+    def fetchall(self):
+        return self._con.fetchall()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._con.close()
+
+class DuckDBConnection:
+    """Conexión con la interfaz de oracledb usada por la app (cursor, commit, fetch_df_*)"""
+
+    def __init__(self, db, pool=None):
+        self._db = db
+        self._pool = pool
+        self.call_timeout = 0
+        self.stmtcachesize = 20
+
+    def count_statement(self, statement):
+        if self._pool is not None:
+            self._pool.count_statement(statement)
+
+    def cursor(self):
+        return DuckDBCursor(self)
+
+    def commit(self):
+        pass  # DuckDB en autocommit: cada sentencia se confirma al ejecutarse
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _arrow_reader(self, statement, parameters, size):
+        cursor = DuckDBCursor(self)
+        cursor._run(statement, parameters)
+        # to_arrow_reader en DuckDB >= 1.4, fetch_record_batch en versiones anteriores
+        lector = getattr(cursor._con, 'to_arrow_reader', None) or cursor._con.fetch_record_batch
+        return lector(size)
+
+    def fetch_df_all(self, statement, parameters=None, arraysize=None):
+        tabla = self._arrow_reader(statement, parameters, arraysize or 100000).read_all()
+        return ArrowFrame(tabla.rename_columns([c.upper() for c in tabla.column_names]))
+
+    def fetch_df_batches(self, statement, parameters=None, size=None):
+        import pyarrow as pa
+        for lote in self._arrow_reader(statement, parameters, size or 100000):
+            nombres = [c.upper() for c in lote.schema.names]
+            yield ArrowFrame(pa.Table.from_batches([pa.RecordBatch.from_arrays(lote.columns, names=nombres)]))
+
+class DuckDBPool:
+    """
+    Sustituto de oracledb.ConnectionPool: cada acquire es una conexión a la misma
+    base. Cuenta las ejecuciones por texto SQL, el equivalente a los cursores
+    compartidos que Oracle parsea una vez por texto distinto.
+    """
+
+    def __init__(self, db, size):
+        self._db = db
+        self._lock = threading.Lock()
+        self.min = self.max = size
+        self.increment = 0
+        self.timeout = 0
+        self.wait_timeout = 0
+        self.opened = size
+        self.busy = 0
+        self.statements = Counter()
+
+    def count_statement(self, statement):
+        with self._lock:
+            self.statements[statement] += 1
+
+    def acquire(self):
+        with self._lock:
+            self.busy += 1
+        return DuckDBConnection(self._db, self)
+
+    def release(self, conn):
+        with self._lock:
+            self.busy -= 1
+
+    def drop(self, conn):
+        self.release(conn)
+
+def open_duckdb(filas, directorio=None):
+    """
+    Base DuckDB con el esquema de la app y filas ingresos sintéticos. Con
+    directorio se guarda en bench_<filas>.duckdb y se reutiliza entre ejecuciones.
+    Returns: (conexión duckdb, segundos de generación o None si se reutiliza)
+    """
+    import duckdb  # Dependencia opcional, solo necesaria para el banco de pruebas
+
+    ruta = os.path.join(directorio, f'bench_{filas}.duckdb') if directorio else ':memory:'
+    if ruta != ':memory:' and os.path.exists(ruta):
+        db = duckdb.connect(ruta)
+        if db.execute('SELECT COUNT(*) FROM VISTA_DASHBOARD').fetchone()[0] == filas:
+            return db, None
+        db.close()
+        os.remove(ruta)
+
+    start = time.perf_counter()
+    db = duckdb.connect(ruta)
+    for sentencia in ESQUEMA_DUCKDB:
+        db.execute(sentencia)
+    lista = lambda valores: '[' + ', '.join("'" + v.replace("'", "''") + "'" for v in valores) + ']'
+    db.execute(GENERAR_INGRESOS.format(
+        filas=filas,
+        comunidades=lista(COMUNIDADES), n_comunidades=len(COMUNIDADES),
+        categorias=lista(CATEGORIAS), n_categorias=len(CATEGORIAS)
+    ))
+    return db, time.perf_counter() - start
+
+# ========== Gemini y SMTP locales ==========
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+class StubGeminiModel:
+    """Sustituto de genai.GenerativeModel: SQL y explicación fijos tras una latencia configurable"""
+
+    SQL = ('SELECT comunidad_atencion, COUNT(*) AS ingresos, AVG(estancia_dias) AS estancia_media '
+           'FROM VISTA_DASHBOARD GROUP BY comunidad_atencion ORDER BY ingresos DESC')
+    ANSWER = ('📊 DATOS: Madrid y Andalucía concentran el mayor número de ingresos. '
+              '🔍 ANÁLISIS: La estancia media es similar entre comunidades.')
+
+    def __init__(self, latency=0.0, chunks=20):
+        self.latency = latency
+        self.chunks = chunks
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        texto = self.SQL if 'Genera solo la consulta SQL' in prompt else self.ANSWER
+        if not stream:
+            time.sleep(self.latency)
+            return _StubResponse(texto)
+        return self._stream(texto)
+
+    def _stream(self, texto):
+        paso = max(1, len(texto) // self.chunks)
+        for i in range(0, len(texto), paso):
+            time.sleep(self.latency / self.chunks)
+            yield _StubResponse(texto[i:i + paso])
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Diálogo SMTP mínimo para smtplib: EHLO, AUTH PLAIN, MAIL, RCPT, DATA y QUIT"""
+
+    def _reply(self, linea):
+        self.wfile.write(linea.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self._reply('220 bench ESMTP')
+        for linea in self.rfile:
+            comando = linea.decode('utf-8', 'replace').strip().upper()
+            if comando.startswith('EHLO'):
+                self._reply('250-bench')
+                self._reply('250 AUTH PLAIN')
+            elif comando.startswith('AUTH'):
+                self._reply('235 Authentication successful')
+            elif comando == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                for dato in self.rfile:
+                    if dato in (b'.\r\n', b'.\n'):
+                        break
+                self.server.count_message()
+                self._reply('250 OK')
+            elif comando == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """Servidor SMTP local en un puerto libre que cuenta y descarta los mensajes"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+# ========== Escenarios ==========
+
+def _scenario_data(cliente, i):
+    r = cliente.get('/api/data', query_string=FILTROS_BENCH[i % len(FILTROS_BENCH)])
+    return r.status_code == 200 and 'error' not in r.get_json()
+
+def _scenario_table(cliente, i):
+    filtros = dict(FILTROS_BENCH[i % len(FILTROS_BENCH)], page=1 + i % 20, per_page=50)
+    r = cliente.get('/api/table', query_string=filtros)
+    return r.status_code == 200 and 'error' not in r.get_json()
+
+def _scenario_chat(cliente, i):
+    # Preguntas distintas para que cada petición recorra el pipeline completo
+    r = cliente.post('/api/chat', json={'question': f'¿Cuántos ingresos hay por comunidad? ({i})'})
+    return r.status_code == 200 and 'answer' in r.get_json()
+
+def _scenario_login(cliente, i, usuarios):
+    r = cliente.post('/login', data={'username': f'usuario{i % usuarios}@{BENCH_DOMAIN}', 'password': BENCH_PASSWORD})
+    return r.status_code == 302 and not r.headers['Location'].startswith('/login')
+
+def _scenario_register(cliente, i, ejecucion):
+    r = cliente.post('/register', data={
+        'nombre': 'Bench', 'apellidos': 'Carga', 'email': f'nuevo{ejecucion}-{i}@{BENCH_DOMAIN}',
+        'password': BENCH_PASSWORD, 'password_confirm': BENCH_PASSWORD
+    })
+    return r.status_code == 302 and '/verify/' in r.headers['Location']
+
+def _scenario_chat_job(cliente, i, espera=0.02):
+    """Pregunta por /api/chat/jobs y sondea hasta que el trabajo termina"""
+    r = cliente.post('/api/chat/jobs', json={'question': f'¿Cuántos ingresos hay por sexo? ({i})'})
+    if r.status_code != 202:
+        return False
+    url = f"/api/chat/jobs/{r.get_json()['job_id']}"
+    while True:
+        estado = cliente.get(url).get_json()
+        if estado.get('status') not in ('queued', 'running'):
+            return estado.get('status') == 'done'
+        time.sleep(espera)
+
+class ChatJobLoad:
+    """
+    Carga de fondo para el escenario mixed: hilos que encadenan preguntas al chat
+    en segundo plano, cada uno con su propio usuario para no chocar con
+    CHAT_JOBS_PER_USER, mientras se mide el dashboard.
+    """
+
+    def __init__(self, app, hilos):
+        self.app = app
+        self.hilos = hilos
+        self.completados = 0
+        self.fallidos = 0
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _trabajador(self, usuario):
+        cliente = self.app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion.update(logged_in=True, username=f'chat{usuario}', user_id=1000 + usuario, is_admin=False)
+        for i in itertools.count():
+            if self._parar.is_set():
+                return
+            try:
+                ok = _scenario_chat_job(cliente, usuario * 1_000_000 + i)
+            except Exception:
+                ok = False
+            with self._lock:
+                self.completados += ok
+                self.fallidos += not ok
+            if not ok:
+                time.sleep(0.05)  # Cola llena: no martillear el endpoint
+
+    def __enter__(self):
+        for usuario in range(self.hilos):
+            hilo = threading.Thread(target=self._trabajador, args=(usuario,), daemon=True)
+            hilo.start()
+            self._threads.append(hilo)
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        for hilo in self._threads:
+            hilo.join()
+
+# Fuerza bruta del escenario abuse: pocas IPs (X-Forwarded-For) contra pocos emails
+ABUSE_IPS = 4
+ABUSE_EMAILS = 4
+
+def _scenario_abuse(cliente, i, solo_rechazos):
+    r = cliente.post(
+        '/login',
+        data={'username': f'usuario{i % ABUSE_EMAILS}@{BENCH_DOMAIN}', 'password': 'incorrecta'},
+        headers={'X-Forwarded-For': f'198.51.100.{i % ABUSE_IPS}'}
+    )
+    # Una vez agotados los límites todo intento debe acabar en 429
+    return r.status_code == 429 if solo_rechazos else r.status_code in (200, 429)
+
+def run_abuse(app, db_pool, rate_limiter, requests, concurrency):
+    """
+    Activa el limitador (el resto de escenarios lo desactivan) y agota los límites
+    de login de ABUSE_IPS IPs y ABUSE_EMAILS emails. Después mide requests
+    intentos más: todos deben ser 429 y no ejecutar ninguna sentencia SQL.
+    Returns: dict - como run_scenario más sentencias por rechazo
+    """
+    from rate_limit import MemoryRateLimitStore
+
+    rate_limiter.enabled, rate_limiter.store = True, MemoryRateLimitStore()
+    try:
+        (limite_ip, _), (limite_email, _) = rate_limiter.rules['login']['ip'], rate_limiter.rules['login']['email']
+        saturar = 2 * max(limite_ip * ABUSE_IPS, limite_email * ABUSE_EMAILS)
+        run_scenario(app, lambda c, i: _scenario_abuse(c, i, False), saturar, concurrency, autenticado=False)
+
+        antes = statement_counters(app, db_pool)
+        resultado = run_scenario(app, lambda c, i: _scenario_abuse(c, i, True), requests, concurrency,
+                                 autenticado=False)
+        resultado.update(statement_delta(antes, statement_counters(app, db_pool)))
+    finally:
+        rate_limiter.enabled = False
+    rechazados = resultado['requests'] - resultado['errors']
+    if 'executions' in resultado and rechazados:
+        resultado['statements_per_rejection'] = round(resultado['executions'] / rechazados, 3)
+    return resultado
+
+# Preguntas del escenario replay: cada grupo es una pregunta con variantes que solo
+# cambian mayúsculas, tildes o puntuación (aciertos exactos tras normalizar) y una
+# paráfrasis al final (solo acierta con CHAT_CACHE_SIMILARITY > 0)
+REPLAY_QUESTIONS = [
+    ['¿Cuántos ingresos hay por comunidad?', 'cuantos ingresos hay por comunidad',
+     'CUÁNTOS INGRESOS HAY POR COMUNIDAD??', '¿Cuántos ingresos hay en cada comunidad?'],
+    ['¿Cuál es la estancia media por sexo?', 'cual es la estancia media por sexo',
+     '¿Cuál es la estancia media, por sexo?', '¿Cuál es la estancia media según el sexo?'],
+    ['¿Qué categoría diagnóstica tiene más ingresos?', 'que categoria diagnostica tiene mas ingresos',
+     '¿Qué categoría diagnóstica tiene más ingresos?!', '¿Qué categoría de diagnóstico tiene más ingresos?'],
+    ['¿Cuál es el coste total por comunidad?', 'cual es el coste total por comunidad',
+     '¿CUÁL es el coste total por comunidad?', '¿Cuál es el coste total en cada comunidad?'],
+    ['¿Cuántos pacientes pasaron por la UCI?', 'cuantos pacientes pasaron por la uci',
+     '¿Cuántos pacientes pasaron por la UCI...?', '¿Cuántos pacientes estuvieron en la UCI?'],
+    ['¿Cómo evolucionan los ingresos por mes?', 'como evolucionan los ingresos por mes',
+     '¿Cómo evolucionan los ingresos, por mes?', '¿Cómo evolucionan los ingresos cada mes?'],
+]
+
+def load_replay_questions(ruta=None):
+    """Preguntas a repetir: una por línea de ruta (p. ej. un log real) o las de REPLAY_QUESTIONS"""
+    if ruta:
+        with open(ruta, encoding='utf-8') as f:
+            return [linea.strip() for linea in f if linea.strip()]
+    # Se recorren todos los grupos antes de pasar a la siguiente variante
+    return [grupo[v] for v in range(max(map(len, REPLAY_QUESTIONS)))
+            for grupo in REPLAY_QUESTIONS if v < len(grupo)]
+
+def run_replay(app, answer_cache, llm, preguntas, requests, concurrency, similarity):
+    """
+    Repite requests preguntas (en bucle sobre preguntas) por /api/chat con la caché
+    de respuestas en modo 'answer', aunque el resto de escenarios la desactive.
+    Returns: dict - como run_scenario más aciertos, fallos y llamadas al LLM
+    """
+    modo, umbral = answer_cache.mode, answer_cache.similarity
+    answer_cache.mode, answer_cache.similarity = 'answer', similarity
+    answer_cache.invalidate()
+    antes, llamadas = dict(answer_cache.stats), llm.calls
+
+    def peticion(cliente, i):
+        r = cliente.post('/api/chat', json={'question': preguntas[i % len(preguntas)]})
+        return r.status_code == 200 and 'answer' in r.get_json()
+
+    try:
+        resultado = run_scenario(app, peticion, requests, concurrency)
+    finally:
+        answer_cache.mode, answer_cache.similarity = modo, umbral
+    delta = {clave: answer_cache.stats[clave] - antes[clave] for clave in ('exact_hits', 'similar_hits', 'misses')}
+    consultas = sum(delta.values())
+    resultado.update(delta)
+    resultado['hit_rate'] = round((delta['exact_hits'] + delta['similar_hits']) / consultas, 3) if consultas else 0
+    resultado['llm_calls'] = llm.calls - llamadas
+    return resultado
+
+# mixed: el escenario data medido con ChatJobLoad de fondo
+# abuse: login con el limitador activo, ver run_abuse
+# replay: chat con la caché de respuestas activa, ver run_replay
+SCENARIOS = ['data', 'table', 'chat', 'login', 'register', 'mixed', 'abuse', 'replay']
+
+def percentile(valores_ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not valores_ordenados:
+        return 0.0
+    return valores_ordenados[min(len(valores_ordenados) - 1, math.ceil(p / 100 * len(valores_ordenados)) - 1)]
+
+def run_scenario(app, peticion, requests, concurrency, warmup=0, autenticado=True):
+    """
+    Lanza requests peticiones repartidas entre concurrency hilos, cada uno con su
+    cliente de pruebas (y sesión iniciada si autenticado).
+    Returns: dict - peticiones, errores, throughput y latencias en ms
+    """
+    def nuevo_cliente():
+        cliente = app.test_client()
+        if autenticado:
+            with cliente.session_transaction() as sesion:
+                sesion.update(logged_in=True, username='bench', user_id=1, is_admin=False)
+        return cliente
+
+    cliente = nuevo_cliente()
+    for i in range(warmup):
+        peticion(cliente, requests + i)
+
+    contador = itertools.count()
+
+    def trabajador():
+        cliente = nuevo_cliente()
+        tiempos, errores = [], 0
+        while True:
+            i = next(contador)
+            if i >= requests:
+                return tiempos, errores
+            start = time.perf_counter()
+            try:
+                ok = peticion(cliente, i)
+            except Exception:
+                ok = False
+            tiempos.append(time.perf_counter() - start)
+            errores += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        resultados = [f.result() for f in [executor.submit(trabajador) for _ in range(concurrency)]]
+    duracion = time.perf_counter() - start
+
+    tiempos = sorted(t for parcial, _ in resultados for t in parcial)
+    return {
+        'requests': len(tiempos),
+        'errors': sum(errores for _, errores in resultados),
+        'throughput_rps': round(len(tiempos) / duracion, 1),
+        'mean_ms': round(sum(tiempos) / len(tiempos) * 1000, 2),
+        'p50_ms': round(percentile(tiempos, 50) * 1000, 2),
+        'p99_ms': round(percentile(tiempos, 99) * 1000, 2),
+        'max_ms': round(tiempos[-1] * 1000, 2)
+    }
+
+def seed_users(app, db_pool, password_hash, usuarios):
+    """Recrea los usuarios de prueba (*@bench.local), verificados y con la misma contraseña"""
+    with app.app_context():
+        cursor = db_pool.get_connection().cursor()
+        cursor.execute('DELETE FROM USUARIOS WHERE email LIKE :1', [f'%@{BENCH_DOMAIN}'])
+        cursor.executemany(
+            'INSERT INTO USUARIOS (email, nombre, apellidos, password_hash, verificado) VALUES (:1, :2, :3, :4, 1)',
+            [[f'usuario{i}@{BENCH_DOMAIN}', f'Usuario {i}', 'Bench', password_hash] for i in range(usuarios)]
+        )
+        cursor.connection.commit()
+        cursor.close()
+
+# ========== Informe y comparación con una línea base ==========
+
+def parse_rows(valor):
+    """'10k,1m,10m' -> [10000, 1000000, 10000000]"""
+    multiplicadores = {'k': 1_000, 'm': 1_000_000}
+    filas = []
+    for parte in valor.lower().split(','):
+        parte = parte.strip()
+        factor = multiplicadores.get(parte[-1:], 1)
+        filas.append(int(float(parte.rstrip('km')) * factor))
+    return filas
+
+# Contadores de v$sysstat para el backend oracle
+ESTADISTICAS_PARSE = {
+    'parse count (total)': 'parses',
+    'parse count (hard)': 'hard_parses',
+    'execute count': 'executions',
+}
+
+def statement_counters(app, db_pool):
+    """
+    Contadores de parse: copia de las ejecuciones por texto SQL con DuckDB o las
+    estadísticas de v$sysstat con Oracle (None si no hay permiso para leerlas).
+    """
+    if isinstance(db_pool.pool, DuckDBPool):
+        with db_pool.pool._lock:
+            return Counter(db_pool.pool.statements)
+    try:
+        with app.app_context():
+            cursor = db_pool.get_connection().cursor()
+            nombres = list(ESTADISTICAS_PARSE)
+            marcadores = ', '.join(f':{i + 1}' for i in range(len(nombres)))
+            cursor.execute(f'SELECT name, value FROM v$sysstat WHERE name IN ({marcadores})', nombres)
+            valores = {ESTADISTICAS_PARSE[nombre]: valor for nombre, valor in cursor.fetchall()}
+            cursor.close()
+            return valores
+    except Exception:
+        return None
+
+def statement_delta(antes, despues):
+    """Sentencias distintas y ejecuciones (DuckDB) o parses totales y duros (Oracle) entre dos lecturas"""
+    if antes is None or despues is None:
+        return {}
+    if isinstance(antes, Counter):
+        ejecutadas = despues - antes
+        return {'statements': len(ejecutadas), 'executions': sum(ejecutadas.values())}
+    return {clave: despues[clave] - antes[clave] for clave in despues}
+
+def print_header():
+    print(f"{'filas':>10} {'escenario':<10} {'peticiones':>10} {'errores':>8} {'req/s':>9} "
+          f"{'media ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'sentencias':>10} {'hard parse':>10}")
+
+def print_row(r):
+    print(f"{r['rows']:>10} {r['scenario']:<10} {r['requests']:>10} {r['errors']:>8} {r['throughput_rps']:>9} "
+          f"{r['mean_ms']:>9} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9} "
+          f"{r.get('statements', '-'):>10} {r.get('hard_parses', '-'):>10}", flush=True)
+
+def compare_baseline(resultados, baseline, tolerancia):
+    """
+    Regresiones respecto a una ejecución anterior (--json): p99 por encima o
+    throughput por debajo de la línea base en más de tolerancia (0.2 = 20 %).
+    Returns: list[str] - una línea por regresión
+    """
+    base = {(r['rows'], r['scenario']): r for r in baseline['results']}
+    regresiones = []
+    for r in resultados:
+        anterior = base.get((r['rows'], r['scenario']))
+        if anterior is None:
+            continue
+        if r['p99_ms'] > anterior['p99_ms'] * (1 + tolerancia):
+            regresiones.append(f"{r['scenario']} ({r['rows']} filas): p99 {anterior['p99_ms']} -> {r['p99_ms']} ms")
+        if r['throughput_rps'] < anterior['throughput_rps'] * (1 - tolerancia):
+            regresiones.append(
+                f"{r['scenario']} ({r['rows']} filas): {anterior['throughput_rps']} -> {r['throughput_rps']} req/s"
+            )
+        if r['errors'] > anterior['errors']:
+            regresiones.append(f"{r['scenario']} ({r['rows']} filas): {anterior['errors']} -> {r['errors']} errores")
+    return regresiones
+
+# ========== Ejecución ==========
+
+def configure_environment(args, smtp_port, directorio):
+    """Variables de entorno que lee config.Config: hay que fijarlas antes de importar la app"""
+    os.environ.update({
+        'RATE_LIMIT_ENABLED': 'false',  # Todas las peticiones salen de la misma IP (abuse lo activa)
+        'PROXY_FIX_X_FOR': '1',  # abuse simula varias IPs con X-Forwarded-For
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': str(smtp_port),
+        'MAIL_USE_TLS': 'false',
+        'MAIL_USERNAME': f'app@{BENCH_DOMAIN}',
+        'MAIL_PASSWORD': 'bench',
+        'EMAIL_OUTBOX_PATH': os.path.join(directorio, 'outbox.sqlite3'),
+        'SLOW_QUERY_LOG_PATH': os.path.join(directorio, 'slow_queries.log'),
+        'DASHBOARD_SNAPSHOT_ENABLED': 'false',
+    })
+    if not args.cache:
+        os.environ.update({'CACHE_BACKEND': 'none', 'CHAT_CACHE_MODE': 'off'})
+    if args.backend == 'duckdb':
+        os.environ['DB_USER'] = 'BENCH'
+    if args.aggregation:
+        os.environ['DASHBOARD_AGGREGATION'] = args.aggregation
+    if args.bcrypt_rounds:
+        os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Throughput y latencias de los endpoints principales')
+    parser.add_argument('--backend', choices=['duckdb', 'oracle'], default='duckdb',
+                        help='duckdb (datos sintéticos) u oracle (la base configurada en .env)')
+    parser.add_argument('--rows', default='10k', help='Tamaños de VISTA_DASHBOARD, p. ej. 10k,1m,10m (solo duckdb)')
+    parser.add_argument('--db-dir', help='Directorio donde guardar y reutilizar las bases DuckDB generadas')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Escenarios separados por comas')
+    parser.add_argument('--requests', type=int, default=200, help='Peticiones por escenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Hilos cliente concurrentes')
+    parser.add_argument('--warmup', type=int, default=5, help='Peticiones de calentamiento no medidas')
+    parser.add_argument('--users', type=int, default=1000, help='Usuarios de prueba para el login')
+    parser.add_argument('--chat-load', type=int, default=4,
+                        help='Hilos de chat en segundo plano durante el escenario mixed')
+    parser.add_argument('--questions', help='Fichero con una pregunta por línea para el escenario replay')
+    parser.add_argument('--similarity', type=float, default=0.0,
+                        help='CHAT_CACHE_SIMILARITY durante el escenario replay (0 = solo aciertos exactos)')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Latencia simulada de Gemini (segundos)')
+    parser.add_argument('--aggregation', help='DASHBOARD_AGGREGATION a probar (db, rollup, kernel, pandas)')
+    parser.add_argument('--bcrypt-rounds', type=int, help='BCRYPT_ROUNDS (por defecto el de la configuración)')
+    parser.add_argument('--cache', action='store_true', help='Mantener las cachés de resultados y del chat')
+    parser.add_argument('--json', help='Guardar los resultados en este fichero')
+    parser.add_argument('--baseline', help='Resultados anteriores (--json) con los que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Margen de regresión admitido (0.2 = 20 %%)')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    escenarios = [e.strip() for e in args.scenarios.split(',') if e.strip()]
+    desconocidos = set(escenarios) - set(SCENARIOS)
+    if desconocidos:
+        sys.exit(f'Escenarios desconocidos: {", ".join(sorted(desconocidos))}')
+
+    smtp = StubSMTPServer()
+    directorio = tempfile.mkdtemp(prefix='bench_')
+    configure_environment(args, smtp.start(), directorio)
+
+    import app as aplicacion  # Lee config.Config con el entorno anterior
+    from db_utils import db_pool
+    from email_outbox import email_outbox
+    from utils import hash_password
+
+    llm = StubGeminiModel(args.llm_latency)
+    aplicacion.gemini_model = llm
+    app = aplicacion.app
+    with app.app_context():
+        password_hash = hash_password(BENCH_PASSWORD)
+
+    print_header()
+    tamaños = parse_rows(args.rows) if args.backend == 'duckdb' else [None]
+    resultados = []
+    for ejecucion, filas in enumerate(tamaños):
+        if args.backend == 'duckdb':
+            db, segundos = open_duckdb(filas, args.db_dir)
+            if segundos is not None:
+                print(f'{filas} ingresos generados en {segundos:.1f} s', flush=True)
+            db_pool.pool = DuckDBPool(db, args.concurrency)
+            if app.config['DASHBOARD_AGGREGATION'] == 'rollup':
+                db.execute(f'DROP TABLE IF EXISTS {aplicacion.dashboard_rollup.table}')
+                with app.app_context():
+                    aplicacion.dashboard_rollup.create(db_pool.get_connection())
+        else:
+            with app.app_context():
+                cursor = db_pool.get_connection().cursor()
+                cursor.execute('SELECT COUNT(*) FROM VISTA_DASHBOARD')
+                filas = cursor.fetchone()[0]
+                cursor.close()
+        aplicacion.result_cache.invalidate()
+        seed_users(app, db_pool, password_hash, args.users)
+
+        peticiones = {
+            'data': (_scenario_data, True),
+            'table': (_scenario_table, True),
+            'chat': (_scenario_chat, True),
+            'login': (lambda c, i: _scenario_login(c, i, args.users), False),
+            'register': (lambda c, i: _scenario_register(c, i, f'{int(time.time())}-{ejecucion}'), False),
+            'mixed': (_scenario_data, True),
+            'abuse': (None, False),
+            'replay': (None, True),
+        }
+        for nombre in escenarios:
+            peticion, autenticado = peticiones[nombre]
+            if nombre == 'abuse':
+                # Cuenta sus propias sentencias: solo la fase con los límites ya agotados
+                resultado = run_abuse(app, db_pool, aplicacion.rate_limiter, args.requests, args.concurrency)
+            elif nombre == 'replay':
+                antes = statement_counters(app, db_pool)
+                resultado = run_replay(app, aplicacion.answer_cache, llm, load_replay_questions(args.questions),
+                                       args.requests, args.concurrency, args.similarity)
+                resultado.update(statement_delta(antes, statement_counters(app, db_pool)))
+            else:
+                antes = statement_counters(app, db_pool)
+                if nombre == 'mixed':
+                    with ChatJobLoad(app, args.chat_load) as carga:
+                        resultado = run_scenario(app, peticion, args.requests, args.concurrency, args.warmup,
+                                                 autenticado)
+                    resultado.update({'chat_jobs_done': carga.completados, 'chat_jobs_failed': carga.fallidos})
+                else:
+                    resultado = run_scenario(app, peticion, args.requests, args.concurrency, args.warmup,
+                                             autenticado)
+                resultado.update(statement_delta(antes, statement_counters(app, db_pool)))
+            resultados.append({'rows': filas, 'scenario': nombre, **resultado})
+            print_row(resultados[-1])
+            if nombre == 'mixed':
+                print(f"{'':>10} chat en segundo plano: {resultado['chat_jobs_done']} trabajos completados, "
+                      f"{resultado['chat_jobs_failed']} rechazados o fallidos", flush=True)
+            if nombre == 'replay':
+                print(f"{'':>10} caché de respuestas: {resultado['exact_hits']} exactos, "
+                      f"{resultado['similar_hits']} similares, {resultado['misses']} fallos "
+                      f"(tasa {resultado['hit_rate']:.0%}), {resultado['llm_calls']} llamadas al LLM "
+                      f"para {resultado['requests']} preguntas", flush=True)
+            if nombre == 'abuse':
+                print(f"{'':>10} intentos rechazados con 429: {resultado['requests'] - resultado['errors']}, "
+                      f"sentencias SQL por rechazo: {resultado.get('statements_per_rejection', '-')}", flush=True)
+
+    # Los correos del registro salen por la cola en segundo plano hacia el SMTP local
+    if 'register' in escenarios:
+        limite = time.monotonic() + 10
+        while time.monotonic() < limite:
+            por_estado = email_outbox.get_stats().get('by_status', {})
+            if not por_estado.get('pending') and not por_estado.get('sending'):
+                break
+            time.sleep(0.1)
+        print(f'SMTP local: {smtp.messages} mensajes recibidos')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': resultados}, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regresiones = compare_baseline(resultados, json.load(f), args.tolerance)
+        if regresiones:
+            print('\nRegresiones respecto a la línea base:')
+            for linea in regresiones:
+                print(f'  - {linea}')
+            sys.exit(1)
+        print('\nSin regresiones respecto a la línea base')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class MemoryCacheBackend:
+    """Caché en proceso con TTL y expulsión LRU (adecuada para un solo worker)"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, prefix=None):
+        with self._lock:
+            if prefix is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k.startswith(prefix)]:
+                    del self._data[key]
+
+    def size(self):
+        return len(self._data)
+
+class RedisCacheBackend:
+    """
+    Caché compartida entre workers de gunicorn. El TTL lo aplica Redis y el
+    límite de tamaño/LRU se delega en su política maxmemory (allkeys-lru).
+    La invalidación incrementa una versión, así no hace falta recorrer claves.
+    Los valores se serializan con el proveedor JSON de Flask (app.json), el mismo
+    que usa jsonify: fechas y Decimal salen igual que con la caché en memoria.
+    """
+
+    def __init__(self, url, json_provider, key_prefix='malackathon:cache:'):
+        import redis  # Dependencia opcional, solo necesaria con CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.json = json_provider
+        self.key_prefix = key_prefix
+        self.evictions = 0
+
+    def _version(self, name):
+        return int(self.client.get(f'{self.key_prefix}version:{name}') or 0)
+
+    def _full_key(self, key):
+        namespace = key.split(':', 1)[0]
+        versions = f'v{self._version("*")}.{self._version(namespace)}'
+        return f'{self.key_prefix}{versions}:{key}'
+
+    def get(self, key):
+        raw = self.client.get(self._full_key(key))
+        if raw is None:
+            return _MISSING
+        return self.json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self._full_key(key), ttl, self.json.dumps(value))
+
+    def clear(self, prefix=None):
+        name = '*' if prefix is None else prefix.rstrip(':')
+        self.client.incr(f'{self.key_prefix}version:{name}')
+
+    def size(self):
+        return None
+
+class DataVersion:
+    """
+    Versión de los datos compartida entre procesos: el mtime de un fichero que cada
+    refresco (rollup, snapshot, invalidación manual) toca. Los workers lo comparan
+    en cada consulta a sus cachés en proceso, así un `flask rollup refresh` lanzado
+    desde cron deja obsoletas las respuestas de todos los workers de la máquina.
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def init_app(self, app):
+        self.path = app.config['DATA_VERSION_PATH'] or os.path.join(app.instance_path, 'data_version')
+
+    def current(self):
+        """Returns: int - mtime en ns del fichero (0 si aún no hay refrescos)"""
+        if self.path is None:
+            return 0
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def bump(self):
+        """Publica una versión nueva (estrictamente mayor aunque el reloj tenga poca resolución)"""
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        version = max(time.time_ns(), self.current() + 1)
+        with open(self.path, 'a'):
+            pass
+        os.utime(self.path, ns=(version, version))
+
+data_version = DataVersion()
+
+class ResultCache:
+    """Caché de resultados del dashboard indexada por la tupla normalizada de filtros"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 300
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['CACHE_BACKEND']
+        self.ttl = app.config['CACHE_TTL']
+        self.enabled = backend != 'none'
+        if backend == 'redis':
+            self.backend = RedisCacheBackend(app.config['CACHE_REDIS_URL'], app.json)
+        else:
+            self.backend = MemoryCacheBackend(app.config['CACHE_MAX_ENTRIES'])
+
+    @staticmethod
+    def make_key(namespace, key, version=0):
+        return f'{namespace}:{version}:{json.dumps(list(key), default=str)}'
+
+    def _count(self, counters, namespace):
+        with self._lock:
+            counters[namespace] = counters.get(namespace, 0) + 1
+
+    def get_or_set(self, namespace, key, compute):
+        """Devuelve el valor cacheado o lo calcula con compute() y lo guarda"""
+        if not self.enabled:
+            return compute()
+
+        # La versión de datos va en la clave: tras un refresco nadie lee lo anterior
+        full_key = self.make_key(namespace, key, data_version.current())
+        value = self.backend.get(full_key)
+        if value is not _MISSING:
+            self._count(self.hits, namespace)
+            return value
+
+        self._count(self.misses, namespace)
+        value = compute()
+        self.backend.set(full_key, value, self.ttl)
+        return value
+
+    def invalidate(self, namespace=None):
+        """Descarta las entradas (todas o de un namespace), p. ej. tras recargar datos"""
+        if self.backend is not None:
+            self.backend.clear(None if namespace is None else f'{namespace}:')
+
+    def get_stats(self):
+        with self._lock:
+            hits = dict(self.hits)
+            misses = dict(self.misses)
+        total_hits = sum(hits.values())
+        total_requests = total_hits + sum(misses.values())
+        return {
+            'enabled': self.enabled,
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'ttl': self.ttl,
+            'size': self.backend.size() if self.backend else 0,
+            'evictions': self.backend.evictions if self.backend else 0,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': total_hits / total_requests if total_requests else 0
+        }
+
+result_cache = ResultCache()
@@ -0,0 +1,285 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import g
+
+class ChatJobError(Exception):
+    """Trabajo rechazado (cola llena o límite por usuario), con su código HTTP"""
+
+    def __init__(self, message, status=429):
+        super().__init__(message)
+        self.status = status
+
+MENSAJE_TIMEOUT = 'La pregunta ha tardado demasiado. Inténtalo de nuevo.'
+
+class MemoryChatJobStore:
+    """
+    Trabajos en un diccionario del proceso. Solo sirve con un worker o con sesiones
+    persistentes: otro worker no conoce el trabajo y los límites son por proceso.
+    """
+
+    def __init__(self, result_ttl=600):
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _purge(self, ahora):
+        """Olvida los trabajos cuyo hilo terminó hace más de result_ttl segundos"""
+        for job_id in [j for j, job in self._jobs.items()
+                       if job['worker_done'] and ahora - (job['finished_at'] or job['deadline']) > self.result_ttl]:
+            del self._jobs[job_id]
+
+    def reserve(self, job_id, job, max_per_user, max_queue, hold_until):
+        """
+        Registra el trabajo si caben en los límites.
+        Returns: str|None - 'user' o 'queue' si se rechaza
+        """
+        with self._lock:
+            self._purge(time.time())
+            activos = [j for j in self._jobs.values() if not j['worker_done']]
+            if sum(1 for j in activos if j['owner'] == job['owner']) >= max_per_user:
+                return 'user'
+            if len(activos) >= max_queue:
+                return 'queue'
+            self._jobs[job_id] = dict(job)
+        return None
+
+    def load(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def update(self, job_id, **campos):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(campos)
+
+    def release(self, job_id, **campos):
+        """Último estado del trabajo; deja de contar en los límites"""
+        self.update(job_id, worker_done=True, **campos)
+
+    def jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def occupied(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job['worker_done'])
+
+# Admisión atómica: dos workers no pueden ver el mismo hueco libre a la vez.
+# Las reservas caducan (puntuación) por si el proceso que ejecutaba el trabajo muere.
+RESERVE_SCRIPT = """
+local ahora = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ahora)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ahora)
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[2]) then
+    return 'user'
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 'queue'
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[5])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[7])
+redis.call('SET', KEYS[3], ARGV[6], 'EX', ARGV[7])
+return false
+"""
+
+class RedisChatJobStore:
+    """
+    Trabajos compartidos entre workers y máquinas: cualquier worker responde al
+    sondeo y los límites son globales. El trabajo se ejecuta en el worker que lo
+    recibió; su estado es un JSON por trabajo y las plazas ocupadas, dos sorted sets
+    (global y por usuario).
+    """
+
+    def __init__(self, url, app, result_ttl=600, key_prefix='malackathon:chatjobs:'):
+        import redis  # Dependencia opcional, solo necesaria con CHAT_JOBS_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.app = app
+        self.result_ttl = result_ttl
+        self.key_prefix = key_prefix
+        self._reserve = self.client.register_script(RESERVE_SCRIPT)
+
+    def _job_key(self, job_id):
+        return f'{self.key_prefix}job:{job_id}'
+
+    def _owner_key(self, owner):
+        return f'{self.key_prefix}active:{owner}'
+
+    def reserve(self, job_id, job, max_per_user, max_queue, hold_until):
+        ahora = time.time()
+        motivo = self._reserve(
+            keys=[f'{self.key_prefix}active', self._owner_key(job['owner']), self._job_key(job_id)],
+            args=[ahora, max_per_user, max_queue, hold_until, job_id,
+                  self.app.json.dumps(job), int(hold_until - ahora) + self.result_ttl]
+        )
+        return motivo.decode() if isinstance(motivo, bytes) else motivo
+
+    def load(self, job_id):
+        raw = self.client.get(self._job_key(job_id))
+        return None if raw is None else self.app.json.loads(raw)
+
+    def update(self, job_id, ttl=None, **campos):
+        # Solo escribe el hilo que ejecuta el trabajo, no hay escrituras concurrentes
+        job = self.load(job_id)
+        if job is None:
+            return
+        job.update(campos)
+        if ttl is None:
+            self.client.set(self._job_key(job_id), self.app.json.dumps(job), keepttl=True)
+        else:
+            self.client.set(self._job_key(job_id), self.app.json.dumps(job), ex=ttl)
+
+    def release(self, job_id, **campos):
+        job = self.load(job_id)
+        self.update(job_id, ttl=self.result_ttl, worker_done=True, **campos)
+        pipe = self.client.pipeline()
+        pipe.zrem(f'{self.key_prefix}active', job_id)
+        if job is not None:
+            pipe.zrem(self._owner_key(job['owner']), job_id)
+        pipe.execute()
+
+    def jobs(self):
+        claves = list(self.client.scan_iter(f'{self.key_prefix}job:*'))
+        return [self.app.json.loads(raw) for raw in self.client.mget(claves) if raw is not None] if claves else []
+
+    def occupied(self):
+        clave = f'{self.key_prefix}active'
+        self.client.zremrangebyscore(clave, '-inf', time.time())
+        return self.client.zcard(clave)
+
+class ChatJobManager:
+    """
+    Ejecuta las preguntas del chat en un pool de hilos acotado para no bloquear
+    los workers WSGI. Cada trabajo corre dentro de un app_context propio, así la
+    conexión del pool se libera en el teardown igual que en una petición.
+    El estado vive en el almacén (memoria o Redis). Un trabajo vencido se ve como
+    'timeout' aunque nadie lo consulte, pero sigue contando en los límites hasta
+    que su hilo termina de verdad. Los instantes son de reloj (time.time) porque
+    con Redis se comparan entre procesos.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.store = None
+        self.max_queue = 16
+        self.max_per_user = 2
+        self.timeout = 60
+        self.result_ttl = 600
+
+    def init_app(self, app):
+        self.app = app
+        self.max_queue = app.config['CHAT_JOBS_MAX_QUEUE']
+        self.max_per_user = app.config['CHAT_JOBS_PER_USER']
+        self.timeout = app.config['CHAT_JOBS_TIMEOUT']
+        self.result_ttl = app.config['CHAT_JOBS_RESULT_TTL']
+        if app.config['CHAT_JOBS_BACKEND'] == 'redis':
+            self.store = RedisChatJobStore(app.config['CHAT_JOBS_REDIS_URL'], app, self.result_ttl)
+        else:
+            self.store = MemoryChatJobStore(self.result_ttl)
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config['CHAT_JOBS_WORKERS'],
+            thread_name_prefix='chat-job'
+        )
+
+    @staticmethod
+    def _effective(job, ahora):
+        """Estado visible: en cola o en curso pasado el plazo cuenta como 'timeout'"""
+        if job['status'] in ('queued', 'running') and ahora > job['deadline']:
+            return dict(job, status='timeout', result=None, error=MENSAJE_TIMEOUT, finished_at=job['deadline'])
+        return job
+
+    def remaining(self):
+        """Segundos que le quedan al trabajo en curso (None fuera de un trabajo)"""
+        deadline = g.get('chat_job_deadline')
+        return None if deadline is None else deadline - time.time()
+
+    def check_deadline(self):
+        """Corta el trabajo en curso entre pasos si ya ha vencido su plazo"""
+        restante = self.remaining()
+        if restante is not None and restante <= 0:
+            raise ChatJobError(MENSAJE_TIMEOUT, 504)
+
+    def submit(self, owner, func, *args):
+        """Encola func(*args) para owner. Lanza ChatJobError si se superan los límites"""
+        job_id = uuid.uuid4().hex
+        ahora = time.time()
+        job = {
+            'owner': owner,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'submitted_at': ahora,
+            'deadline': ahora + self.timeout,
+            'started_at': None,
+            'finished_at': None,
+            'worker_done': False
+        }
+        # Si el proceso muere sin liberar la plaza, la reserva caduca un plazo después del vencimiento
+        motivo = self.store.reserve(job_id, job, self.max_per_user, self.max_queue, ahora + 2 * self.timeout)
+        if motivo == 'user':
+            raise ChatJobError('Ya tienes preguntas en curso. Espera a que terminen.', 429)
+        if motivo == 'queue':
+            raise ChatJobError('El asistente está saturado. Inténtalo en unos segundos.', 503)
+
+        self.executor.submit(self._run, job_id, job['deadline'], func, args)
+        return job_id
+
+    def _run(self, job_id, deadline, func, args):
+        ahora = time.time()
+        if ahora > deadline:
+            # Venció esperando en la cola: no llega a ejecutarse
+            self.store.release(job_id, status='timeout', error=MENSAJE_TIMEOUT, finished_at=deadline)
+            return
+        self.store.update(job_id, status='running', started_at=ahora)
+
+        try:
+            with self.app.app_context():
+                # run_chat_query y answer_question acotan sus pasos con este plazo
+                g.chat_job_deadline = deadline
+                result, error = func(*args), None
+        except Exception as e:
+            result, error = None, str(e)
+
+        ahora = time.time()
+        # Un resultado tardío se descarta
+        if ahora > deadline:
+            self.store.release(job_id, status='timeout', error=MENSAJE_TIMEOUT, finished_at=ahora)
+        else:
+            self.store.release(job_id, status='done' if error is None else 'error',
+                               result=result, error=error, finished_at=ahora)
+
+    def get(self, job_id, owner):
+        """Estado del trabajo (None si no existe o pertenece a otro usuario)"""
+        job = self.store.load(job_id)
+        if job is None or job['owner'] != owner:
+            return None
+
+        ahora = time.time()
+        job = self._effective(job, ahora)
+        return {
+            'job_id': job_id,
+            'status': job['status'],
+            'result': job['result'],
+            'error': job['error'],
+            'elapsed': (job['finished_at'] or ahora) - job['submitted_at']
+        }
+
+    def get_stats(self):
+        ahora = time.time()
+        por_estado = {}
+        for job in self.store.jobs():
+            estado = self._effective(job, ahora)['status']
+            por_estado[estado] = por_estado.get(estado, 0) + 1
+        return {
+            'backend': type(self.store).__name__ if self.store else None,
+            'jobs': por_estado,
+            'occupied': self.store.occupied(),
+            'max_queue': self.max_queue,
+            'max_per_user': self.max_per_user
+        }
+
+chat_jobs = ChatJobManager()
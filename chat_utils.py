@@ -0,0 +1,296 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from db_utils import explain_plan, fetch_dataframe
+from cache_utils import data_version
+
+class SchemaCache:
+    """
+    Esquema introspectado para el prompt del chat. Se consulta all_tab_columns solo
+    al caducar (o al invalidar) y únicamente para las tablas/vistas relevantes.
+    """
+
+    def __init__(self):
+        self.owner = None
+        self.tables = []
+        self.refresh_seconds = 3600
+        self.version = 0
+        self._lock = threading.Lock()
+        self._esquema = None
+        self._texto = None
+        self._loaded_at = 0.0
+
+    def init_app(self, app):
+        self.owner = (app.config['DB_USER'] or '').upper()
+        self.tables = [t.strip().upper() for t in app.config['CHAT_SCHEMA_TABLES'].split(',') if t.strip()]
+        self.refresh_seconds = app.config['CHAT_SCHEMA_REFRESH_SECONDS']
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        query = """
+            SELECT table_name, column_name
+            FROM all_tab_columns
+            WHERE owner = :1
+        """
+        params = [self.owner]
+        if self.tables:
+            placeholders = ', '.join(f':{i + 2}' for i in range(len(self.tables)))
+            query += f' AND table_name IN ({placeholders})'
+            params.extend(self.tables)
+        cursor.execute(query + ' ORDER BY table_name, column_id', params)
+
+        esquema = {}
+        for table, column in cursor:
+            esquema.setdefault(table, []).append(column)
+        cursor.close()
+        return esquema
+
+    def is_stale(self):
+        return self._texto is None or time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    def get_prompt_fragment(self, get_connection):
+        """
+        Returns: (str, int) - (esquema en texto para el prompt, versión).
+        La versión cambia en cada recarga, útil para invalidar cachés derivadas.
+        """
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    esquema = self._load(get_connection())
+                    self._esquema = esquema
+                    self._texto = "\n".join(
+                        f"{tabla}({', '.join(columnas)})" for tabla, columnas in esquema.items()
+                    )
+                    self._loaded_at = time.monotonic()
+                    self.version += 1
+        return self._texto, self.version
+
+    def invalidate(self):
+        """Fuerza la reintrospección en la próxima pregunta (p. ej. tras un cambio de DDL)"""
+        with self._lock:
+            self._texto = None
+
+schema_cache = SchemaCache()
+
+def normalize_question(question):
+    """Minúsculas, sin tildes ni signos de puntuación y con espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', question.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^\w\s]', ' ', texto)
+    return ' '.join(texto.split())
+
+def ngram_vector(texto, dim=512, n=3):
+    """Vector normalizado de n-gramas de caracteres con hashing (sin modelos externos)"""
+    vector = np.zeros(dim, dtype=np.float32)
+    relleno = f' {texto} '
+    for i in range(len(relleno) - n + 1):
+        digest = hashlib.blake2b(relleno[i:i + n].encode('utf-8'), digest_size=4).digest()
+        vector[int.from_bytes(digest, 'little') % dim] += 1.0
+    norma = np.linalg.norm(vector)
+    return vector / norma if norma else vector
+
+class AnswerCache:
+    """
+    Caché de respuestas del chat indexada por la pregunta normalizada, con búsqueda
+    opcional por similitud (coseno sobre n-gramas). Cada entrada guarda el SQL y la
+    respuesta, y queda obsoleta al caducar, al cambiar la versión del esquema o la
+    versión de datos compartida (data_version, la tocan los refrescos).
+    Los vectores viven en una matriz de max_entries filas; cada entrada ocupa un
+    hueco fijo, así guardar no reconstruye el índice.
+    """
+
+    def __init__(self):
+        self.mode = 'answer'
+        self.ttl = 86400
+        self.max_entries = 1000
+        self.similarity = 0.0
+        self.dim = 512
+        self.data_version = 0
+        self._shared_version = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._reset_index()
+        self.stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'llm_calls_saved': 0}
+
+    def init_app(self, app):
+        self.mode = app.config['CHAT_CACHE_MODE']
+        self.ttl = app.config['CHAT_CACHE_TTL']
+        self.max_entries = app.config['CHAT_CACHE_MAX_ENTRIES']
+        self.similarity = app.config['CHAT_CACHE_SIMILARITY']
+        with self._lock:
+            self._entries.clear()
+            self._reset_index()
+
+    @property
+    def enabled(self):
+        return self.mode in ('answer', 'sql')
+
+    def _reset_index(self):
+        capacidad = max(self.max_entries, 1)
+        self._matrix = np.zeros((capacidad, self.dim), dtype=np.float32)
+        self._created = np.full(capacidad, -np.inf)  # -inf = hueco libre
+        self._schema = np.zeros(capacidad, dtype=np.int64)
+        self._keys = [None] * capacidad
+        self._free = list(range(capacidad - 1, -1, -1))
+
+    def _remove(self, clave):
+        slot = self._entries.pop(clave)['slot']
+        self._matrix[slot] = 0
+        self._created[slot] = -np.inf
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def _sync(self, schema_version):
+        """
+        Descarta todo si otro proceso ha publicado una versión de datos nueva y
+        después las entradas caducadas o de otro esquema (vectorizado sobre la matriz).
+        """
+        version = data_version.current()
+        if version != self._shared_version:
+            if self._shared_version is not None:
+                self.data_version += 1
+            self._shared_version = version
+            self._entries.clear()
+            self._reset_index()
+            return
+
+        ocupados = np.isfinite(self._created)
+        obsoletos = ocupados & ((time.monotonic() - self._created >= self.ttl) | (self._schema != schema_version))
+        for slot in np.flatnonzero(obsoletos):
+            self._remove(self._keys[slot])
+
+    def lookup(self, question, schema_version):
+        """
+        Returns: dict|None - {'sql', 'answer', 'match'} si hay una entrada vigente.
+        En modo 'sql' solo se reutiliza la consulta (se ahorra la primera llamada al LLM).
+        """
+        if not self.enabled:
+            return None
+
+        clave = normalize_question(question)
+        with self._lock:
+            # Tras _sync solo quedan entradas vigentes: la más parecida ya es válida
+            self._sync(schema_version)
+            entry = self._entries.get(clave)
+            match = 'exact'
+
+            if entry is None and self.similarity > 0 and self._entries:
+                scores = self._matrix @ ngram_vector(clave, self.dim)
+                best = int(np.argmax(scores))
+                # Los huecos libres tienen vector nulo (puntuación 0) y nunca superan el umbral
+                if scores[best] >= self.similarity and self._keys[best] is not None:
+                    clave = self._keys[best]
+                    entry = self._entries[clave]
+                    match = 'similar'
+
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(clave)
+            self.stats['exact_hits' if match == 'exact' else 'similar_hits'] += 1
+            self.stats['llm_calls_saved'] += 2 if self.mode == 'answer' else 1
+            return {
+                'sql': entry['sql'],
+                'answer': entry['answer'] if self.mode == 'answer' else None,
+                'match': match
+            }
+
+    def store(self, question, sql, answer, schema_version):
+        if not self.enabled:
+            return
+        clave = normalize_question(question)
+        with self._lock:
+            self._sync(schema_version)
+            if clave in self._entries:
+                slot = self._entries[clave]['slot']
+            else:
+                while len(self._entries) >= len(self._keys):
+                    self._remove(next(iter(self._entries)))
+                slot = self._free.pop()
+            self._entries[clave] = {'sql': sql, 'answer': answer, 'slot': slot}
+            self._entries.move_to_end(clave)
+            self._matrix[slot] = ngram_vector(clave, self.dim)
+            self._created[slot] = time.monotonic()
+            self._schema[slot] = schema_version
+            self._keys[slot] = clave
+
+    def invalidate(self):
+        """Marca todas las respuestas de este proceso como obsoletas (p. ej. tras recargar datos)"""
+        with self._lock:
+            self.data_version += 1
+            self._entries.clear()
+            self._reset_index()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['data_version'] = self.data_version
+        stats['mode'] = self.mode
+        return stats
+
+answer_cache = AnswerCache()
+
+class ChatQueryError(Exception):
+    """El SQL generado no se ejecuta por no ser de solo lectura o por ser demasiado costoso"""
+
+def run_guarded_query(conn, sql, max_rows=1000, max_cost=None, timeout_ms=None):
+    """
+    Ejecuta el SQL generado por el LLM con protecciones: solo SELECT/WITH, coste
+    estimado (EXPLAIN PLAN) por debajo de max_cost, límite de filas con fetchmany
+    y call_timeout en la conexión. El SQL se ejecuta tal cual: envolverlo en
+    SELECT * FROM (...) falla (ORA-00918) si repite nombres de columna, p. ej. a.*, b.*
+    Returns: (DataFrame, truncado, estimacion)
+    """
+    if not re.match(r'^\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+        raise ChatQueryError('Solo se permiten consultas de lectura (SELECT).')
+
+    cursor = conn.cursor()
+    previous_timeout = conn.call_timeout
+    try:
+        if timeout_ms:
+            conn.call_timeout = timeout_ms
+
+        estimacion = explain_plan(cursor, sql)
+        if max_cost and estimacion['cost'] is not None and estimacion['cost'] > max_cost:
+            raise ChatQueryError(
+                f"La consulta es demasiado costosa (coste estimado {estimacion['cost']}, "
+                f"~{estimacion['cardinality']} filas). Prueba con una pregunta más concreta o agregada."
+            )
+
+        # Una fila extra para saber si el resultado se ha recortado
+        df = fetch_dataframe(conn, sql, arraysize=min(max_rows + 1, 1000), max_rows=max_rows + 1)
+    finally:
+        conn.call_timeout = previous_timeout
+        cursor.close()
+
+    truncado = len(df) > max_rows
+    return df.iloc[:max_rows], truncado, estimacion
+
+def dataframe_rows(df, max_rows):
+    """Primeras filas como listas serializables (NaN/NaT -> None) para enviarlas al navegador"""
+    head = df.head(max_rows).astype(object)
+    return head.where(head.notna(), None).values.tolist()
+
+def summarize_results(df, max_rows=50, truncado=False):
+    """
+    Resultados en markdown para el prompt de explicación. Si hay demasiadas filas
+    se envían las primeras max_rows y un resumen estadístico de las columnas numéricas.
+    """
+    if len(df) <= max_rows and not truncado:
+        return df.to_markdown(index=False)
+
+    partes = [df.head(max_rows).to_markdown(index=False)]
+    total = f'más de {len(df)}' if truncado else str(len(df))
+    partes.append(f'\n(Se muestran {min(len(df), max_rows)} de {total} filas)')
+
+    numericas = df.select_dtypes(include='number')
+    if not numericas.empty:
+        partes.append('\nResumen de las columnas numéricas sobre las filas obtenidas:')
+        partes.append(numericas.describe().to_markdown())
+    return '\n'.join(partes)
@@ -11,6 +11,7 @@ class Config:
     # Credenciales de login (mantener compatibilidad con sistema antiguo)
     LOGIN_USERNAME = os.environ.get('LOGIN_USERNAME')
     LOGIN_PASSWORD = os.environ.get('LOGIN_PASSWORD')
+    LOGIN_MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 5))  # Intentos fallidos antes de bloquear la cuenta
     
     # Base de datos Oracle
     DB_USER = os.environ.get('DB_USER')
@@ -21,19 +22,141 @@ class Config:
     WALLET_LOCATION = os.environ.get('WALLET_LOCATION')
     WALLET_PASSWORD = os.environ.get('WALLET_PASSWORD')
     
+    # Pool de conexiones Oracle (evita un handshake TLS por petición)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_INCREMENT = int(os.environ.get('DB_POOL_INCREMENT', 1))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 300))  # Segundos antes de cerrar sesiones ociosas
+    DB_POOL_WAIT_TIMEOUT = int(os.environ.get('DB_POOL_WAIT_TIMEOUT', 5000))  # Milisegundos esperando una sesión libre
+    DB_POOL_PING_INTERVAL = int(os.environ.get('DB_POOL_PING_INTERVAL', 60))
+    # Cursores que cada sesión mantiene abiertos para reejecutar sin volver a parsear (oracledb usa 20)
+    DB_STMT_CACHE_SIZE = int(os.environ.get('DB_STMT_CACHE_SIZE', 64))
+    
+    # Descarga de resultados a DataFrames vía Arrow (python-oracledb 3+ y pyarrow); si no, cursor con arraysize
+    DB_FETCH_ARROW = os.environ.get('DB_FETCH_ARROW', 'true').lower() == 'true'
+    
+    # Agregación del dashboard: 'db' (GROUPING SETS en Oracle), 'rollup' (tabla resumen),
+    # 'kernel' (descarga por lotes y agrega con NumPy) o 'pandas' (descarga todas las filas)
+    DASHBOARD_AGGREGATION = os.environ.get('DASHBOARD_AGGREGATION', 'db')
+    
+    # Tabla resumen del dashboard (flask rollup create / flask rollup refresh)
+    DASHBOARD_ROLLUP_TABLE = os.environ.get('DASHBOARD_ROLLUP_TABLE', 'DASHBOARD_ROLLUP')
+    DASHBOARD_ROLLUP_GRAIN = os.environ.get('DASHBOARD_ROLLUP_GRAIN', 'day')  # 'day' o 'month'
+    DASHBOARD_ROLLUP_REFRESH_DAYS = int(os.environ.get('DASHBOARD_ROLLUP_REFRESH_DAYS', 62))  # Ventana del refresco incremental
+    
+    # Snapshot columnar local (Arrow IPC, requiere pyarrow) para servir /api/data y /api/table sin Oracle
+    DASHBOARD_SNAPSHOT_ENABLED = os.environ.get('DASHBOARD_SNAPSHOT_ENABLED', 'false').lower() == 'true'
+    DASHBOARD_SNAPSHOT_PATH = os.environ.get('DASHBOARD_SNAPSHOT_PATH')  # Por defecto instance/dashboard.arrow
+    DASHBOARD_SNAPSHOT_REFRESH_SECONDS = int(os.environ.get('DASHBOARD_SNAPSHOT_REFRESH_SECONDS', 900))
+    
+    # Migraciones de la tabla de ingresos bajo VISTA_DASHBOARD (flask schema migrate / check-pruning / bench)
+    SCHEMA_INGRESOS_TABLE = os.environ.get('SCHEMA_INGRESOS_TABLE', 'INGRESOS')
+    SCHEMA_MIGRATIONS_TABLE = os.environ.get('SCHEMA_MIGRATIONS_TABLE', 'SCHEMA_MIGRATIONS')
+    SCHEMA_PARTITIONING = os.environ.get('SCHEMA_PARTITIONING', 'true').lower() == 'true'  # Requiere la opción de particionado
+    SCHEMA_PARTITION_FUTURE_MONTHS = int(os.environ.get('SCHEMA_PARTITION_FUTURE_MONTHS', 12))  # Meses vista (flask schema extend)
+    
+    # Caché de resultados del dashboard: 'memory' (un worker), 'redis' (varios workers) o 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))  # Segundos
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 256))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    # Fichero cuyo mtime marca la versión de datos (por defecto instance/data_version). Los refrescos
+    # lo tocan y todos los workers descartan sus cachés; con varias máquinas, en almacenamiento compartido
+    DATA_VERSION_PATH = os.environ.get('DATA_VERSION_PATH')
+    
+    # Tamaño máximo de página en /api/table (evita descargar la vista completa)
+    TABLE_MAX_PER_PAGE = int(os.environ.get('TABLE_MAX_PER_PAGE', 100))
+    
+    # Filas por lote en /api/export (arraysize/prefetchrows del cursor)
+    EXPORT_ARRAYSIZE = int(os.environ.get('EXPORT_ARRAYSIZE', 5000))
+    
+    # Opciones de los filtros: recarga en servidor y caché en navegador (segundos)
+    LOOKUP_REFRESH_SECONDS = int(os.environ.get('LOOKUP_REFRESH_SECONDS', 3600))
+    LOOKUP_BROWSER_MAX_AGE = int(os.environ.get('LOOKUP_BROWSER_MAX_AGE', 300))
+    
     # Google Gemini API
     GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
     
+    # Tablas/vistas que se describen al modelo en el chat y refresco del esquema (segundos)
+    CHAT_SCHEMA_TABLES = os.environ.get(
+        'CHAT_SCHEMA_TABLES', 'VISTA_DASHBOARD,COMUNIDADES,CATEGORIAS_DIAGNOSTICO'
+    )
+    CHAT_SCHEMA_REFRESH_SECONDS = int(os.environ.get('CHAT_SCHEMA_REFRESH_SECONDS', 3600))
+    
+    # Caché de respuestas del chat: 'answer' (respuesta completa), 'sql' (solo la consulta) o 'none'
+    CHAT_CACHE_MODE = os.environ.get('CHAT_CACHE_MODE', 'answer')
+    CHAT_CACHE_TTL = int(os.environ.get('CHAT_CACHE_TTL', 86400))  # Segundos
+    CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', 1000))
+    # Umbral de similitud coseno (0 = solo coincidencia exacta de la pregunta normalizada)
+    CHAT_CACHE_SIMILARITY = float(os.environ.get('CHAT_CACHE_SIMILARITY', 0))
+    
+    # Límites para ejecutar el SQL generado por el modelo
+    CHAT_SQL_MAX_ROWS = int(os.environ.get('CHAT_SQL_MAX_ROWS', 1000))
+    CHAT_SQL_MAX_COST = int(os.environ.get('CHAT_SQL_MAX_COST', 100000))  # Coste del optimizador (EXPLAIN PLAN)
+    CHAT_SQL_TIMEOUT_MS = int(os.environ.get('CHAT_SQL_TIMEOUT_MS', 15000))
+    CHAT_PROMPT_MAX_ROWS = int(os.environ.get('CHAT_PROMPT_MAX_ROWS', 50))  # Filas que se envían al prompt de explicación
+    
+    # Modo del chat en el navegador: 'stream' (SSE), 'jobs' (encolar y consultar) o 'sync' (bloqueante)
+    CHAT_MODE = os.environ.get('CHAT_MODE', 'stream')
+    CHAT_STREAM_TABLE_ROWS = int(os.environ.get('CHAT_STREAM_TABLE_ROWS', 50))  # Filas de la tabla enviadas al navegador
+    CHAT_JOBS_WORKERS = int(os.environ.get('CHAT_JOBS_WORKERS', 4))
+    # Estado de los trabajos: 'memory' (un worker o sesiones persistentes) o 'redis' (varios workers,
+    # límites globales y sondeo desde cualquier worker)
+    CHAT_JOBS_BACKEND = os.environ.get('CHAT_JOBS_BACKEND', 'memory')
+    CHAT_JOBS_REDIS_URL = os.environ.get('CHAT_JOBS_REDIS_URL', CACHE_REDIS_URL)
+    CHAT_JOBS_MAX_QUEUE = int(os.environ.get('CHAT_JOBS_MAX_QUEUE', 16))
+    CHAT_JOBS_PER_USER = int(os.environ.get('CHAT_JOBS_PER_USER', 2))
+    CHAT_JOBS_TIMEOUT = int(os.environ.get('CHAT_JOBS_TIMEOUT', 60))  # Segundos
+    CHAT_JOBS_RESULT_TTL = int(os.environ.get('CHAT_JOBS_RESULT_TTL', 600))  # Segundos
+    
     # ========== NUEVAS CONFIGURACIONES PARA SISTEMA DE USUARIOS ==========
     
     # Configuración de Email (Gmail)
-    MAIL_SERVER = 'smtp.gmail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')  # Añadir a tu .env
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')  # Añadir a tu .env (App Password de Gmail)
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_USERNAME')
     
+    # Cola de salida de emails: las peticiones solo encolan y un hilo envía con reintentos
+    EMAIL_OUTBOX_ENABLED = os.environ.get('EMAIL_OUTBOX_ENABLED', 'true').lower() == 'true'
+    EMAIL_OUTBOX_PATH = os.environ.get('EMAIL_OUTBOX_PATH')  # Por defecto instance/outbox.sqlite3
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 20))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+    EMAIL_OUTBOX_BACKOFF = int(os.environ.get('EMAIL_OUTBOX_BACKOFF', 30))  # Segundos, se duplica en cada reintento
+    # Segundos que se conservan los enviados/fallidos (ya sin parámetros) antes de borrarlos; 0 = borrar al enviar
+    EMAIL_OUTBOX_RETENTION = int(os.environ.get('EMAIL_OUTBOX_RETENTION', 7 * 86400))
+    
+    # Proxies inversos de confianza delante de la app (0 = clientes directos). Con N > 0
+    # la IP del cliente, la que usa el límite por IP, sale de X-Forwarded-For
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+    
+    # Límite de intentos por IP y por email en login y verificación ('peticiones/segundos')
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory' (un worker) o 'redis' (compartido)
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', CACHE_REDIS_URL)
+    RATE_LIMIT_LOGIN_IP = os.environ.get('RATE_LIMIT_LOGIN_IP', '30/300')
+    RATE_LIMIT_LOGIN_EMAIL = os.environ.get('RATE_LIMIT_LOGIN_EMAIL', '10/300')
+    RATE_LIMIT_VERIFY_IP = os.environ.get('RATE_LIMIT_VERIFY_IP', '30/600')
+    RATE_LIMIT_VERIFY_EMAIL = os.environ.get('RATE_LIMIT_VERIFY_EMAIL', '10/600')
+    RATE_LIMIT_RESEND_IP = os.environ.get('RATE_LIMIT_RESEND_IP', '10/3600')
+    RATE_LIMIT_RESEND_EMAIL = os.environ.get('RATE_LIMIT_RESEND_EMAIL', '3/900')
+    
+    # Métricas de latencia por ruta y por fase en /metrics (formato Prometheus, una serie por worker)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Si se define, /metrics exige 'Authorization: Bearer <token>'
+    
+    # Perfil de consultas SQL: las sentencias que superan el umbral van a un log rotativo con su EXPLAIN PLAN
+    SLOW_QUERY_ENABLED = os.environ.get('SLOW_QUERY_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 500))
+    SLOW_QUERY_LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH')  # Por defecto instance/slow_queries.log
+    SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024))
+    SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    SLOW_QUERY_EXPLAIN_INTERVAL = int(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300))  # Segundos entre planes de la misma sentencia
+    SLOW_QUERY_MAX_STATEMENTS = int(os.environ.get('SLOW_QUERY_MAX_STATEMENTS', 500))  # Sentencias distintas en memoria
+    
     # Validación de contraseñas
     PASSWORD_MIN_LENGTH = 8
     PASSWORD_REQUIRE_UPPERCASE = True
@@ -41,6 +164,12 @@ class Config:
     PASSWORD_REQUIRE_DIGIT = True
     PASSWORD_REQUIRE_SPECIAL = True
     
+    # Hashing bcrypt: coste, procesos dedicados (0 = en el hilo de la petición) y límite de cola
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 32))
+    BCRYPT_TIMEOUT = int(os.environ.get('BCRYPT_TIMEOUT', 10))  # Segundos
+    
     # URL base (IMPORTANTE: usar tu dominio en producción)
     BASE_URL = os.environ.get('BASE_URL', 'https://vulnai.es')  # Cambia localhost por tu dominio
     
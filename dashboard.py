@@ -0,0 +1,514 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+import numpy as np
+import oracledb
+import pandas as pd
+from db_utils import fetch_dataframe, fetch_arrow_batches, arrow_fetch_available
+from metrics import metrics
+
+# Filtros de la query string -> (columna de VISTA_DASHBOARD, operador)
+FILTROS = [
+    ('comunidad', 'comunidad_atencion', '='),
+    ('sexo', 'sexo', '='),
+    ('categoria', 'categoria_diagnostico', '='),
+    ('fecha_inicio', 'fecha_ingreso', '>='),
+    ('fecha_fin', 'fecha_ingreso', '<='),
+]
+
+def parse_filters(args):
+    """Extrae los filtros del dashboard de la query string (vacíos -> None)"""
+    return {nombre: ((args.get(nombre) or '').strip() or None) for nombre, _, _ in FILTROS}
+
+def filter_key(filters):
+    """Tupla normalizada de filtros, en orden fijo, usada como clave de caché"""
+    return tuple(filters.get(nombre) for nombre, _, _ in FILTROS)
+
+# Filtros que se enlazan como DATE en lugar de texto
+FILTROS_FECHA = ('fecha_inicio', 'fecha_fin')
+
+class FilterError(ValueError):
+    """Filtro de la query string que no se puede interpretar (la ruta responde 400)"""
+
+def parse_filter_date(valor):
+    """'2024-03-01' (o ISO completo) -> datetime. Lanza FilterError si no se reconoce"""
+    try:
+        return datetime.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise FilterError(f'Fecha no válida: {valor}')
+
+def build_filter_clause(filters, columnas=None):
+    """
+    Construye la cláusula WHERE con los filtros presentes, en orden fijo y con
+    binds por nombre: cada combinación de filtros es una variante preparada
+    estable (el texto no depende de los valores) y el optimizador ve predicados
+    reales sobre las columnas para usar índices y podar particiones.
+    Las fechas viajan como datetime, no como texto.
+    columnas permite renombrar columnas al filtrar otra tabla (p. ej. el rollup).
+    Returns: (str, dict) - (' AND ...', binds por nombre)
+    """
+    columnas = columnas or {}
+    clause = ''
+    params = {}
+    for nombre, columna, operador in FILTROS:
+        valor = filters.get(nombre)
+        if not valor:
+            continue
+        if nombre in FILTROS_FECHA:
+            valor = parse_filter_date(valor)
+        params[nombre] = valor
+        clause += f' AND {columnas.get(columna, columna)} {operador} :{nombre}'
+    return clause, params
+
+def set_filter_input_sizes(cursor, params):
+    """
+    Enlaza como DATE los binds de fecha presentes en params: un datetime podría
+    viajar como TIMESTAMP y Oracle convertiría la columna en lugar del bind, sin
+    poder usar índices ni podar particiones. Se llama antes de cada execute con
+    build_filter_clause (fetch_df_* no admite setinputsizes).
+    """
+    tipos = {nombre: oracledb.DB_TYPE_DATE for nombre in FILTROS_FECHA if nombre in params}
+    if tipos:
+        cursor.setinputsizes(**tipos)
+
+def aggregate_dataframe(df):
+    """Calcula los agregados del dashboard en pandas a partir de las filas de VISTA_DASHBOARD"""
+    if df.empty:
+        return None
+
+    pacientes_uci = 0
+    dias_uci_promedio = 0
+    ingresos_uci_dict = {}
+
+    if 'DIAS_UCI' in df.columns:
+        df['DIAS_UCI_NUM'] = pd.to_numeric(df['DIAS_UCI'], errors='coerce')
+        df_con_uci = df[df['DIAS_UCI_NUM'] > 0]
+        pacientes_uci = len(df_con_uci)
+
+        if pacientes_uci > 0:
+            dias_uci_promedio = float(df_con_uci['DIAS_UCI_NUM'].mean())
+            if pd.isna(dias_uci_promedio):
+                dias_uci_promedio = 0
+
+        sin_uci = len(df) - pacientes_uci
+        ingresos_uci_dict = {'Sin UCI': sin_uci, 'Con UCI': pacientes_uci}
+
+    estancia_promedio = 0
+    if 'ESTANCIA_DIAS' in df.columns:
+        estancia = pd.to_numeric(df['ESTANCIA_DIAS'], errors='coerce')
+        estancia_promedio = float(estancia.mean())
+        if pd.isna(estancia_promedio):
+            estancia_promedio = 0
+
+    coste_total = 0
+    if 'COSTE_APR' in df.columns:
+        coste = pd.to_numeric(df['COSTE_APR'], errors='coerce')
+        coste_total = float(coste.sum())
+        if pd.isna(coste_total):
+            coste_total = 0
+
+    return {
+        'comunidades': df['COMUNIDAD_ATENCION'].value_counts().to_dict() if 'COMUNIDAD_ATENCION' in df.columns else {},
+        'sexos': df['SEXO'].value_counts().to_dict() if 'SEXO' in df.columns else {},
+        'categorias': df['CATEGORIA_DIAGNOSTICO'].value_counts().to_dict() if 'CATEGORIA_DIAGNOSTICO' in df.columns else {},
+        'ingresos_por_mes': df['MES_INGRESO'].value_counts().sort_index().to_dict() if 'MES_INGRESO' in df.columns else {},
+        'estancia_promedio': estancia_promedio,
+        'coste_total': coste_total,
+        'ingresos_uci': ingresos_uci_dict,
+        'pacientes_uci': pacientes_uci,
+        'dias_uci_promedio': dias_uci_promedio
+    }
+
+# GROUPING_ID(comunidad, sexo, categoria, mes) de cada conjunto de agrupación
+GRUPO_COMUNIDAD = 0b0111
+GRUPO_SEXO = 0b1011
+GRUPO_CATEGORIA = 0b1101
+GRUPO_MES = 0b1110
+GRUPO_TOTAL = 0b1111
+
+AGGREGATE_QUERY = """
+    SELECT GROUPING_ID(comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso) AS grupo,
+           comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso,
+           COUNT(*) AS total,
+           COUNT(estancia_dias) AS n_estancia,
+           SUM(estancia_dias) AS suma_estancia,
+           SUM(coste_apr) AS coste_total,
+           COUNT(CASE WHEN dias_uci > 0 THEN 1 END) AS n_uci,
+           SUM(CASE WHEN dias_uci > 0 THEN dias_uci END) AS suma_uci
+    FROM VISTA_DASHBOARD
+    WHERE 1=1{filtros}
+    GROUP BY GROUPING SETS (
+        (comunidad_atencion), (sexo), (categoria_diagnostico), (mes_ingreso), ()
+    )
+"""
+
+def _ordenar_por_conteo(conteos):
+    """Mismo orden que value_counts(): de mayor a menor frecuencia"""
+    return dict(sorted(conteos.items(), key=lambda item: item[1], reverse=True))
+
+def aggregate_rows(rows):
+    """
+    Construye el resultado del dashboard a partir de las filas de AGGREGATE_QUERY.
+    Devuelve el mismo diccionario que aggregate_dataframe (None si no hay datos).
+    """
+    comunidades, sexos, categorias, meses = {}, {}, {}, {}
+    total = None
+
+    for grupo, comunidad, sexo, categoria, mes, n, n_estancia, suma_estancia, coste, n_uci, suma_uci in rows:
+        if grupo == GRUPO_TOTAL:
+            total = (n, n_estancia, suma_estancia, coste, n_uci, suma_uci)
+        # value_counts() descarta los valores nulos
+        elif grupo == GRUPO_COMUNIDAD and comunidad is not None:
+            comunidades[comunidad] = n
+        elif grupo == GRUPO_SEXO and sexo is not None:
+            sexos[sexo] = n
+        elif grupo == GRUPO_CATEGORIA and categoria is not None:
+            categorias[categoria] = n
+        elif grupo == GRUPO_MES and mes is not None:
+            meses[mes] = n
+
+    # Sobre el rollup, el conjunto vacío da SUM(total) = NULL en lugar de 0
+    if total is None or not total[0]:
+        return None
+
+    n, n_estancia, suma_estancia, coste, n_uci, suma_uci = total
+
+    dias_uci_promedio = float(suma_uci) / n_uci if n_uci else 0
+    estancia_promedio = float(suma_estancia) / n_estancia if n_estancia else 0
+
+    return {
+        'comunidades': _ordenar_por_conteo(comunidades),
+        'sexos': _ordenar_por_conteo(sexos),
+        'categorias': _ordenar_por_conteo(categorias),
+        'ingresos_por_mes': dict(sorted(meses.items())),
+        'estancia_promedio': estancia_promedio,
+        'coste_total': float(coste or 0),
+        'ingresos_uci': {'Sin UCI': n - n_uci, 'Con UCI': n_uci},
+        'pacientes_uci': n_uci,
+        'dias_uci_promedio': dias_uci_promedio
+    }
+
+def aggregate_in_db(cursor, filters):
+    """Agrega en Oracle con GROUPING SETS: solo viajan unas decenas de filas"""
+    filter_clause, params = build_filter_clause(filters)
+    set_filter_input_sizes(cursor, params)
+    cursor.execute(AGGREGATE_QUERY.format(filtros=filter_clause), params)
+    return aggregate_rows(cursor.fetchall())
+
+# Mismos conjuntos de agrupación sobre el rollup: se suman las medidas aditivas
+ROLLUP_AGGREGATE_QUERY = """
+    SELECT GROUPING_ID(comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso) AS grupo,
+           comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso,
+           SUM(total), SUM(n_estancia), SUM(suma_estancia), SUM(coste_total), SUM(n_uci), SUM(suma_uci)
+    FROM {tabla}
+    WHERE 1=1{filtros}
+    GROUP BY GROUPING SETS (
+        (comunidad_atencion), (sexo), (categoria_diagnostico), (mes_ingreso), ()
+    )
+"""
+
+def aggregate_in_rollup(cursor, filters, tabla='DASHBOARD_ROLLUP'):
+    """Agrega desde la tabla resumen: el coste depende del tamaño del cubo, no de los ingresos"""
+    filter_clause, params = build_filter_clause(filters, {'fecha_ingreso': 'fecha_periodo'})
+    set_filter_input_sizes(cursor, params)
+    cursor.execute(ROLLUP_AGGREGATE_QUERY.format(tabla=tabla, filtros=filter_clause), params)
+    return aggregate_rows(cursor.fetchall())
+
+def aggregate_in_pandas(cursor, filters, arraysize=5000, use_arrow=True):
+    """Camino original: descarga todas las filas filtradas y agrega en pandas"""
+    filter_clause, params = build_filter_clause(filters)
+    df = fetch_dataframe(cursor.connection, 'SELECT * FROM VISTA_DASHBOARD WHERE 1=1' + filter_clause,
+                         params, arraysize, use_arrow)
+    with metrics.span('pandas'):
+        return aggregate_dataframe(df)
+
+# ========== KERNEL VECTORIZADO DE AGREGACIÓN ==========
+
+# Columnas que necesita el kernel: histogramas (categóricas) y estadísticas (numéricas)
+KERNEL_CATEGORICAS = ['COMUNIDAD_ATENCION', 'SEXO', 'CATEGORIA_DIAGNOSTICO', 'MES_INGRESO']
+KERNEL_NUMERICAS = ['ESTANCIA_DIAS', 'COSTE_APR', 'DIAS_UCI']
+
+def _to_float(valores):
+    """Columna a float64 (None -> NaN); los valores no numéricos pasan a NaN como en pd.to_numeric"""
+    try:
+        return np.array(valores, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+class AggregationKernel:
+    """
+    Agregados del dashboard en una sola pasada por lote: cada columna categórica se
+    convierte a códigos enteros (diccionario global) y se cuenta con np.bincount, y
+    las numéricas acumulan sumas y recuentos sobre arrays float64. Devuelve lo mismo
+    que aggregate_dataframe sin construir un DataFrame de objetos.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.total = 0
+        self.categorias = {}
+        for columna in KERNEL_CATEGORICAS:
+            if columna in self.columns:
+                self.categorias[columna] = {'codigos': {}, 'conteos': np.zeros(0, dtype=np.int64)}
+        self.n_estancia = 0
+        self.suma_estancia = 0.0
+        self.coste_total = 0.0
+        self.n_uci = 0
+        self.suma_uci = 0.0
+
+    def _add_categorica(self, estado, valores):
+        if isinstance(valores, pd.Categorical):
+            # Ya viene codificada (p. ej. diccionario de Arrow): no hace falta factorizar
+            locales, uniques = valores.codes, valores.categories
+        else:
+            locales, uniques = pd.factorize(np.asarray(valores, dtype=object), use_na_sentinel=True)
+        codigos = estado['codigos']
+        # Traducción de códigos locales del lote a códigos globales
+        mapa = np.fromiter((codigos.setdefault(valor, len(codigos)) for valor in uniques),
+                           dtype=np.int64, count=len(uniques))
+        validos = locales[locales >= 0]  # value_counts() descarta los nulos
+        conteos = np.bincount(mapa[validos], minlength=len(codigos))
+        if len(estado['conteos']) < len(conteos):
+            estado['conteos'] = np.pad(estado['conteos'], (0, len(conteos) - len(estado['conteos'])))
+        estado['conteos'] += conteos
+
+    def add_batch(self, rows):
+        """Acumula un lote de filas (tuplas en el orden de columns)"""
+        if rows:
+            self.add_columns(dict(zip(self.columns, zip(*rows))), len(rows))
+
+    def add_columns(self, columnas, n_filas):
+        """
+        Acumula un lote ya en columnas: secuencias de objetos, arrays de NumPy o
+        pd.Categorical para las categóricas (se usan sus códigos directamente).
+        """
+        self.total += n_filas
+
+        for columna, estado in self.categorias.items():
+            self._add_categorica(estado, columnas[columna])
+
+        if 'ESTANCIA_DIAS' in columnas:
+            estancia = _to_float(columnas['ESTANCIA_DIAS'])
+            validos = ~np.isnan(estancia)
+            self.n_estancia += int(validos.sum())
+            self.suma_estancia += float(estancia[validos].sum())
+
+        if 'COSTE_APR' in columnas:
+            self.coste_total += float(np.nansum(_to_float(columnas['COSTE_APR'])))
+
+        if 'DIAS_UCI' in columnas:
+            dias = _to_float(columnas['DIAS_UCI'])
+            con_uci = dias > 0  # NaN > 0 es False
+            self.n_uci += int(con_uci.sum())
+            self.suma_uci += float(dias[con_uci].sum())
+
+    def _histograma(self, columna, ordenar_por_clave=False):
+        estado = self.categorias.get(columna)
+        if estado is None:
+            return {}
+        conteos = estado['conteos']
+        pares = [(valor, int(conteos[codigo])) for valor, codigo in estado['codigos'].items()
+                 if codigo < len(conteos) and conteos[codigo]]
+        if ordenar_por_clave:
+            return dict(sorted(pares))
+        return dict(sorted(pares, key=lambda item: item[1], reverse=True))
+
+    def result(self):
+        """Mismo diccionario que aggregate_dataframe (None si no hay filas)"""
+        if self.total == 0:
+            return None
+        tiene_uci = 'DIAS_UCI' in self.columns
+        return {
+            'comunidades': self._histograma('COMUNIDAD_ATENCION'),
+            'sexos': self._histograma('SEXO'),
+            'categorias': self._histograma('CATEGORIA_DIAGNOSTICO'),
+            'ingresos_por_mes': self._histograma('MES_INGRESO', ordenar_por_clave=True),
+            'estancia_promedio': self.suma_estancia / self.n_estancia if self.n_estancia else 0,
+            'coste_total': self.coste_total,
+            'ingresos_uci': {'Sin UCI': self.total - self.n_uci, 'Con UCI': self.n_uci} if tiene_uci else {},
+            'pacientes_uci': self.n_uci,
+            'dias_uci_promedio': self.suma_uci / self.n_uci if self.n_uci else 0
+        }
+
+def arrow_columns(tabla):
+    """
+    Columnas de una tabla de pyarrow en el formato de add_columns: las categóricas
+    codificadas como diccionario (pd.Categorical) y las numéricas en float64.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columnas = {}
+    for nombre in tabla.column_names:
+        columna = tabla[nombre]
+        if nombre in KERNEL_CATEGORICAS:
+            columnas[nombre] = columna.dictionary_encode().to_pandas().array
+        elif pa.types.is_integer(columna.type) or pa.types.is_floating(columna.type) \
+                or pa.types.is_decimal(columna.type):
+            columnas[nombre] = pc.cast(columna, pa.float64()).to_numpy()
+        else:
+            columnas[nombre] = columna.to_pylist()
+    return columnas
+
+def aggregate_in_kernel(cursor, filters, arraysize=5000, use_arrow=True):
+    """
+    Descarga solo las columnas necesarias por lotes y agrega con AggregationKernel.
+    Con Arrow los lotes llegan ya tipados y no se crea ningún objeto por fila.
+    """
+    filter_clause, params = build_filter_clause(filters)
+    columnas = KERNEL_CATEGORICAS + KERNEL_NUMERICAS
+    sql = f'SELECT {", ".join(columnas)} FROM VISTA_DASHBOARD WHERE 1=1' + filter_clause
+    kernel = AggregationKernel(columnas)
+
+    if use_arrow and arrow_fetch_available(cursor.connection):
+        for tabla in fetch_arrow_batches(cursor.connection, sql, params, arraysize):
+            with metrics.span('kernel'):
+                kernel.add_columns(arrow_columns(tabla), tabla.num_rows)
+        return kernel.result()
+
+    cursor.arraysize = arraysize
+    cursor.prefetchrows = arraysize + 1
+    set_filter_input_sizes(cursor, params)
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        with metrics.span('kernel'):
+            kernel.add_batch(rows)
+    return kernel.result()
+
+# ========== SENTENCIAS DE /api/table ==========
+
+TABLE_COUNT_QUERY = 'SELECT COUNT(*) FROM VISTA_DASHBOARD WHERE 1=1{filtros}'
+
+# Límites de página como binds: todas las páginas comparten la misma sentencia
+TABLE_PAGE_QUERY = (
+    'SELECT * FROM (SELECT a.*, ROWNUM rnum FROM (SELECT * FROM VISTA_DASHBOARD WHERE 1=1{filtros}) a'
+    ' WHERE ROWNUM <= :max_fila) WHERE rnum > :min_fila'
+)
+
+KEYSET_PAGE_QUERY = (
+    'SELECT * FROM VISTA_DASHBOARD WHERE 1=1{filtros}'
+    ' ORDER BY fecha_ingreso {orden}, id {orden} FETCH FIRST :n_filas ROWS ONLY'
+)
+
+# ========== PAGINACIÓN POR CLAVE (KEYSET) PARA /api/table ==========
+
+def encode_cursor(fecha, id_, direccion):
+    """Cursor opaco con la clave de orden (fecha_ingreso, id) de la fila frontera"""
+    payload = {'f': fecha.isoformat() if fecha is not None else None, 'i': id_, 'd': direccion}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    """Returns: (datetime|None, id, 'next'|'prev'). Lanza ValueError si el cursor no es válido"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        fecha = datetime.fromisoformat(payload['f']) if payload['f'] is not None else None
+        direccion = payload['d']
+        if direccion not in ('next', 'prev'):
+            raise ValueError(direccion)
+        return fecha, int(payload['i']), direccion
+    except Exception:
+        raise ValueError('Cursor de paginación inválido')
+
+def build_seek_clause(fecha, id_, direccion, params):
+    """
+    Predicado de búsqueda por clave para ORDER BY fecha_ingreso, id (NULLS LAST).
+    Añade los binds :k_fecha y :k_id a params y devuelve la cláusula ' AND (...)'.
+    """
+    params['k_id'] = id_
+    if fecha is None:
+        if direccion == 'next':
+            return ' AND (fecha_ingreso IS NULL AND id > :k_id)'
+        return ' AND (fecha_ingreso IS NOT NULL OR id < :k_id)'
+
+    params['k_fecha'] = fecha
+    if direccion == 'next':
+        return (' AND (fecha_ingreso > :k_fecha OR (fecha_ingreso = :k_fecha AND id > :k_id)'
+                ' OR fecha_ingreso IS NULL)')
+    return ' AND (fecha_ingreso < :k_fecha OR (fecha_ingreso = :k_fecha AND id < :k_id))'
+
+def fetch_keyset_page(cursor, filters, per_page, token=None):
+    """
+    Página de VISTA_DASHBOARD a partir de un cursor: el coste no depende de la profundidad.
+    Returns: (columns, rows, next_cursor, prev_cursor)
+    """
+    filter_clause, params = build_filter_clause(filters)
+
+    direccion = 'next'
+    if token:
+        fecha, id_, direccion = decode_cursor(token)
+        filter_clause += build_seek_clause(fecha, id_, direccion, params)
+
+    orden = 'ASC' if direccion == 'next' else 'DESC'
+    params['n_filas'] = per_page + 1  # Una fila extra para saber si hay más páginas
+    set_filter_input_sizes(cursor, params)
+    cursor.execute(KEYSET_PAGE_QUERY.format(filtros=filter_clause, orden=orden), params)
+    columns = [desc[0] for desc in cursor.description]
+    rows = cursor.fetchall()
+
+    hay_mas = len(rows) > per_page
+    rows = rows[:per_page]
+    if direccion == 'prev':
+        rows.reverse()
+
+    if not rows:
+        return columns, rows, None, None
+
+    i_fecha = columns.index('FECHA_INGRESO')
+    i_id = columns.index('ID')
+    primera, ultima = rows[0], rows[-1]
+
+    # Hacia delante siempre hay anterior si venimos de un cursor; hacia atrás, siempre hay siguiente
+    tiene_siguiente = hay_mas if direccion == 'next' else True
+    tiene_anterior = bool(token) if direccion == 'next' else hay_mas
+
+    next_cursor = encode_cursor(ultima[i_fecha], ultima[i_id], 'next') if tiene_siguiente else None
+    prev_cursor = encode_cursor(primera[i_fecha], primera[i_id], 'prev') if tiene_anterior else None
+    return columns, rows, next_cursor, prev_cursor
+
+# ========== EXPORTACIÓN EN STREAMING ==========
+
+def _json_default(valor):
+    """Serializa fechas y decimales para NDJSON"""
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return str(valor)
+
+def stream_export(cursor, filters, formato='csv', arraysize=5000):
+    """
+    Genera el export de VISTA_DASHBOARD por lotes de fetchmany: la memoria es
+    constante (un lote) independientemente del número de filas.
+    """
+    filter_clause, params = build_filter_clause(filters)
+    cursor.arraysize = arraysize
+    cursor.prefetchrows = arraysize + 1
+    set_filter_input_sizes(cursor, params)
+    cursor.execute('SELECT * FROM VISTA_DASHBOARD WHERE 1=1' + filter_clause, params)
+    columns = [desc[0] for desc in cursor.description]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if formato == 'csv':
+        writer.writerow(columns)
+        yield buffer.getvalue()
+
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        buffer.seek(0)
+        buffer.truncate(0)
+        if formato == 'csv':
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False))
+                buffer.write('\n')
+        yield buffer.getvalue()
+
+    cursor.close()
@@ -0,0 +1,192 @@
+import secrets
+import threading
+import time
+import oracledb
+import pandas as pd
+from flask import g
+from metrics import metrics
+
+class DatabasePool:
+    """Pool de sesiones Oracle compartido por todas las peticiones"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.pool = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.acquisitions = 0
+        self.releases = 0
+        self.errors = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Registra el pool en la app y el teardown que devuelve las conexiones"""
+        self.app = app
+        app.teardown_appcontext(self.release_connection)
+
+    def get_pool(self):
+        """Crea el pool la primera vez que se necesita (evita conectar al importar)"""
+        if self.pool is None:
+            with self._lock:
+                if self.pool is None:
+                    config = self.app.config
+                    self.pool = oracledb.create_pool(
+                        user=config['DB_USER'],
+                        password=config['DB_PASSWORD'],
+                        dsn=config['DB_DSN'],
+                        wallet_location=config['WALLET_LOCATION'],
+                        wallet_password=config['WALLET_PASSWORD'],
+                        min=config['DB_POOL_MIN'],
+                        max=config['DB_POOL_MAX'],
+                        increment=config['DB_POOL_INCREMENT'],
+                        timeout=config['DB_POOL_TIMEOUT'],
+                        getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+                        wait_timeout=config['DB_POOL_WAIT_TIMEOUT'],
+                        ping_interval=config['DB_POOL_PING_INTERVAL'],
+                        stmtcachesize=config['DB_STMT_CACHE_SIZE']
+                    )
+        return self.pool
+
+    def get_connection(self):
+        """
+        Devuelve la conexión de la petición actual, sacándola del pool si hace falta.
+        La conexión se libera en el teardown, también cuando la ruta lanza una excepción.
+        """
+        if 'db_conn' not in g:
+            start = time.perf_counter()
+            try:
+                with metrics.span('db_acquire'):
+                    g.db_conn = self.get_pool().acquire()
+            except Exception:
+                with self._stats_lock:
+                    self.errors += 1
+                raise
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.acquisitions += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+        # Al pool se devuelve siempre la conexión original (g.db_conn), nunca el envoltorio
+        return metrics.wrap_connection(g.db_conn)
+
+    def release_connection(self, exception=None):
+        """Devuelve la conexión al pool al terminar la petición"""
+        conn = g.pop('db_conn', None)
+        if conn is None:
+            return
+        try:
+            if exception is not None:
+                conn.rollback()
+            self.pool.release(conn)
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            try:
+                self.pool.drop(conn)
+            except Exception:
+                pass
+        else:
+            with self._stats_lock:
+                self.releases += 1
+
+    def get_stats(self):
+        """Estadísticas del pool y de uso desde el arranque del proceso"""
+        with self._stats_lock:
+            stats = {
+                'acquisitions': self.acquisitions,
+                'releases': self.releases,
+                'errors': self.errors,
+                'wait_time_avg_ms': (self.wait_time_total / self.acquisitions * 1000) if self.acquisitions else 0,
+                'wait_time_max_ms': self.wait_time_max * 1000
+            }
+
+        if self.pool is None:
+            stats.update({'initialized': False})
+            return stats
+
+        stats.update({
+            'initialized': True,
+            'opened': self.pool.opened,
+            'busy': self.pool.busy,
+            'min': self.pool.min,
+            'max': self.pool.max,
+            'increment': self.pool.increment,
+            'timeout': self.pool.timeout,
+            'wait_timeout': self.pool.wait_timeout
+        })
+        return stats
+
+def explain_plan(cursor, sql, params=None):
+    """
+    Estimación del optimizador para una consulta sin ejecutarla
+    Returns: dict - {'cost', 'cardinality', 'bytes'} de la raíz del plan
+    """
+    statement_id = f'app_{secrets.token_hex(8)}'  # STATEMENT_ID admite 30 caracteres
+    cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}", params or [])
+    cursor.execute("""
+        SELECT cost, cardinality, bytes
+        FROM plan_table
+        WHERE statement_id = :1 AND id = 0
+    """, [statement_id])
+    row = cursor.fetchone()
+    cursor.execute("DELETE FROM plan_table WHERE statement_id = :1", [statement_id])
+    if row is None:
+        return {'cost': None, 'cardinality': None, 'bytes': None}
+    cost, cardinality, bytes_ = row
+    return {'cost': cost, 'cardinality': cardinality, 'bytes': bytes_}
+
+def _lobs_as_values(cursor, metadata):
+    """outputtypehandler: CLOB/BLOB como str/bytes en lugar de objetos LOB (una ida y vuelta menos por valor)"""
+    if metadata.type_code in (oracledb.DB_TYPE_CLOB, oracledb.DB_TYPE_NCLOB):
+        return cursor.var(oracledb.DB_TYPE_LONG, arraysize=cursor.arraysize)
+    if metadata.type_code is oracledb.DB_TYPE_BLOB:
+        return cursor.var(oracledb.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
+
+def arrow_fetch_available(conn):
+    """True si la conexión puede devolver data frames Arrow (python-oracledb 3+ y pyarrow instalado)"""
+    if not hasattr(conn, 'fetch_df_all'):
+        return False
+    try:
+        import pyarrow  # noqa: F401  Dependencia opcional
+    except ImportError:
+        return False
+    return True
+
+def fetch_dataframe(conn, sql, params=None, arraysize=1000, use_arrow=True, max_rows=None):
+    """
+    Resultado de una consulta como DataFrame de pandas. Con Arrow las filas llegan
+    en columnas tipadas sin crear una tupla de objetos por fila; si no está
+    disponible se usa un cursor con arraysize/prefetchrows ajustados.
+    Con max_rows se leen como mucho esas filas (fetchmany, sin modificar el SQL) y
+    siempre por cursor: el resultado es pequeño y se conservan las columnas aunque
+    no haya filas.
+    """
+    if use_arrow and max_rows is None and arrow_fetch_available(conn):
+        import pyarrow as pa
+        odf = conn.fetch_df_all(sql, params or [], arraysize)
+        with metrics.span('dataframe'):
+            return pa.table(odf).to_pandas()
+
+    cursor = conn.cursor()
+    try:
+        cursor.arraysize = arraysize
+        cursor.prefetchrows = arraysize + 1
+        cursor.outputtypehandler = _lobs_as_values
+        cursor.execute(sql, params or [])
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+        with metrics.span('dataframe'):
+            return pd.DataFrame(rows, columns=columns)
+    finally:
+        cursor.close()
+
+def fetch_arrow_batches(conn, sql, params=None, size=5000):
+    """Lotes del resultado como tablas de pyarrow (requiere arrow_fetch_available)"""
+    import pyarrow as pa
+    for batch in conn.fetch_df_batches(sql, params or [], size):
+        yield pa.table(batch)
+
+db_pool = DatabasePool()
@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from email_utils import mail, MESSAGE_BUILDERS
+from metrics import metrics
+
+class EmailOutbox:
+    """
+    Cola de salida persistente (SQLite local) para los emails de la aplicación.
+    Las peticiones solo encolan; un hilo en segundo plano envía por lotes
+    reutilizando la conexión SMTP y reintenta con backoff exponencial.
+    Los parámetros (p. ej. códigos de verificación en claro) se borran en cuanto
+    el mensaje se envía o se descarta, y la fila entera tras retention segundos.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.path = None
+        self.batch_size = 20
+        self.max_attempts = 5
+        self.backoff_base = 30
+        self.poll_interval = 2
+        self.sending_timeout = 300
+        self.retention = 7 * 86400
+        self.purge_interval = 3600
+        self._last_purge = 0
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.errors = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['EMAIL_OUTBOX_ENABLED']
+        self.path = app.config['EMAIL_OUTBOX_PATH'] or os.path.join(app.instance_path, 'outbox.sqlite3')
+        self.batch_size = app.config['EMAIL_OUTBOX_BATCH_SIZE']
+        self.max_attempts = app.config['EMAIL_OUTBOX_MAX_ATTEMPTS']
+        self.backoff_base = app.config['EMAIL_OUTBOX_BACKOFF']
+        self.retention = app.config['EMAIL_OUTBOX_RETENTION']
+        if self.enabled:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with self._connect() as db:
+                db.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        recipient TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL,
+                        claimed_at REAL,
+                        last_error TEXT,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+                # Filas terminadas de versiones anteriores que aún guardan los parámetros
+                db.execute("UPDATE outbox SET params = '{}' WHERE status IN ('sent', 'failed') AND params != '{}'")
+            # El hilo se arranca en la primera petición (no en el import, por el fork de gunicorn)
+            app.before_request(self._ensure_sender)
+
+    @contextmanager
+    def _connect(self):
+        """Conexión SQLite por operación: confirma al salir y se cierra siempre"""
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def send(self, kind, recipient, **params):
+        """
+        Encola un email (o lo envía directamente si la cola está desactivada).
+        Returns: bool - True si se ha encolado/enviado, False si no se pudo guardar
+        en la cola (p. ej. disco lleno o SQLite bloqueado) y el email no saldrá
+        """
+        if kind not in MESSAGE_BUILDERS:
+            raise ValueError(f'Tipo de email desconocido: {kind}')
+
+        if not self.enabled:
+            try:
+                message = MESSAGE_BUILDERS[kind](recipient, **params)
+                with metrics.span('smtp_send'):
+                    mail.send(message)
+                return True
+            except Exception:
+                self.app.logger.exception('Error al enviar email')
+                return False
+
+        ahora = time.time()
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT INTO outbox (kind, recipient, params, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, recipient, json.dumps(params), ahora, ahora)
+                )
+        except sqlite3.Error:
+            self.app.logger.exception('Error al encolar email')
+            return False
+        self._ensure_sender()
+        self._wake.set()
+        return True
+
+    def _ensure_sender(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._sender_loop, name='email-outbox', daemon=True)
+                    self._thread.start()
+
+    def _claim_batch(self):
+        """Reserva mensajes vencidos; el UPDATE condicional evita que dos workers envíen el mismo"""
+        ahora = time.time()
+        with self._connect() as db:
+            # Libera reservas de envíos que se quedaron a medias (worker caído)
+            db.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                (ahora - self.sending_timeout,)
+            )
+            rows = db.execute(
+                """SELECT id, kind, recipient, params, attempts FROM outbox
+                   WHERE status = 'pending' AND next_attempt_at <= ?
+                   ORDER BY next_attempt_at LIMIT ?""",
+                (ahora, self.batch_size)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                cur = db.execute(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ? AND status = 'pending'",
+                    (ahora, row[0])
+                )
+                if cur.rowcount:
+                    claimed.append(row)
+        return claimed
+
+    def _mark(self, msg_id, attempts, error=None):
+        """Registra el resultado de un intento; los mensajes terminados se quedan sin parámetros"""
+        with self._connect() as db:
+            if error is None and not self.retention:
+                db.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+            elif error is None:
+                db.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, params = '{}' WHERE id = ?",
+                    (attempts, msg_id)
+                )
+            elif attempts >= self.max_attempts:
+                db.execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, params = '{}' WHERE id = ?",
+                    (attempts, error, msg_id)
+                )
+            else:
+                retry_at = time.time() + self.backoff_base * (2 ** (attempts - 1))
+                db.execute(
+                    """UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?,
+                       next_attempt_at = ? WHERE id = ?""",
+                    (attempts, error, retry_at, msg_id)
+                )
+
+    def process_batch(self):
+        """Envía un lote de mensajes pendientes con una sola conexión SMTP. Returns: int enviados"""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        enviados = 0
+        pendientes = list(batch)
+        with self.app.app_context():
+            try:
+                with mail.connect() as smtp:
+                    while pendientes:
+                        msg_id, kind, recipient, params, attempts = pendientes[0]
+                        try:
+                            message = MESSAGE_BUILDERS[kind](recipient, **json.loads(params))
+                            with metrics.span('smtp_send'):
+                                smtp.send(message)
+                        except Exception as e:
+                            self._mark(msg_id, attempts + 1, str(e))
+                            with self._lock:
+                                self.errors += 1
+                        else:
+                            self._mark(msg_id, attempts + 1)
+                            enviados += 1
+                            with self._lock:
+                                self.sent += 1
+                        pendientes.pop(0)
+            except Exception as e:
+                # Fallo de conexión SMTP: se reprograman los que no llegaron a intentarse
+                for msg_id, _, _, _, attempts in pendientes:
+                    self._mark(msg_id, attempts + 1, f'SMTP: {e}')
+        return enviados
+
+    def purge(self):
+        """Borra los mensajes enviados o descartados hace más de retention segundos. Returns: int borrados"""
+        with self._connect() as db:
+            cur = db.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND claimed_at < ?",
+                (time.time() - self.retention,)
+            )
+        self._last_purge = time.monotonic()
+        return cur.rowcount
+
+    def _sender_loop(self):
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_purge > self.purge_interval:
+                    self.purge()
+                if self.process_batch():
+                    continue
+            except Exception:
+                self.app.logger.exception('Error en la cola de emails')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def get_stats(self):
+        stats = {'enabled': self.enabled, 'sent': self.sent, 'errors': self.errors, 'retention': self.retention}
+        if self.enabled:
+            with self._connect() as db:
+                stats['by_status'] = dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return stats
+
+email_outbox = EmailOutbox()
@@ -1,33 +1,74 @@
+import html
+import re
+from flask import current_app
 from flask_mail import Mail, Message
-from datetime import datetime
+from metrics import metrics
 
 mail = Mail()
 
-def send_verification_code_email(user_email, user_name, code):
-    """Envía email con código de verificación"""
-    
-    html_body = f"""
+class CompiledEmailTemplate:
+    """
+    Plantilla de email compilada una sola vez al importar: se parte en trozos fijos
+    y huecos $campo, así cada envío solo concatena los valores (escapados en HTML).
+    Genera también la alternativa en texto plano.
+    """
+
+    _CAMPO = re.compile(r'\$(\w+)')
+
+    def __init__(self, subject, html_body, text_body):
+        self.subject = self._compile(subject)
+        self.html = self._compile(html_body)
+        self.text = self._compile(text_body)
+
+    @classmethod
+    def _compile(cls, source):
+        """Returns: list - trozos alternos [literal, campo, literal, campo, ...]"""
+        return cls._CAMPO.split(source)
+
+    @staticmethod
+    def _render(parts, params, escape):
+        out = list(parts)
+        for i in range(1, len(out), 2):
+            valor = str(params[out[i]])
+            out[i] = html.escape(valor) if escape else valor
+        return ''.join(out)
+
+    def render(self, **params):
+        """Returns: (asunto, html, texto)"""
+        return (
+            self._render(self.subject, params, False),
+            self._render(self.html, params, True),
+            self._render(self.text, params, False)
+        )
+
+    def message(self, recipient, **params):
+        subject, html_body, text_body = self.render(**params)
+        return Message(subject=subject, recipients=[recipient], html=html_body, body=text_body)
+
+VERIFICATION_CODE_TEMPLATE = CompiledEmailTemplate(
+    subject="🔐 Tu código de verificación: $code",
+    html_body="""
     <!DOCTYPE html>
     <html>
     <head>
         <style>
-            body {{ font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }}
-            .container {{ max-width: 600px; margin: 0 auto; background: #f5f5f5; }}
-            .header {{ 
+            body { font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }
+            .container { max-width: 600px; margin: 0 auto; background: #f5f5f5; }
+            .header { 
                 background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
                 color: white; 
                 padding: 40px 20px; 
                 text-align: center; 
                 border-radius: 10px 10px 0 0; 
-            }}
-            .header h1 {{ margin: 0; font-size: 28px; }}
-            .content {{ 
+            }
+            .header h1 { margin: 0; font-size: 28px; }
+            .content { 
                 background: white; 
                 padding: 40px 30px; 
                 border-radius: 0 0 10px 10px; 
                 box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }}
-            .code-box {{ 
+            }
+            .code-box { 
                 background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
                 color: white;
                 padding: 25px;
@@ -35,8 +76,8 @@ def send_verification_code_email(user_email, user_name, code):
                 border-radius: 10px;
                 margin: 30px 0;
                 box-shadow: 0 4px 15px rgba(102, 126, 234, 0.4);
-            }}
-            .code {{ 
+            }
+            .code { 
                 font-size: 36px; 
                 font-weight: bold; 
                 letter-spacing: 8px; 
@@ -45,21 +86,21 @@ def send_verification_code_email(user_email, user_name, code):
                 padding: 10px 20px;
                 background: rgba(255, 255, 255, 0.2);
                 border-radius: 8px;
-            }}
-            .warning {{ 
+            }
+            .warning { 
                 background: #fff3cd; 
                 border-left: 4px solid #ffc107; 
                 padding: 15px; 
                 margin: 20px 0; 
                 border-radius: 4px;
-            }}
-            .footer {{ 
+            }
+            .footer { 
                 text-align: center; 
                 padding: 20px; 
                 color: #999; 
                 font-size: 12px; 
-            }}
-            .icon {{ font-size: 48px; margin-bottom: 10px; }}
+            }
+            .icon { font-size: 48px; margin-bottom: 10px; }
         </style>
     </head>
     <body>
@@ -70,13 +111,13 @@ def send_verification_code_email(user_email, user_name, code):
                 <p style="margin: 10px 0 0 0; opacity: 0.9;">Verificación de Cuenta</p>
             </div>
             <div class="content">
-                <h2 style="color: #667eea; margin-top: 0;">¡Hola {user_name}! 👋</h2>
+                <h2 style="color: #667eea; margin-top: 0;">¡Hola $user_name! 👋</h2>
                 <p>Gracias por registrarte en nuestro Dashboard de Análisis de Salud Mental.</p>
                 <p><strong>Tu código de verificación es:</strong></p>
                 
                 <div class="code-box">
                     <div style="font-size: 14px; margin-bottom: 10px; opacity: 0.9;">Código de verificación</div>
-                    <div class="code">{code}</div>
+                    <div class="code">$code</div>
                     <div style="font-size: 12px; margin-top: 10px; opacity: 0.8;">Expira en 10 minutos</div>
                 </div>
                 
@@ -102,52 +143,55 @@ def send_verification_code_email(user_email, user_name, code):
         </div>
     </body>
     </html>
-    """
-    
-    msg = Message(
-        subject=f"🔐 Tu código de verificación: {code}",
-        recipients=[user_email],
-        html=html_body
-    )
-    
-    try:
-        mail.send(msg)
-        return True
-    except Exception as e:
-        print(f"Error al enviar email: {e}")
-        return False
+    """,
+    text_body="""¡Hola $user_name!
 
-def send_welcome_email(user_email, user_name):
-    """Envía email de bienvenida después de verificar"""
-    
-    html_body = f"""
+Gracias por registrarte en nuestro Dashboard de Análisis de Salud Mental.
+
+Tu código de verificación es: $code
+
+Introduce este código en la página de verificación para activar tu cuenta.
+
+Importante:
+- Este código es válido solo por 10 minutos
+- No compartas este código con nadie
+- Si no solicitaste este registro, ignora este email
+
+Salud Mental Dashboard - Malackathon 2025
+Este es un correo automático, por favor no respondas a este mensaje.
+"""
+)
+
+WELCOME_TEMPLATE = CompiledEmailTemplate(
+    subject="🎉 ¡Bienvenido a Salud Mental Dashboard!",
+    html_body="""
     <!DOCTYPE html>
     <html>
     <head>
         <style>
-            body {{ font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }}
-            .container {{ max-width: 600px; margin: 0 auto; background: #f5f5f5; }}
-            .header {{ 
+            body { font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; }
+            .container { max-width: 600px; margin: 0 auto; background: #f5f5f5; }
+            .header { 
                 background: linear-gradient(135deg, #28a745 0%, #20c997 100%); 
                 color: white; 
                 padding: 40px 20px; 
                 text-align: center; 
                 border-radius: 10px 10px 0 0; 
-            }}
-            .content {{ 
+            }
+            .content { 
                 background: white; 
                 padding: 40px 30px; 
                 border-radius: 0 0 10px 10px; 
                 box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-            }}
-            .feature {{ 
+            }
+            .feature { 
                 padding: 15px; 
                 margin: 10px 0; 
                 background: #f8f9fa; 
                 border-left: 4px solid #667eea; 
                 border-radius: 4px;
-            }}
-            .footer {{ text-align: center; padding: 20px; color: #999; font-size: 12px; }}
+            }
+            .footer { text-align: center; padding: 20px; color: #999; font-size: 12px; }
         </style>
     </head>
     <body>
@@ -157,7 +201,7 @@ def send_welcome_email(user_email, user_name):
                 <h1>¡Cuenta Verificada!</h1>
             </div>
             <div class="content">
-                <h2 style="color: #28a745;">¡Bienvenido {user_name}!</h2>
+                <h2 style="color: #28a745;">¡Bienvenido $user_name!</h2>
                 <p>Tu cuenta ha sido <strong>verificada exitosamente</strong>. Ya puedes acceder a todas las funcionalidades del Dashboard.</p>
                 
                 <h3 style="color: #667eea;">¿Qué puedes hacer ahora?</h3>
@@ -190,17 +234,76 @@ def send_welcome_email(user_email, user_name):
         </div>
     </body>
     </html>
-    """
-    
-    msg = Message(
-        subject="🎉 ¡Bienvenido a Salud Mental Dashboard!",
-        recipients=[user_email],
-        html=html_body
-    )
-    
+    """,
+    text_body="""¡Bienvenido $user_name!
+
+Tu cuenta ha sido verificada exitosamente. Ya puedes acceder a todas las funcionalidades del Dashboard.
+
+¿Qué puedes hacer ahora?
+- Análisis de Datos: explora datos de salud mental de diferentes comunidades
+- Visualizaciones: gráficos interactivos y estadísticas en tiempo real
+- Tablas de Datos: consulta información detallada con filtros avanzados
+- Filtros Personalizados: filtra por comunidad, categoría, fechas y más
+
+¡Gracias por unirte a nosotros y contribuir al análisis de la salud mental!
+
+Salud Mental Dashboard - Malackathon 2025
+"""
+)
+
+def build_verification_code_message(user_email, user_name, code):
+    """Construye el email con código de verificación"""
+    return VERIFICATION_CODE_TEMPLATE.message(user_email, user_name=user_name, code=code)
+
+def send_verification_code_email(user_email, user_name, code):
+    """Envía email con código de verificación"""
+    try:
+        mail.send(build_verification_code_message(user_email, user_name, code))
+        return True
+    except Exception:
+        current_app.logger.exception('Error al enviar email de verificación')
+        return False
+
+def build_welcome_message(user_email, user_name):
+    """Construye el email de bienvenida después de verificar"""
+    return WELCOME_TEMPLATE.message(user_email, user_name=user_name)
+
+def send_welcome_email(user_email, user_name):
+    """Envía email de bienvenida después de verificar"""
     try:
-        mail.send(msg)
+        mail.send(build_welcome_message(user_email, user_name))
         return True
-    except Exception as e:
-        print(f"Error al enviar email de bienvenida: {e}")
+    except Exception:
+        current_app.logger.exception('Error al enviar email de bienvenida')
         return False
+
+# Constructores por tipo de email, usados por la cola de salida
+MESSAGE_BUILDERS = {
+    'verification_code': build_verification_code_message,
+    'welcome': build_welcome_message,
+}
+
+def render_batch(kind, items):
+    """
+    Renderiza muchos emails del mismo tipo (p. ej. una campaña de re-verificación).
+    items: iterable de (email, {parámetros}). Returns: list de Message
+    """
+    builder = MESSAGE_BUILDERS[kind]
+    return [builder(recipient, **params) for recipient, params in items]
+
+def send_batch(kind, items):
+    """
+    Envía un lote por una única conexión SMTP.
+    Returns: (int, list) - (enviados, [(posición en items, error)] de los que fallaron)
+    """
+    enviados, fallos = 0, []
+    with mail.connect() as conn:
+        for posicion, msg in enumerate(render_batch(kind, items)):
+            try:
+                with metrics.span('smtp_send'):
+                    conn.send(msg)
+                enviados += 1
+            except Exception as e:
+                current_app.logger.exception('Error al enviar email del lote')
+                fallos.append((posicion, str(e)))
+    return enviados, fallos
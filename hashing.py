@@ -0,0 +1,125 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _verify(password, password_hash):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except Exception:
+        return False
+
+def hash_rounds(password_hash):
+    """Coste bcrypt de un hash ($2b$12$... -> 12), None si no se reconoce"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class HashingOverloaded(Exception):
+    """
+    bcrypt no puede atender ahora: demasiadas operaciones pendientes, no ha
+    terminado en BCRYPT_TIMEOUT segundos o el pool de procesos se ha roto.
+    Las rutas responden 503 con Retry-After.
+    """
+
+class PasswordHasher:
+    """
+    Hashing y verificación bcrypt en un pool de procesos dedicado, fuera de los
+    hilos de las peticiones. Con BCRYPT_WORKERS = 0 se ejecuta en línea.
+    """
+
+    def __init__(self):
+        self.rounds = 12
+        self.workers = 0
+        self.max_pending = 32
+        self.timeout = 10
+        self.executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def init_app(self, app):
+        self.rounds = app.config['BCRYPT_ROUNDS']
+        self.workers = app.config['BCRYPT_WORKERS']
+        self.max_pending = app.config['BCRYPT_MAX_PENDING']
+        self.timeout = app.config['BCRYPT_TIMEOUT']
+
+    def _get_executor(self):
+        if self.executor is None:
+            with self._lock:
+                if self.executor is None:
+                    # spawn: no heredar hilos ni sockets del worker web (pool Oracle, SMTP...)
+                    self.executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self.executor
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded('Servicio de autenticación saturado, inténtalo en unos segundos')
+            self.pending += 1
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            self._release()
+            # Un proceso murió (p. ej. OOM): el pool ya no acepta trabajo, se crea otro en la siguiente llamada
+            with self._lock:
+                self.executor = None
+            raise HashingOverloaded('Servicio de autenticación no disponible, inténtalo en unos segundos')
+        except BaseException:
+            self._release()
+            raise
+        # pending baja cuando el proceso termina de verdad (o se cancela antes de empezar),
+        # no cuando la petición deja de esperar: así refleja la ocupación real del pool
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            future.cancel()  # Si aún no ha empezado, no ocupa un proceso
+            with self._lock:
+                self.timeouts += 1
+            raise HashingOverloaded('El servicio de autenticación tarda demasiado, inténtalo en unos segundos')
+        except BrokenProcessPool:
+            with self._lock:
+                self.executor = None
+            raise HashingOverloaded('Servicio de autenticación no disponible, inténtalo en unos segundos')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(_verify, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True si el hash se generó con un coste distinto del configurado"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts
+            }
+
+password_hasher = PasswordHasher()
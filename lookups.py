@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+import time
+
+class FilterOptions:
+    """
+    Opciones de los desplegables de filtros (comunidades, sexos, categorías).
+    Se cargan una vez y se mantienen en memoria hasta que vence el intervalo de refresco.
+    """
+
+    def __init__(self, refresh_seconds=3600):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._data = None
+        self._etag = None
+        self._loaded_at = 0.0
+
+    def init_app(self, app):
+        self.refresh_seconds = app.config['LOOKUP_REFRESH_SECONDS']
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT nombre_comunidad FROM COMUNIDADES ORDER BY nombre_comunidad')
+        comunidades = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute('SELECT DISTINCT sexo FROM INGRESOS WHERE sexo IS NOT NULL ORDER BY sexo')
+        sexos = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute('SELECT nombre_categoria FROM CATEGORIAS_DIAGNOSTICO ORDER BY nombre_categoria')
+        categorias = [row[0] for row in cursor.fetchall()]
+
+        cursor.close()
+        return {'comunidades': comunidades, 'sexos': sexos, 'categorias': categorias}
+
+    def is_stale(self):
+        return self._data is None or time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    def get(self, get_connection):
+        """
+        Returns: (dict, str) - (opciones, etag). Solo consulta la BD si los datos han caducado;
+        get_connection se llama de forma perezosa para no sacar una conexión del pool en vano.
+        """
+        if self.is_stale():
+            with self._lock:
+                if self.is_stale():
+                    data = self._load(get_connection())
+                    payload = json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+                    self._etag = hashlib.sha1(payload).hexdigest()
+                    self._data = data
+                    self._loaded_at = time.monotonic()
+        return self._data, self._etag
+
+    def invalidate(self):
+        """Fuerza la recarga en la próxima petición"""
+        with self._lock:
+            self._data = None
+
+filter_options = FilterOptions()
@@ -0,0 +1,305 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from flask import g, request, has_request_context
+from profiler import query_profiler
+
+# Límites de los histogramas en segundos (los mismos que usa prometheus_client por defecto)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(nombres, valores):
+    if not nombres:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(nombres, valores)) + '}'
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, valor):
+        with self._lock:
+            serie = self._series.get(labels)
+            if serie is None:
+                serie = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            indice = bisect.bisect_left(self.buckets, valor)
+            if indice < len(self.buckets):
+                serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def render(self):
+        lineas = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for labels, (conteos, suma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                le = _labels(self.label_names + ('le',), labels + (repr(limite),))
+                lineas.append(f'{self.name}_bucket{le} {acumulado}')
+            lineas.append(f'{self.name}_bucket{_labels(self.label_names + ("le",), labels + ("+Inf",))} {total}')
+            lineas.append(f'{self.name}_sum{_labels(self.label_names, labels)} {suma}')
+            lineas.append(f'{self.name}_count{_labels(self.label_names, labels)} {total}')
+        return lineas
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, labels, valor=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + valor
+
+    def render(self):
+        lineas = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for labels, valor in sorted(series.items()):
+            lineas.append(f'{self.name}{_labels(self.label_names, labels)} {valor}')
+        return lineas
+
+# Ruta de la petición en curso, fijada en before_request: leer request.url_rule en cada fase cuesta ~2 µs
+_ruta_actual = ContextVar('metrics_route', default=None)
+
+def current_route():
+    """Plantilla de la ruta en curso ('/api/data'), 'background' fuera de una petición"""
+    ruta = _ruta_actual.get()
+    if ruta is not None:
+        return ruta
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return 'background'
+
+class InstrumentedCursor:
+    """
+    Cursor de oracledb que mide execute/fetch, cuenta filas y pasa cada sentencia
+    al perfil de consultas; el resto se delega en el cursor original
+    """
+
+    def __init__(self, cursor, connection, metrics):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, '_metrics', metrics)
+        object.__setattr__(self, '_statement', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def _start(self, statement, parameters):
+        self._finish()
+        object.__setattr__(self, '_statement', query_profiler.start(
+            statement, parameters, current_route(), self.connection._connection
+        ))
+
+    def _finish(self):
+        if self._statement is not None:
+            self._statement.finish()
+            object.__setattr__(self, '_statement', None)
+
+    def _observe(self, fase, segundos, filas=0):
+        self._metrics.observe(fase, segundos)
+        self._metrics.count_rows(filas)
+        if self._statement is not None:
+            self._statement.add(segundos, filas)
+
+    def _run(self, metodo, statement, parameters, *args, **kwargs):
+        self._start(statement, parameters)
+        start = time.perf_counter()
+        try:
+            return getattr(self._cursor, metodo)(statement, *args, **kwargs)
+        except Exception as e:
+            if self._statement is not None:
+                self._statement.error = str(e)[:200]
+            raise
+        finally:
+            self._observe('db_execute', time.perf_counter() - start)
+
+    def execute(self, statement, parameters=None, **kwargs):
+        if parameters is None:
+            return self._run('execute', statement, kwargs, **kwargs)
+        return self._run('execute', statement, parameters, parameters, **kwargs)
+
+    def executemany(self, statement, parameters, **kwargs):
+        return self._run('executemany', statement, parameters[0] if parameters else None, parameters, **kwargs)
+
+    def _fetch(self, metodo, *args):
+        start = time.perf_counter()
+        resultado = getattr(self._cursor, metodo)(*args)
+        if metodo == 'fetchone':
+            filas = 0 if resultado is None else 1
+        else:
+            filas = len(resultado)
+        self._observe('db_fetch', time.perf_counter() - start, filas)
+        return resultado
+
+    def fetchone(self):
+        return self._fetch('fetchone')
+
+    def fetchmany(self, *args):
+        return self._fetch('fetchmany', *args)
+
+    def fetchall(self):
+        return self._fetch('fetchall')
+
+    def __iter__(self):
+        return iter(self._fetch('fetchall'))
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+class InstrumentedConnection:
+    """Conexión de oracledb cuyos cursores y fetch_df_* quedan instrumentados"""
+
+    def __init__(self, connection, metrics):
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_metrics', metrics)
+
+    def __getattr__(self, name):
+        atributo = getattr(self._connection, name)
+        # fetch_df_* solo existen en python-oracledb 3+: hasattr() sigue funcionando igual
+        if name == 'fetch_df_all':
+            return self._fetch_df_all
+        if name == 'fetch_df_batches':
+            return self._fetch_df_batches
+        return atributo
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self, self._metrics)
+
+    def _observe(self, statement, segundos, filas):
+        self._metrics.observe('db_fetch', segundos)
+        self._metrics.count_rows(filas)
+        if statement is not None:
+            statement.add(segundos, filas)
+
+    def _fetch_df_all(self, statement, parameters=None, *args, **kwargs):
+        perfil = query_profiler.start(statement, parameters, current_route(), self._connection)
+        start = time.perf_counter()
+        df = self._connection.fetch_df_all(statement, parameters, *args, **kwargs)
+        self._observe(perfil, time.perf_counter() - start, df.num_rows())
+        if perfil is not None:
+            perfil.finish()
+        return df
+
+    def _fetch_df_batches(self, statement, parameters=None, *args, **kwargs):
+        perfil = query_profiler.start(statement, parameters, current_route(), self._connection)
+        batches = self._connection.fetch_df_batches(statement, parameters, *args, **kwargs)
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = next(batches, None)
+                if batch is None:
+                    return
+                self._observe(perfil, time.perf_counter() - start, batch.num_rows())
+                yield batch
+        finally:
+            if perfil is not None:
+                perfil.finish()
+
+class _Span:
+    """Clase en lugar de @contextmanager: evita crear un generador por cada fase medida"""
+    __slots__ = ('metrics', 'nombre', 'start')
+
+    def __init__(self, metrics, nombre):
+        self.metrics = metrics
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.spans.observe((self.nombre, current_route()), time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """
+    Métricas en proceso en formato de texto de Prometheus: latencia por ruta,
+    tiempos de las fases (pool, execute, fetch, DataFrame, LLM, SMTP) y filas
+    leídas. Con METRICS_ENABLED = False los spans son nullcontext y las
+    conexiones solo se envuelven si el perfil de consultas (profiler.py) está
+    activo. Con varios workers cada uno expone las suyas.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.requests = Histogram(
+            'http_request_duration_seconds', 'Latencia de las peticiones por ruta',
+            ('route', 'method', 'status')
+        )
+        self.spans = Histogram(
+            'app_span_duration_seconds', 'Duración de las fases de cada petición',
+            ('span', 'route')
+        )
+        self.rows = Counter('db_rows_fetched_total', 'Filas leídas de Oracle', ('route',))
+        self._null_span = nullcontext()
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        if self.enabled:
+            app.before_request(self._start_request)
+            app.after_request(self._end_request)
+            app.teardown_request(self._teardown_request)
+
+    def _start_request(self):
+        _ruta_actual.set(request.url_rule.rule if request.url_rule is not None else 'unmatched')
+        g.metrics_start = time.perf_counter()
+
+    def _teardown_request(self, exception=None):
+        _ruta_actual.set(None)
+
+    def _end_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            self.requests.observe(
+                (current_route(), request.method, str(response.status_code)),
+                time.perf_counter() - start
+            )
+        return response
+
+    def span(self, nombre):
+        """Context manager que mide una fase; sin coste apreciable si está desactivado"""
+        if not self.enabled:
+            return self._null_span
+        return _Span(self, nombre)
+
+    def observe(self, nombre, segundos):
+        """Registra una fase medida a mano (p. ej. un streaming que termina en otro sitio)"""
+        if self.enabled:
+            self.spans.observe((nombre, current_route()), segundos)
+
+    def count_rows(self, n):
+        if self.enabled and n:
+            self.rows.inc((current_route(),), n)
+
+    def wrap_connection(self, connection):
+        """Envuelve la conexión si hay métricas o perfil de consultas; si no, se usa tal cual"""
+        if self.enabled or query_profiler.enabled:
+            return InstrumentedConnection(connection, self)
+        return connection
+
+    def render(self):
+        lineas = self.requests.render() + self.spans.render() + self.rows.render()
+        return '\n'.join(lineas) + '\n'
+
+metrics = Metrics()
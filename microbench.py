@@ -0,0 +1,414 @@
+"""
+Comprobaciones y microbenchmarks de las piezas del dashboard sin pasar por HTTP.
+
+Usa la misma base DuckDB sintética que bench.py (VISTA_DASHBOARD con ingresos
+deterministas) detrás del adaptador con la interfaz de python-oracledb, así que
+requiere `pip install duckdb pyarrow`.
+
+- parity: compara los agregados de /api/data calculados en la base, en pandas
+  (tuplas y Arrow), con el kernel (tuplas y Arrow) y sobre el rollup (grano
+  diario y mensual) para varios juegos de filtros. Sale con 1 si alguno difiere.
+- kernel: tiempo y pico de memoria de AggregationKernel frente a
+  aggregate_dataframe, con tuplas de Python (lo que da un cursor) y con
+  columnas tipadas de Arrow. Las filas ya están en memoria: se mide solo la
+  agregación.
+- fetch: pico de memoria de los caminos de lectura de /api/data
+  (fetch_dataframe con cursor o con Arrow, y el kernel por fetchmany o por
+  fetch_arrow_batches). Cada camino corre en un proceso nuevo para medir
+  también el pico de RSS, que sí incluye la memoria de Arrow y de DuckDB.
+- export: recorre stream_export completo (CSV y NDJSON) con el tiempo, los MiB
+  generados y el pico de tracemalloc, que no debe crecer con el número de filas.
+- email: renderizado de CompiledEmailTemplate frente a sustituir la plantilla
+  sin compilar en cada envío, construcción y serialización del Message, y envío
+  uno a uno frente a send_batch contra el SMTP local de bench.py.
+
+Los picos de memoria son los de tracemalloc (heap de Python): no ven el
+asignador propio de Arrow ni los buffers de NumPy fuera de él.
+
+Uso:
+    python microbench.py parity --rows 10k,1m --db-dir /tmp/bench
+    python microbench.py kernel --rows 100k,1m,5m --db-dir /tmp/bench
+    python microbench.py fetch --rows 100k,1m --db-dir /tmp/bench
+    python microbench.py export --rows 100k,1m --db-dir /tmp/bench
+    python microbench.py email --count 20000 --send 500
+"""
+import argparse
+import math
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench import FILTROS_BENCH, DuckDBConnection, open_duckdb, parse_rows
+
+# Filtros de paridad: los del banco de pruebas más rangos de fechas que el rollup
+# mensual puede servir (meses completos) y otros que no (mitad de mes)
+FILTROS_PARIDAD = FILTROS_BENCH + [
+    {'fecha_inicio': '2022-01-01', 'fecha_fin': '2022-06-30', 'sexo': 'H'},
+    {'fecha_inicio': '2020-03-15', 'fecha_fin': '2020-04-10', 'categoria': 'Trastornos de ansiedad'},
+    {'comunidad': 'No existe'},
+]
+
+def differences(a, b, ruta='', tolerancia=1e-9):
+    """
+    Diferencias entre dos resultados del dashboard. Los floats se comparan con
+    tolerancia relativa (el orden de las sumas cambia entre caminos) y los
+    histogramas por contenido.
+    Returns: list[str] - una línea por diferencia
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        diferencias = []
+        for clave in sorted(set(a) | set(b), key=str):
+            if clave not in a or clave not in b:
+                diferencias.append(f'{ruta}/{clave}: solo en {"el primero" if clave in a else "el segundo"}')
+            else:
+                diferencias.extend(differences(a[clave], b[clave], f'{ruta}/{clave}', tolerancia))
+        return diferencias
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        if math.isclose(a, b, rel_tol=tolerancia, abs_tol=tolerancia):
+            return []
+    elif a == b:
+        return []
+    return [f'{ruta or "/"}: {a!r} != {b!r}']
+
+def aggregation_paths(conn):
+    """Caminos de agregación de /api/data: nombre -> función(filtros)"""
+    from dashboard import aggregate_in_db, aggregate_in_pandas, aggregate_in_kernel
+
+    return {
+        'db': lambda filtros: aggregate_in_db(conn.cursor(), filtros),
+        'pandas-tuplas': lambda filtros: aggregate_in_pandas(conn.cursor(), filtros, use_arrow=False),
+        'pandas-arrow': lambda filtros: aggregate_in_pandas(conn.cursor(), filtros, use_arrow=True),
+        'kernel-tuplas': lambda filtros: aggregate_in_kernel(conn.cursor(), filtros, use_arrow=False),
+        'kernel-arrow': lambda filtros: aggregate_in_kernel(conn.cursor(), filtros, use_arrow=True),
+    }
+
+def build_rollups(conn, db):
+    """Crea un rollup por grano (PARIDAD_ROLLUP_DAY/MONTH). Returns: {nombre: DashboardRollup}"""
+    from rollup import DashboardRollup, FORMATOS
+
+    rollups = {}
+    for grano in FORMATOS:
+        rollup = DashboardRollup()
+        rollup.table = f'PARIDAD_ROLLUP_{grano.upper()}'
+        rollup.grain = grano
+        db.execute(f'DROP TABLE IF EXISTS {rollup.table}')
+        rollup.create(conn)
+        rollups[f'rollup-{grano}'] = rollup
+    return rollups
+
+def run_parity(args):
+    from dashboard import aggregate_in_rollup
+
+    fallos = 0
+    for filas in parse_rows(args.rows):
+        db, segundos = open_duckdb(filas, args.db_dir)
+        if segundos is not None:
+            print(f'{filas} ingresos generados en {segundos:.1f} s', flush=True)
+        conn = DuckDBConnection(db)
+        caminos = aggregation_paths(conn)
+        rollups = build_rollups(conn, db)
+
+        for filtros in FILTROS_PARIDAD:
+            referencia = caminos['db'](filtros)
+            resultados = {nombre: camino(filtros) for nombre, camino in caminos.items() if nombre != 'db'}
+            for nombre, rollup in rollups.items():
+                # /api/data solo usa el rollup cuando can_serve lo admite
+                if rollup.can_serve(filtros):
+                    resultados[nombre] = aggregate_in_rollup(conn.cursor(), filtros, rollup.table)
+
+            for nombre, resultado in resultados.items():
+                diferencias = differences(referencia, resultado)
+                estado = 'OK' if not diferencias else f'{len(diferencias)} diferencias'
+                print(f'{filas:>10} {nombre:<14} {estado:<16} {filtros}')
+                for linea in diferencias[:args.max_diffs]:
+                    print(f'{"":>12}{linea}')
+                fallos += bool(diferencias)
+        db.close()
+
+    print('\nTodos los caminos coinciden' if not fallos else f'\n{fallos} comparaciones con diferencias')
+    return 1 if fallos else 0
+
+def measure(func, repeticiones=3, memoria=True):
+    """
+    Mejor tiempo de repeticiones ejecuciones y, con memoria, el pico de
+    tracemalloc de una ejecución más (fuera de las cronometradas).
+    Returns: (resultado, segundos, MiB de pico o None)
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        start = time.perf_counter()
+        resultado = func()
+        tiempos.append(time.perf_counter() - start)
+    pico = None
+    if memoria:
+        tracemalloc.start()
+        try:
+            func()
+            pico = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return resultado, min(tiempos), pico
+
+def print_measure(filas, entrada, camino, segundos, pico, coincide):
+    pico = f'{pico:.1f}' if pico is not None else '-'
+    print(f'{filas:>10} {entrada:<10} {camino:<20} {segundos * 1000:>10.1f} {pico:>10} {coincide:>9}', flush=True)
+
+def run_kernel(args):
+    import pandas as pd
+    from dashboard import AggregationKernel, KERNEL_CATEGORICAS, KERNEL_NUMERICAS, aggregate_dataframe, arrow_columns
+
+    columnas = KERNEL_CATEGORICAS + KERNEL_NUMERICAS
+    sql = f'SELECT {", ".join(columnas)} FROM VISTA_DASHBOARD'
+    limite_tuplas = parse_rows(args.tuples_max)[0]
+
+    def kernel_tuplas(filas):
+        kernel = AggregationKernel(columnas)
+        for i in range(0, len(filas), args.batch):
+            kernel.add_batch(filas[i:i + args.batch])
+        return kernel.result()
+
+    def kernel_arrow(tabla):
+        # Mismo recorrido que aggregate_in_kernel: una tabla de Arrow por lote
+        import pyarrow as pa
+        kernel = AggregationKernel(columnas)
+        for lote in tabla.to_batches(max_chunksize=args.batch):
+            kernel.add_columns(arrow_columns(pa.Table.from_batches([lote])), lote.num_rows)
+        return kernel.result()
+
+    print(f"{'filas':>10} {'entrada':<10} {'camino':<20} {'ms':>10} {'MiB pico':>10} {'coincide':>9}")
+    fallos = 0
+    for n in parse_rows(args.rows):
+        db, segundos = open_duckdb(n, args.db_dir)
+        if segundos is not None:
+            print(f'{n} ingresos generados en {segundos:.1f} s', flush=True)
+        resultado = db.execute(sql)
+        # to_arrow_table en DuckDB >= 1.4, fetch_arrow_table en versiones anteriores
+        tabla = (getattr(resultado, 'to_arrow_table', None) or resultado.fetch_arrow_table)()
+        tabla = tabla.rename_columns([c.upper() for c in tabla.column_names])
+
+        referencia = None
+        if n <= limite_tuplas:
+            filas = db.execute(sql).fetchall()
+            referencia, segundos, pico = measure(
+                lambda: aggregate_dataframe(pd.DataFrame(filas, columns=columnas)), args.repeat, args.memory
+            )
+            print_measure(n, 'tuplas', 'aggregate_dataframe', segundos, pico, 'ref.')
+            resultado, segundos, pico = measure(lambda: kernel_tuplas(filas), args.repeat, args.memory)
+            coincide = not differences(referencia, resultado)
+            print_measure(n, 'tuplas', 'kernel.add_batch', segundos, pico, 'sí' if coincide else 'NO')
+            fallos += not coincide
+            del filas
+
+        resultado, segundos, pico = measure(lambda: kernel_arrow(tabla), args.repeat, args.memory)
+        coincide = referencia is None or not differences(referencia, resultado)
+        print_measure(n, 'arrow', 'kernel.add_columns', segundos, pico,
+                      '-' if referencia is None else ('sí' if coincide else 'NO'))
+        fallos += not coincide
+        db.close()
+    return 1 if fallos else 0
+
+# Caminos de lectura de /api/data: (función de dashboard, use_arrow)
+CAMINOS_FETCH = {
+    'fetch_dataframe cursor': ('aggregate_in_pandas', False),
+    'fetch_dataframe arrow': ('aggregate_in_pandas', True),
+    'fetchmany + kernel': ('aggregate_in_kernel', False),
+    'fetch_arrow_batches + kernel': ('aggregate_in_kernel', True),
+}
+
+def _fetch_worker(filas, directorio, camino, arraysize, cola):
+    """Proceso hijo: un camino de lectura con su tiempo, pico de tracemalloc, de Arrow y de RSS"""
+    import pyarrow as pa
+    import dashboard
+
+    db, _ = open_duckdb(filas, directorio)
+    funcion, use_arrow = CAMINOS_FETCH[camino]
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB en Linux
+    tracemalloc.start()
+    start = time.perf_counter()
+    resultado = getattr(dashboard, funcion)(DuckDBConnection(db).cursor(), {}, arraysize, use_arrow)
+    segundos = time.perf_counter() - start
+    pico_python = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    cola.put({
+        'resultado': resultado,
+        'segundos': segundos,
+        'python_mib': pico_python,
+        'arrow_mib': pa.default_memory_pool().max_memory() / 2**20,
+        'rss_mib': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_base) / 1024,
+    })
+
+def run_fetch(args):
+    directorio = args.db_dir or tempfile.mkdtemp(prefix='microbench_')
+    contexto = multiprocessing.get_context('spawn')  # Proceso limpio: el pico de RSS es solo del camino
+
+    print(f"{'filas':>10} {'camino':<30} {'ms':>10} {'MiB Python':>11} {'MiB Arrow':>10} {'MiB RSS':>9} {'coincide':>9}")
+    fallos = 0
+    for n in parse_rows(args.rows):
+        db, segundos = open_duckdb(n, directorio)  # Genera la base una vez para todos los procesos
+        db.close()
+        if segundos is not None:
+            print(f'{n} ingresos generados en {segundos:.1f} s', flush=True)
+
+        referencia = None
+        for camino in CAMINOS_FETCH:
+            cola = contexto.Queue()
+            proceso = contexto.Process(target=_fetch_worker, args=(n, directorio, camino, args.arraysize, cola))
+            proceso.start()
+            medida = cola.get()
+            proceso.join()
+            if referencia is None:
+                referencia, coincide = medida['resultado'], 'ref.'
+            else:
+                iguales = not differences(referencia, medida['resultado'])
+                coincide = 'sí' if iguales else 'NO'
+                fallos += not iguales
+            print(f"{n:>10} {camino:<30} {medida['segundos'] * 1000:>10.1f} {medida['python_mib']:>11.1f} "
+                  f"{medida['arrow_mib']:>10.1f} {medida['rss_mib']:>9.1f} {coincide:>9}", flush=True)
+    return 1 if fallos else 0
+
+def run_export(args):
+    from dashboard import stream_export
+
+    print(f"{'filas':>10} {'formato':<8} {'arraysize':>9} {'ms':>10} {'filas/s':>10} {'MiB':>8} {'MiB pico':>9}")
+    fallos = 0
+    for n in parse_rows(args.rows):
+        db, segundos = open_duckdb(n, args.db_dir)
+        if segundos is not None:
+            print(f'{n} ingresos generados en {segundos:.1f} s', flush=True)
+        conn = DuckDBConnection(db)
+
+        for formato in ('csv', 'ndjson'):
+            for arraysize in args.arraysize:
+                def exportar():
+                    # Lo que hace el servidor WSGI con la respuesta: consumir y descartar los trozos
+                    total = lineas = 0
+                    for trozo in stream_export(conn.cursor(), {}, formato, arraysize):
+                        total += len(trozo.encode('utf-8'))
+                        lineas += trozo.count('\n')
+                    return total, lineas
+
+                (total, lineas), segundos, pico = measure(exportar, args.repeat, args.memory)
+                esperadas = n + (formato == 'csv')  # Cabecera del CSV
+                if lineas != esperadas:
+                    print(f'  {formato}: {lineas} líneas, se esperaban {esperadas}')
+                    fallos += 1
+                pico = f'{pico:.1f}' if pico is not None else '-'
+                print(f'{n:>10} {formato:<8} {arraysize:>9} {segundos * 1000:>10.0f} {n / segundos:>10.0f} '
+                      f'{total / 2**20:>8.1f} {pico:>9}', flush=True)
+        db.close()
+    return 1 if fallos else 0
+
+def rate(func, n):
+    """Llamadas por segundo de func(i) para i en range(n)"""
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    return n / (time.perf_counter() - start)
+
+def run_email(args):
+    from flask import Flask
+    from bench import StubSMTPServer
+    from email_utils import mail, VERIFICATION_CODE_TEMPLATE, CompiledEmailTemplate, \
+        build_verification_code_message, send_verification_code_email, send_batch
+
+    smtp = StubSMTPServer()
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp.start(), MAIL_USE_TLS=False,
+        MAIL_USERNAME='app@bench.local', MAIL_PASSWORD='bench', MAIL_DEFAULT_SENDER='app@bench.local'
+    )
+    mail.init_app(app)
+
+    # Referencia: la misma plantilla sin compilar, sustituida con re.sub en cada envío
+    fuente = {
+        parte: ''.join(trozo if i % 2 == 0 else f'${trozo}' for i, trozo in enumerate(trozos))
+        for parte, trozos in (('subject', VERIFICATION_CODE_TEMPLATE.subject),
+                              ('html', VERIFICATION_CODE_TEMPLATE.html),
+                              ('text', VERIFICATION_CODE_TEMPLATE.text))
+    }
+    campo = CompiledEmailTemplate._CAMPO
+
+    def sin_compilar(i):
+        valores = {'user_name': f'Usuario <{i}>', 'code': f'{i:06d}'}
+        return tuple(campo.sub(lambda m: str(valores[m.group(1)]), fuente[parte]) for parte in fuente)
+
+    n = args.count
+    medidas = [
+        ('plantilla sin compilar (re.sub)', rate(sin_compilar, n)),
+        ('CompiledEmailTemplate.render', rate(
+            lambda i: VERIFICATION_CODE_TEMPLATE.render(user_name=f'Usuario <{i}>', code=f'{i:06d}'), n)),
+    ]
+    with app.app_context():
+        medidas.append(('Message completo', rate(
+            lambda i: build_verification_code_message(f'u{i}@bench.local', f'Usuario {i}', f'{i:06d}'), n)))
+        # Serialización MIME: lo que hace Connection.send antes de hablar con el servidor
+        medidas.append(('Message + as_bytes', rate(
+            lambda i: build_verification_code_message(f'u{i}@bench.local', f'Usuario {i}', f'{i:06d}').as_bytes(),
+            min(n, 2000))))
+        if args.send:
+            medidas.append(('mail.send uno a uno', rate(
+                lambda i: send_verification_code_email(f'u{i}@bench.local', f'Usuario {i}', f'{i:06d}'), args.send)))
+            items = [(f'u{i}@bench.local', {'user_name': f'Usuario {i}', 'code': f'{i:06d}'}) for i in range(args.send)]
+            start = time.perf_counter()
+            enviados, fallos = send_batch('verification_code', items)
+            medidas.append(('send_batch (una conexión)', enviados / (time.perf_counter() - start)))
+            if fallos:
+                print(f'send_batch: {len(fallos)} errores, el primero: {fallos[0][1]}')
+
+    print(f"{'paso':<34} {'por segundo':>12}")
+    for nombre, por_segundo in medidas:
+        print(f'{nombre:<34} {por_segundo:>12,.0f}')
+    if args.send:
+        print(f'SMTP local: {smtp.messages} mensajes recibidos')
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Paridad y microbenchmarks del dashboard sobre DuckDB')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parity = subparsers.add_parser('parity', help='Compara los caminos de agregación de /api/data')
+    parity.add_argument('--rows', default='10k', help='Tamaños de VISTA_DASHBOARD, p. ej. 10k,1m')
+    parity.add_argument('--db-dir', help='Directorio donde guardar y reutilizar las bases DuckDB generadas')
+    parity.add_argument('--max-diffs', type=int, default=5, help='Diferencias a mostrar por comparación')
+    parity.set_defaults(func=run_parity)
+
+    kernel = subparsers.add_parser('kernel', help='AggregationKernel frente a aggregate_dataframe')
+    kernel.add_argument('--rows', default='100k,1m,5m', help='Tamaños de VISTA_DASHBOARD')
+    kernel.add_argument('--db-dir', help='Directorio donde guardar y reutilizar las bases DuckDB generadas')
+    kernel.add_argument('--tuples-max', default='1m',
+                        help='Tamaño máximo con tuplas de Python (5M tuplas no caben en pocos GiB)')
+    kernel.add_argument('--batch', type=int, default=5000, help='Filas por lote (arraysize)')
+    kernel.add_argument('--repeat', type=int, default=3, help='Repeticiones cronometradas (se toma la mejor)')
+    kernel.add_argument('--no-memory', dest='memory', action='store_false', help='No medir el pico con tracemalloc')
+    kernel.set_defaults(func=run_kernel)
+
+    fetch = subparsers.add_parser('fetch', help='Pico de memoria de fetch_dataframe y fetch_arrow_batches')
+    fetch.add_argument('--rows', default='100k,1m', help='Tamaños de VISTA_DASHBOARD')
+    fetch.add_argument('--db-dir', help='Directorio donde guardar y reutilizar las bases DuckDB generadas')
+    fetch.add_argument('--arraysize', type=int, default=5000, help='arraysize / tamaño de lote (EXPORT_ARRAYSIZE en /api/data)')
+    fetch.set_defaults(func=run_fetch)
+
+    export = subparsers.add_parser('export', help='Tiempo y memoria de stream_export (CSV y NDJSON)')
+    export.add_argument('--rows', default='100k,1m', help='Tamaños de VISTA_DASHBOARD')
+    export.add_argument('--db-dir', help='Directorio donde guardar y reutilizar las bases DuckDB generadas')
+    export.add_argument('--arraysize', type=lambda v: [int(x) for x in v.split(',')], default=[5000],
+                        help='Valores de EXPORT_ARRAYSIZE separados por comas')
+    export.add_argument('--repeat', type=int, default=1, help='Repeticiones cronometradas (se toma la mejor)')
+    export.add_argument('--no-memory', dest='memory', action='store_false', help='No medir el pico con tracemalloc')
+    export.set_defaults(func=run_export)
+
+    email = subparsers.add_parser('email', help='Renderizado y envío de los emails de verificación')
+    email.add_argument('--count', type=int, default=20000, help='Emails a renderizar por medida')
+    email.add_argument('--send', type=int, default=500, help='Emails a enviar al SMTP local (0 = no enviar)')
+    email.set_defaults(func=run_email)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(args.func(args))
+
+if __name__ == '__main__':
+    main()
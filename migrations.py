@@ -0,0 +1,532 @@
+import json
+import re
+import secrets
+import time
+from datetime import date, datetime
+import click
+from flask.cli import AppGroup
+from db_utils import db_pool
+from dashboard import (
+    AGGREGATE_QUERY, TABLE_COUNT_QUERY, TABLE_PAGE_QUERY, KEYSET_PAGE_QUERY,
+    build_filter_clause, set_filter_input_sizes
+)
+
+# Columnas propias de la tabla de ingresos por las que filtra el dashboard
+COLUMNA_FECHA = 'FECHA_INGRESO'
+COLUMNA_SEXO = 'SEXO'
+
+# Comunidad y categoría son claves ajenas a las tablas de referencia (las de lookups.py);
+# si la tabla está desnormalizada se usa la columna con el nombre de VISTA_DASHBOARD
+REFERENCIAS = {
+    'comunidad': ('COMUNIDADES', 'COMUNIDAD_ATENCION'),
+    'categoria': ('CATEGORIAS_DIAGNOSTICO', 'CATEGORIA_DIAGNOSTICO'),
+}
+
+# Índices compuestos por rol de columna: igualdades primero y el rango de fecha al final;
+# (fecha, id) sirve además el ORDER BY de la paginación por clave. Son LOCAL si la tabla
+# está particionada.
+INDICES = [
+    ('FECHA_ID_IX', ['fecha', 'id']),
+    ('COMUNIDAD_FECHA_IX', ['comunidad', 'fecha']),
+    ('CATEGORIA_SEXO_FECHA_IX', ['categoria', 'sexo', 'fecha']),
+]
+
+# Partición que recoge fechas NULL y posteriores a la última partición mensual
+PARTICION_MAXIMA = 'P_MAX'
+_PARTICION_MES = re.compile(r'^P_(\d{4})(\d{2})$')
+
+# Estadísticas de sesión que cuenta la medición de bloques
+ESTADISTICAS_BLOQUES = {
+    'consistent gets': 'consistent_gets',
+    'db block gets': 'db_block_gets',
+    'physical reads': 'physical_reads',
+}
+
+def _mes_siguiente(dia):
+    return date(dia.year + dia.month // 12, dia.month % 12 + 1, 1)
+
+def _literal_fecha(dia):
+    return f"DATE '{dia.isoformat()}'"
+
+def _nombre_particion(dia):
+    """Partición del mes de dia: P_YYYYMM (su límite superior es el día 1 del mes siguiente)"""
+    return f'P_{dia.year:04d}{dia.month:02d}'
+
+def dashboard_statements(filters):
+    """
+    Sentencias de /api/data (GROUPING SETS) y /api/table (conteo, página por
+    ROWNUM y primera página keyset) con los filtros dados, tal y como las ejecuta la app.
+    Returns: list[(nombre, sql, binds)]
+    """
+    filter_clause, params = build_filter_clause(filters)
+    return [
+        ('data', AGGREGATE_QUERY.format(filtros=filter_clause), params),
+        ('table_count', TABLE_COUNT_QUERY.format(filtros=filter_clause), params),
+        ('table_page', TABLE_PAGE_QUERY.format(filtros=filter_clause), dict(params, max_fila=50, min_fila=0)),
+        ('table_keyset', KEYSET_PAGE_QUERY.format(filtros=filter_clause, orden='ASC'), dict(params, n_filas=51)),
+    ]
+
+class SchemaMigrations:
+    """
+    Migraciones del esquema de la tabla de ingresos (la que hay bajo VISTA_DASHBOARD):
+    particiones mensuales por fecha_ingreso e índices compuestos alineados con los
+    filtros del dashboard. Cada migración aplicada se registra en una tabla de
+    control, así `flask schema migrate` solo ejecuta las pendientes.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.table = 'INGRESOS'
+        self.migrations_table = 'SCHEMA_MIGRATIONS'
+        self.partitioning = True
+        self.future_months = 12
+        self.migrations = [
+            ('001_particiones_mensuales', 'Particiones mensuales por fecha_ingreso', self._partition_statements),
+            ('002_indices_filtros', 'Índices compuestos de los filtros del dashboard', self._index_statements),
+            ('003_estadisticas', 'Estadísticas del optimizador de la tabla e índices', self._stats_statements),
+        ]
+
+    def init_app(self, app):
+        self.app = app
+        self.table = app.config['SCHEMA_INGRESOS_TABLE'].upper()
+        self.migrations_table = app.config['SCHEMA_MIGRATIONS_TABLE'].upper()
+        self.partitioning = app.config['SCHEMA_PARTITIONING']
+        self.future_months = app.config['SCHEMA_PARTITION_FUTURE_MONTHS']
+        app.cli.add_command(self._build_cli())
+
+    # ---------- Diccionario de datos ----------
+
+    def _columns(self, cursor):
+        """Returns: dict - columna -> nullable ('Y'/'N')"""
+        cursor.execute('SELECT column_name, nullable FROM user_tab_columns WHERE table_name = :1', [self.table])
+        return dict(cursor.fetchall())
+
+    def _is_partitioned(self, cursor):
+        cursor.execute('SELECT COUNT(*) FROM user_part_tables WHERE table_name = :1', [self.table])
+        return cursor.fetchone()[0] > 0
+
+    def _index_names(self, cursor):
+        cursor.execute('SELECT index_name FROM user_indexes WHERE table_name = :1', [self.table])
+        return {fila[0] for fila in cursor.fetchall()}
+
+    def _monthly_partitions(self, cursor):
+        """Meses (día 1) de las particiones P_YYYYMM existentes"""
+        cursor.execute('SELECT partition_name FROM user_tab_partitions WHERE table_name = :1', [self.table])
+        meses = []
+        for (nombre,) in cursor.fetchall():
+            m = _PARTICION_MES.match(nombre)
+            if m:
+                meses.append(date(int(m.group(1)), int(m.group(2)), 1))
+        return sorted(meses)
+
+    def _constraint_columns(self, cursor, tipo):
+        """
+        Columnas de las restricciones de una sola columna de la tabla ('P' o 'R').
+        Returns: dict - tabla referenciada (None para la clave primaria) -> columna
+        """
+        cursor.execute("""
+            SELECT r.table_name, MIN(cc.column_name)
+            FROM user_constraints c
+            JOIN user_cons_columns cc ON cc.constraint_name = c.constraint_name
+            LEFT JOIN user_constraints r ON r.constraint_name = c.r_constraint_name
+            WHERE c.table_name = :1 AND c.constraint_type = :2
+            GROUP BY c.constraint_name, r.table_name
+            HAVING COUNT(*) = 1
+        """, [self.table, tipo])
+        return dict(cursor.fetchall())
+
+    def _check_view(self, cursor):
+        """La tabla configurada debe ser una de las que lee VISTA_DASHBOARD (si la vista es del usuario)"""
+        cursor.execute("""
+            SELECT referenced_name FROM user_dependencies
+            WHERE name = 'VISTA_DASHBOARD' AND referenced_type = 'TABLE'
+        """)
+        tablas = {fila[0] for fila in cursor.fetchall()}
+        if tablas and self.table not in tablas:
+            raise click.ClickException(
+                f'VISTA_DASHBOARD no lee de {self.table} (SCHEMA_INGRESOS_TABLE) sino de: {", ".join(sorted(tablas))}'
+            )
+
+    def resolve_columns(self, cursor):
+        """
+        Columnas físicas de la tabla de ingresos para cada filtro del dashboard:
+        fecha y sexo propias, id de la clave primaria, y comunidad y categoría
+        de las claves ajenas a COMUNIDADES y CATEGORIAS_DIAGNOSTICO.
+        Returns: dict - rol -> (columna, nullable)
+        """
+        columnas = self._columns(cursor)
+        if not columnas:
+            raise click.ClickException(f'La tabla {self.table} no existe (SCHEMA_INGRESOS_TABLE)')
+        self._check_view(cursor)
+
+        resueltas = {}
+        for rol, columna in (('fecha', COLUMNA_FECHA), ('sexo', COLUMNA_SEXO)):
+            if columna in columnas:
+                resueltas[rol] = columna
+        primaria = self._constraint_columns(cursor, 'P').get(None)
+        if primaria:
+            resueltas['id'] = primaria
+        ajenas = self._constraint_columns(cursor, 'R')
+        for rol, (referencia, columna_vista) in REFERENCIAS.items():
+            columna = ajenas.get(referencia) or (columna_vista if columna_vista in columnas else None)
+            if columna:
+                resueltas[rol] = columna
+
+        faltan = [rol for rol in ('fecha', 'id', 'sexo', *REFERENCIAS) if rol not in resueltas]
+        if faltan:
+            referencias = ' / '.join(tabla for tabla, _ in REFERENCIAS.values())
+            raise click.ClickException(
+                f'No se encuentran en {self.table} las columnas de: {", ".join(faltan)} '
+                f'(fecha={COLUMNA_FECHA}, sexo={COLUMNA_SEXO}, id=clave primaria, '
+                f'comunidad/categoría=clave ajena a {referencias})'
+            )
+        return {rol: (columna, columnas[columna]) for rol, columna in resueltas.items()}
+
+    # ---------- Migraciones: cada una devuelve sus sentencias DDL ----------
+
+    def _partition_statements(self, cursor):
+        """
+        Convierte la tabla en particionada por mes de fecha_ingreso (ALTER TABLE ...
+        MODIFY ONLINE, Oracle 12.2+). Con fecha_ingreso NOT NULL se usa INTERVAL y
+        Oracle crea cada mes al insertar; si admite NULL (las particiones por
+        intervalo no los aceptan) se crean meses explícitos hasta future_months
+        vista y P_MAX para NULL y fechas posteriores (`flask schema extend`).
+        """
+        if not self.partitioning or self._is_partitioned(cursor):
+            return []
+        columna_fecha, nullable = self.resolve_columns(cursor)['fecha']
+
+        cursor.execute(f'SELECT MIN({columna_fecha}), MAX({columna_fecha}) FROM {self.table}')
+        minima, maxima = cursor.fetchone()
+        hoy = date.today().replace(day=1)
+        primero = minima.date().replace(day=1) if minima else hoy
+
+        if nullable == 'N':
+            return [
+                f'ALTER TABLE {self.table} MODIFY PARTITION BY RANGE ({columna_fecha})'
+                f" INTERVAL (NUMTOYMINTERVAL(1, 'MONTH'))"
+                f' (PARTITION {_nombre_particion(primero)} VALUES LESS THAN ({_literal_fecha(_mes_siguiente(primero))}))'
+                f' ONLINE UPDATE INDEXES'
+            ]
+
+        ultimo = max(maxima.date().replace(day=1) if maxima else hoy, hoy)
+        for _ in range(self.future_months):
+            ultimo = _mes_siguiente(ultimo)
+        particiones = []
+        mes = primero
+        while mes <= ultimo:
+            limite = _literal_fecha(_mes_siguiente(mes))
+            particiones.append(f'PARTITION {_nombre_particion(mes)} VALUES LESS THAN ({limite})')
+            mes = _mes_siguiente(mes)
+        particiones.append(f'PARTITION {PARTICION_MAXIMA} VALUES LESS THAN (MAXVALUE)')
+        return [
+            f'ALTER TABLE {self.table} MODIFY PARTITION BY RANGE ({columna_fecha}) '
+            f'({", ".join(particiones)}) ONLINE UPDATE INDEXES'
+        ]
+
+    def _index_statements(self, cursor):
+        columnas = self.resolve_columns(cursor)
+        existentes = self._index_names(cursor)
+        # En el modo de prueba la migración anterior aún no se ha aplicado
+        local = ' LOCAL' if self.partitioning else ''
+        sentencias = []
+        for sufijo, roles in INDICES:
+            nombre = f'{self.table}_{sufijo}'[:128]
+            if nombre not in existentes:
+                lista = ', '.join(columnas[rol][0] for rol in roles)
+                sentencias.append(f'CREATE INDEX {nombre} ON {self.table} ({lista}){local}')
+        return sentencias
+
+    def _stats_statements(self, cursor):
+        return [
+            f"BEGIN DBMS_STATS.GATHER_TABLE_STATS(ownname => USER, tabname => '{self.table}', cascade => TRUE); END;"
+        ]
+
+    # ---------- Aplicación ----------
+
+    def _ensure_migrations_table(self, cursor, create=True):
+        """True si la tabla de control existe (la crea salvo con create=False)"""
+        cursor.execute('SELECT COUNT(*) FROM user_tables WHERE table_name = :1', [self.migrations_table])
+        if cursor.fetchone()[0] > 0:
+            return True
+        if create:
+            cursor.execute(f"""
+                CREATE TABLE {self.migrations_table} (
+                    id VARCHAR2(100) PRIMARY KEY,
+                    descripcion VARCHAR2(400),
+                    aplicada_en TIMESTAMP DEFAULT SYSTIMESTAMP,
+                    segundos NUMBER
+                )
+            """)
+        return create
+
+    def applied(self, cursor, create=True):
+        """Returns: dict - id -> fecha de aplicación de las migraciones ya aplicadas"""
+        if not self._ensure_migrations_table(cursor, create):
+            return {}
+        cursor.execute(f'SELECT id, aplicada_en FROM {self.migrations_table}')
+        return dict(cursor.fetchall())
+
+    def status(self, conn):
+        cursor = conn.cursor()
+        try:
+            aplicadas = self.applied(cursor)
+            return [
+                {'id': id_, 'description': descripcion, 'applied_at': aplicadas.get(id_)}
+                for id_, descripcion, _ in self.migrations
+            ]
+        finally:
+            cursor.close()
+
+    def migrate(self, conn, dry_run=False, echo=click.echo):
+        """
+        Aplica en orden las migraciones pendientes. El DDL de Oracle confirma cada
+        sentencia, así que una migración que falla a medias se reintenta entera
+        (las sentencias comprueban el diccionario y omiten lo que ya existe).
+        Returns: list[str] - ids aplicados (o que se aplicarían con dry_run)
+        """
+        cursor = conn.cursor()
+        try:
+            aplicadas = self.applied(cursor, create=not dry_run)
+            ejecutadas = []
+            for id_, descripcion, sentencias in self.migrations:
+                if id_ in aplicadas:
+                    continue
+                echo(f'-- {id_}: {descripcion}')
+                start = time.perf_counter()
+                for sql in sentencias(cursor):
+                    echo(sql + ('' if sql.endswith(';') else ';'))
+                    if not dry_run:
+                        cursor.execute(sql)
+                if not dry_run:
+                    cursor.execute(
+                        f'INSERT INTO {self.migrations_table} (id, descripcion, segundos) VALUES (:1, :2, :3)',
+                        [id_, descripcion, round(time.perf_counter() - start, 3)]
+                    )
+                    conn.commit()
+                ejecutadas.append(id_)
+            return ejecutadas
+        finally:
+            cursor.close()
+
+    def extend(self, conn, months=None, dry_run=False, echo=click.echo):
+        """
+        Añade particiones mensuales hasta months meses vista partiendo P_MAX (solo
+        con particionado por rango; con INTERVAL Oracle las crea al insertar).
+        Pensado para un cron mensual. Returns: list[str] - particiones creadas
+        """
+        months = self.future_months if months is None else months
+        cursor = conn.cursor()
+        try:
+            meses = self._monthly_partitions(cursor)
+            if not meses:
+                raise click.ClickException(f'{self.table} no tiene particiones mensuales P_YYYYMM')
+            objetivo = date.today().replace(day=1)
+            for _ in range(months):
+                objetivo = _mes_siguiente(objetivo)
+            creadas = []
+            mes = _mes_siguiente(meses[-1])
+            while mes <= objetivo:
+                sql = (f'ALTER TABLE {self.table} SPLIT PARTITION {PARTICION_MAXIMA}'
+                       f' AT ({_literal_fecha(_mes_siguiente(mes))})'
+                       f' INTO (PARTITION {_nombre_particion(mes)}, PARTITION {PARTICION_MAXIMA}) UPDATE INDEXES')
+                echo(sql + ';')
+                if not dry_run:
+                    cursor.execute(sql)
+                creadas.append(_nombre_particion(mes))
+                mes = _mes_siguiente(mes)
+            return creadas
+        finally:
+            cursor.close()
+
+    # ---------- Verificación de planes ----------
+
+    def _plan(self, cursor, sql, params):
+        """Operaciones del plan estimado (EXPLAIN PLAN) con sus particiones de inicio y fin"""
+        statement_id = f'prune_{secrets.token_hex(8)}'
+        # Binds de fecha como DATE, igual que en la app: con VARCHAR2 Oracle no puede podar
+        set_filter_input_sizes(cursor, params)
+        cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}", params)
+        cursor.execute("""
+            SELECT id, operation, options, object_name, partition_start, partition_stop
+            FROM plan_table
+            WHERE statement_id = :1
+            ORDER BY id
+        """, [statement_id])
+        filas = cursor.fetchall()
+        cursor.execute('DELETE FROM plan_table WHERE statement_id = :1', [statement_id])
+        return filas
+
+    def check_pruning(self, conn, filters):
+        """
+        Informa del acceso a particiones en el plan de cada sentencia del dashboard
+        con los filtros dados. Se considera podada si hay operación PARTITION y
+        ninguna es PARTITION RANGE ALL; el resultado es lo que muestra el plan, no
+        una suposición (si la vista transforma fecha_ingreso no habrá poda).
+        Returns: list[dict] - por sentencia: podada, operaciones de partición y plan
+        """
+        cursor = conn.cursor()
+        try:
+            resultado = []
+            for nombre, sql, params in dashboard_statements(filters):
+                plan = self._plan(cursor, sql, params)
+                particiones = [
+                    {'operation': f'{operacion} {opciones or ""}'.strip(), 'start': inicio, 'stop': fin}
+                    for _, operacion, opciones, _, inicio, fin in plan if operacion.startswith('PARTITION')
+                ]
+                resultado.append({
+                    'statement': nombre,
+                    'pruned': bool(particiones) and all(not p['operation'].endswith(' ALL') for p in particiones),
+                    'partitions': particiones,
+                    'plan': [
+                        f'{id_:>3} {operacion} {opciones or ""} {objeto or ""} {inicio or ""} {fin or ""}'.rstrip()
+                        for id_, operacion, opciones, objeto, inicio, fin in plan
+                    ]
+                })
+            return resultado
+        finally:
+            cursor.close()
+
+    # ---------- Medición de bloques leídos ----------
+
+    def _session_stats(self, cursor):
+        nombres = list(ESTADISTICAS_BLOQUES)
+        marcadores = ', '.join(f':{i + 1}' for i in range(len(nombres)))
+        cursor.execute(f"""
+            SELECT n.name, s.value
+            FROM v$mystat s JOIN v$statname n ON n.statistic# = s.statistic#
+            WHERE n.name IN ({marcadores})
+        """, nombres)
+        return {ESTADISTICAS_BLOQUES[nombre]: valor for nombre, valor in cursor.fetchall()}
+
+    def sample_filters(self, conn, months=3):
+        """
+        Juegos de filtros representativos sobre los datos reales: los últimos
+        months meses completos, el mismo rango con la comunidad más frecuente, y
+        sin filtros como control (no hay poda posible).
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT MAX(fecha_ingreso) FROM VISTA_DASHBOARD')
+            maxima = cursor.fetchone()[0]
+            fin = (maxima.date() if maxima else date.today()).replace(day=1)
+            inicio = fin
+            for _ in range(months):
+                inicio = date(inicio.year - (inicio.month == 1), (inicio.month - 2) % 12 + 1, 1)
+            cursor.execute("""
+                SELECT comunidad_atencion FROM VISTA_DASHBOARD
+                WHERE comunidad_atencion IS NOT NULL
+                GROUP BY comunidad_atencion ORDER BY COUNT(*) DESC FETCH FIRST 1 ROWS ONLY
+            """)
+            fila = cursor.fetchone()
+        finally:
+            cursor.close()
+        # fecha_fin es inclusiva: último día del mes anterior a fin
+        rango = {'fecha_inicio': inicio.isoformat(), 'fecha_fin': date.fromordinal(fin.toordinal() - 1).isoformat()}
+        juegos = [('rango', rango)]
+        if fila:
+            juegos.append(('rango+comunidad', dict(rango, comunidad=fila[0])))
+        juegos.append(('sin_filtros', {}))
+        return juegos
+
+    def measure_blocks(self, conn, juegos):
+        """
+        Ejecuta cada sentencia del dashboard con cada juego de filtros y mide los
+        bloques leídos en la sesión (v$mystat: consistent gets, db block gets y
+        physical reads), descontando lo que cuesta la propia lectura de v$mystat.
+        Requiere SELECT sobre v$mystat y v$statname.
+        Returns: list[dict] - una entrada por (juego, sentencia)
+        """
+        cursor = conn.cursor()
+        try:
+            base_a = self._session_stats(cursor)
+            base_b = self._session_stats(cursor)
+            sobrecoste = {k: base_b[k] - base_a[k] for k in base_b}
+
+            resultado = []
+            for juego, filters in juegos:
+                for nombre, sql, params in dashboard_statements(filters):
+                    cursor.arraysize = 1000
+                    antes = self._session_stats(cursor)
+                    start = time.perf_counter()
+                    set_filter_input_sizes(cursor, params)
+                    cursor.execute(sql, params)
+                    filas = len(cursor.fetchall())
+                    segundos = time.perf_counter() - start
+                    despues = self._session_stats(cursor)
+                    medida = {k: max(despues[k] - antes[k] - sobrecoste[k], 0) for k in despues}
+                    resultado.append({
+                        'filters': juego, 'statement': nombre, 'rows': filas,
+                        'ms': round(segundos * 1000, 1), **medida
+                    })
+            return resultado
+        finally:
+            cursor.close()
+
+    def _build_cli(self):
+        """Comandos `flask schema status|migrate|extend|check-pruning|bench`"""
+        grupo = AppGroup('schema', help='Migraciones del esquema (particiones e índices de ingresos)')
+
+        @grupo.command('status', help='Migraciones aplicadas y pendientes')
+        def status_command():
+            for m in self.status(db_pool.get_connection()):
+                estado = m['applied_at'].isoformat(sep=' ', timespec='seconds') if m['applied_at'] else 'pendiente'
+                click.echo(f"{m['id']:<30} {estado:<20} {m['description']}")
+
+        @grupo.command('migrate', help='Aplica las migraciones pendientes')
+        @click.option('--dry-run', is_flag=True, help='Muestra el DDL sin ejecutarlo')
+        def migrate_command(dry_run):
+            ejecutadas = self.migrate(db_pool.get_connection(), dry_run)
+            click.echo(f"{len(ejecutadas)} migraciones {'pendientes' if dry_run else 'aplicadas'}")
+
+        @grupo.command('extend', help='Añade particiones mensuales partiendo P_MAX')
+        @click.option('--months', type=int, default=None, help='Meses vista (por defecto SCHEMA_PARTITION_FUTURE_MONTHS)')
+        @click.option('--dry-run', is_flag=True, help='Muestra el DDL sin ejecutarlo')
+        def extend_command(months, dry_run):
+            creadas = self.extend(db_pool.get_connection(), months, dry_run)
+            click.echo(f'{len(creadas)} particiones nuevas')
+
+        @grupo.command('check-pruning', help='Verifica la poda de particiones en los planes del dashboard')
+        @click.option('--plan', is_flag=True, help='Muestra el plan completo de cada sentencia')
+        def check_pruning_command(plan):
+            conn = db_pool.get_connection()
+            juego = self.sample_filters(conn)[0][1]
+            click.echo(f'Filtros: {juego}')
+            resultado = self.check_pruning(conn, juego)
+            for r in resultado:
+                detalle = ', '.join(f"{p['operation']} {p['start']}-{p['stop']}" for p in r['partitions'])
+                click.echo(f"{r['statement']:<14} {'PODADA' if r['pruned'] else 'SIN PODA':<9} {detalle or 'sin particiones'}")
+                if plan:
+                    click.echo('\n'.join(r['plan']))
+            if not all(r['pruned'] for r in resultado):
+                raise SystemExit(1)
+
+        @grupo.command('bench', help='Bloques leídos por las sentencias del dashboard')
+        @click.option('--json', 'salida', help='Guarda las mediciones en este fichero')
+        @click.option('--baseline', help='Mediciones anteriores (--json) con las que comparar')
+        def bench_command(salida, baseline):
+            conn = db_pool.get_connection()
+            medidas = self.measure_blocks(conn, self.sample_filters(conn))
+            anteriores = {}
+            if baseline:
+                with open(baseline, encoding='utf-8') as f:
+                    anteriores = {(m['filters'], m['statement']): m for m in json.load(f)['results']}
+
+            click.echo(f"{'filtros':<16} {'sentencia':<14} {'filas':>8} {'ms':>9} {'consistent':>11} "
+                       f"{'físicas':>9}" + (f" {'antes':>11} {'ratio':>7}" if anteriores else ''))
+            for m in medidas:
+                linea = (f"{m['filters']:<16} {m['statement']:<14} {m['rows']:>8} {m['ms']:>9} "
+                         f"{m['consistent_gets']:>11} {m['physical_reads']:>9}")
+                anterior = anteriores.get((m['filters'], m['statement']))
+                if anterior:
+                    ratio = anterior['consistent_gets'] / m['consistent_gets'] if m['consistent_gets'] else float('inf')
+                    linea += f" {anterior['consistent_gets']:>11} {ratio:>6.1f}x"
+                click.echo(linea)
+
+            if salida:
+                with open(salida, 'w', encoding='utf-8') as f:
+                    json.dump({'table': self.table, 'at': datetime.now().isoformat(), 'results': medidas}, f, indent=2)
+
+        return grupo
+
+schema_migrations = SchemaMigrations()
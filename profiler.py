@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from flask import g, has_app_context
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w:$.])\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*(?:\?|:\w+)(?:\s*,\s*(?:\?|:\w+))+\s*\)')
+_SPACES = re.compile(r'\s+')
+_SELECT = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+# Orden admitido en la lista de sentencias más costosas
+ORDENES = ('total_ms', 'max_ms', 'avg_ms', 'count', 'slow')
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """
+    Forma canónica para agrupar sentencias equivalentes: literales y números -> ?,
+    listas IN -> (...) y espacios colapsados. Los binds (:1, :email) se conservan.
+    """
+    sql = _LITERAL.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+def explain_plan_text(cursor, sql, params=None):
+    """Plan estimado de una consulta (DBMS_XPLAN, formato TYPICAL) sin ejecutarla"""
+    statement_id = f'slow_{secrets.token_hex(8)}'
+    cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {sql}", params or [])
+    cursor.execute(
+        "SELECT plan_table_output FROM TABLE(DBMS_XPLAN.DISPLAY('PLAN_TABLE', :1, 'TYPICAL'))",
+        [statement_id]
+    )
+    lineas = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute("DELETE FROM plan_table WHERE statement_id = :1", [statement_id])
+    return lineas
+
+class ProfiledStatement:
+    """Una ejecución de sentencia: tiempo de execute y fetch acumulado hasta que se cierra el cursor"""
+    __slots__ = ('profiler', 'sql', 'parameters', 'binds', 'route', 'connection', 'elapsed', 'rows', 'error', 'done')
+
+    def __init__(self, profiler, sql, parameters, route, connection):
+        self.profiler = profiler
+        self.sql = sql
+        self.parameters = parameters
+        self.binds = len(parameters) if parameters else 0
+        self.route = route
+        self.connection = connection
+        self.elapsed = 0.0
+        self.rows = 0
+        self.error = None
+        self.done = False
+
+    def add(self, segundos, filas=0):
+        self.elapsed += segundos
+        self.rows += filas
+
+    def finish(self):
+        if not self.done:
+            self.done = True
+            self.profiler.record(self)
+
+class QueryProfiler:
+    """
+    Perfil de las sentencias SQL: tiempo (execute + fetch), filas, número de binds
+    y ruta, agregado por SQL normalizado. Las sentencias que superan el umbral se
+    escriben en un log rotativo (una línea JSON) con su plan de ejecución.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.threshold = 0.5
+        self.max_statements = 500
+        self.explain = True
+        self.explain_interval = 300
+        self.log_path = None
+        self.logger = logging.getLogger('slow_queries')
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._recent = deque(maxlen=50)
+        self.slow_total = 0
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['SLOW_QUERY_ENABLED']
+        self.threshold = config['SLOW_QUERY_THRESHOLD_MS'] / 1000
+        self.max_statements = config['SLOW_QUERY_MAX_STATEMENTS']
+        self.explain = config['SLOW_QUERY_EXPLAIN']
+        self.explain_interval = config['SLOW_QUERY_EXPLAIN_INTERVAL']
+        if not self.enabled:
+            return
+
+        self.log_path = config['SLOW_QUERY_LOG_PATH'] or os.path.join(app.instance_path, 'slow_queries.log')
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        # Crear la app varias veces (tests, bench, CLI) no debe duplicar cada línea del log
+        destino = os.path.abspath(self.log_path)
+        for handler in [h for h in self.logger.handlers if isinstance(h, RotatingFileHandler)]:
+            if handler.baseFilename != destino:
+                self.logger.removeHandler(handler)
+                handler.close()
+        if not any(getattr(h, 'baseFilename', None) == destino for h in self.logger.handlers):
+            handler = RotatingFileHandler(
+                self.log_path,
+                maxBytes=config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=config['SLOW_QUERY_LOG_BACKUPS'],
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        app.teardown_request(self._finish_request)
+
+    def start(self, sql, parameters, route, connection):
+        """
+        Abre el registro de una sentencia (None si el perfil está desactivado). Se
+        cierra con finish() al cerrar el cursor, al ejecutar otra sentencia en él
+        o al terminar la petición.
+        """
+        if not self.enabled:
+            return None
+        statement = ProfiledStatement(self, sql, parameters, route, connection)
+        if has_app_context():
+            g.setdefault('profiled_statements', []).append(statement)
+        return statement
+
+    def _finish_request(self, exception=None):
+        for statement in g.pop('profiled_statements', ()):
+            statement.finish()
+
+    def record(self, statement):
+        normalizada = normalize_sql(statement.sql)
+        lenta = statement.elapsed >= self.threshold
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._stats.get(normalizada)
+            if entrada is None:
+                if len(self._stats) >= self.max_statements:
+                    # Se descarta la sentencia que menos tiempo acumula
+                    del self._stats[min(self._stats, key=lambda k: self._stats[k]['total_ms'])]
+                entrada = self._stats[normalizada] = {
+                    'sql': normalizada, 'binds': statement.binds, 'count': 0, 'slow': 0, 'errors': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'routes': {}, 'last_at': None, 'explained_at': None
+                }
+            milisegundos = statement.elapsed * 1000
+            entrada['count'] += 1
+            entrada['total_ms'] += milisegundos
+            entrada['max_ms'] = max(entrada['max_ms'], milisegundos)
+            entrada['rows'] += statement.rows
+            entrada['errors'] += statement.error is not None
+            entrada['routes'][statement.route] = entrada['routes'].get(statement.route, 0) + 1
+            entrada['last_at'] = datetime.now().isoformat(timespec='seconds')
+            explicar = (lenta and self.explain and _SELECT.match(statement.sql) is not None and
+                        (entrada['explained_at'] is None or ahora - entrada['explained_at'] > self.explain_interval))
+            if lenta:
+                entrada['slow'] += 1
+                self.slow_total += 1
+            if explicar:
+                entrada['explained_at'] = ahora
+
+        if not lenta:
+            return
+
+        registro = {
+            'at': datetime.now().isoformat(timespec='milliseconds'),
+            'route': statement.route,
+            'elapsed_ms': round(milisegundos, 1),
+            'rows': statement.rows,
+            'binds': statement.binds,
+            'error': statement.error,
+            'sql': normalizada,
+            # Solo la primera vez (o pasado explain_interval) para no repetir EXPLAIN en cada ejecución
+            'plan': self._explain(statement) if explicar else None
+        }
+        self.logger.info(json.dumps(registro, ensure_ascii=False))
+        with self._lock:
+            self._recent.appendleft(registro)
+
+    def _explain(self, statement):
+        try:
+            cursor = statement.connection.cursor()
+            try:
+                return explain_plan_text(cursor, statement.sql, statement.parameters)
+            finally:
+                cursor.close()
+        except Exception as e:
+            return [f'Plan no disponible: {e}']
+
+    def top(self, orden='total_ms', limite=50):
+        """Sentencias más costosas según orden (total_ms, max_ms, avg_ms, count o slow)"""
+        with self._lock:
+            entradas = [dict(e, routes=dict(e['routes'])) for e in self._stats.values()]
+        for entrada in entradas:
+            entrada['avg_ms'] = entrada['total_ms'] / entrada['count']
+            entrada.pop('explained_at')
+        entradas.sort(key=lambda e: e[orden], reverse=True)
+        return entradas[:limite]
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def get_stats(self, orden='total_ms', limite=20):
+        with self._lock:
+            sentencias = len(self._stats)
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold * 1000,
+            'statements': sentencias,
+            'slow_total': self.slow_total,
+            'log_path': self.log_path,
+            'top': self.top(orden, limite),
+            'recent': self.recent()
+        }
+
+query_profiler = QueryProfiler()
@@ -0,0 +1,210 @@
+import math
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify, flash, render_template, make_response
+
+def parse_limit(spec):
+    """'5/300' -> (5, 300): como máximo 5 peticiones cada 300 segundos"""
+    count, seconds = spec.split('/', 1)
+    return int(count), int(seconds)
+
+class MemoryRateLimitStore:
+    """
+    Contadores de ventana deslizante en proceso: se guarda el recuento de la ventana
+    actual y de la anterior, y la anterior se pondera por la fracción que sigue dentro.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        """Olvida las claves sin actividad en las dos últimas ventanas"""
+        for key in [k for k, (start, window, _, _) in self._data.items() if now - start >= 2 * window]:
+            del self._data[key]
+
+    def hit(self, key, limit, window):
+        """Registra un intento. Returns: float - segundos de espera (0 si se permite)"""
+        now = time.time()
+        start = now - now % window
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < start - window:
+                previous, current = 0, 0
+            elif entry[0] < start:
+                previous, current = entry[3], 0
+            else:
+                previous, current = entry[2], entry[3]
+
+            weight = 1 - (now - start) / window
+            if previous * weight + current >= limit:
+                self._data[key] = (start, window, previous, current)
+                return max(window - (now - start), 1)
+
+            self._data[key] = (start, window, previous, current + 1)
+            if len(self._data) > self.max_keys:
+                self._prune(now)
+        return 0
+
+    def reset(self, key, window):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self):
+        return len(self._data)
+
+# Comprobación e incremento en un solo paso dentro de Redis: dos workers no pueden
+# leer el mismo recuento y pasar ambos el límite
+HIT_SCRIPT = """
+local actual = tonumber(redis.call('GET', KEYS[1]) or '0')
+local anterior = tonumber(redis.call('GET', KEYS[2]) or '0')
+if anterior * tonumber(ARGV[1]) + actual >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+class RedisRateLimitStore:
+    """
+    Misma ventana deslizante sobre Redis, compartida entre workers y máquinas.
+    Cada ventana es un contador INCR con caducidad de dos ventanas; la lectura y
+    el incremento van en un script Lua atómico.
+    """
+
+    def __init__(self, url, key_prefix='malackathon:ratelimit:'):
+        import redis  # Dependencia opcional, solo necesaria con RATE_LIMIT_BACKEND=redis
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+        self._hit = self.client.register_script(HIT_SCRIPT)
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        weight = 1 - (now % window) / window
+        permitido = self._hit(
+            keys=[f'{self.key_prefix}{key}:{index}', f'{self.key_prefix}{key}:{index - 1}'],
+            args=[weight, limit, 2 * window]
+        )
+        return 0 if permitido else max(window - now % window, 1)
+
+    def reset(self, key, window):
+        # Solo cuentan la ventana actual y la anterior; se borran por nombre, sin
+        # patrones (un email puede contener *, ? o [ y casar con claves ajenas)
+        index = int(time.time() // window)
+        self.client.delete(f'{self.key_prefix}{key}:{index}', f'{self.key_prefix}{key}:{index - 1}')
+
+    def size(self):
+        return None
+
+class RateLimiter:
+    """
+    Limitador por IP y por email delante de los endpoints de autenticación. Rechaza
+    antes de tocar Oracle, bcrypt o SMTP, así el tráfico abusivo no genera carga.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.store = None
+        self.rules = {}
+        self._lock = threading.Lock()
+        self.allowed = {}
+        self.rejected = {}
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        if config['RATE_LIMIT_BACKEND'] == 'redis':
+            self.store = RedisRateLimitStore(config['RATE_LIMIT_REDIS_URL'])
+        else:
+            self.store = MemoryRateLimitStore()
+        self.rules = {
+            'login': {'ip': parse_limit(config['RATE_LIMIT_LOGIN_IP']),
+                      'email': parse_limit(config['RATE_LIMIT_LOGIN_EMAIL'])},
+            'verify_check': {'ip': parse_limit(config['RATE_LIMIT_VERIFY_IP']),
+                             'email': parse_limit(config['RATE_LIMIT_VERIFY_EMAIL'])},
+            'verify_resend': {'ip': parse_limit(config['RATE_LIMIT_RESEND_IP']),
+                              'email': parse_limit(config['RATE_LIMIT_RESEND_EMAIL'])},
+        }
+
+    def _count(self, counters, scope):
+        with self._lock:
+            counters[scope] = counters.get(scope, 0) + 1
+
+    def check(self, scope, ip, email=None):
+        """
+        Registra un intento para la IP y el email.
+        Returns: int - segundos hasta poder reintentar (0 si se permite)
+        """
+        if not self.enabled:
+            return 0
+
+        rules = self.rules[scope]
+        keys = [('ip', ip)]
+        if email:
+            keys.append(('email', str(email).strip().lower()))
+
+        for kind, value in keys:
+            limit, window = rules[kind]
+            retry_after = self.store.hit(f'{scope}:{kind}:{value}', limit, window)
+            if retry_after:
+                self._count(self.rejected, scope)
+                return math.ceil(retry_after)
+
+        self._count(self.allowed, scope)
+        return 0
+
+    def reset(self, scope, email):
+        """Limpia el contador del email (p. ej. tras un login correcto)"""
+        if self.enabled and email:
+            _, window = self.rules[scope]['email']
+            self.store.reset(f'{scope}:email:{email.strip().lower()}', window)
+
+    def limit(self, scope, email_field, template=None):
+        """
+        Decorador para rutas POST. Las peticiones JSON reciben 429 con Retry-After;
+        los formularios vuelven a la plantilla con un aviso.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if request.method != 'POST':
+                    return f(*args, **kwargs)
+
+                if request.is_json:
+                    email = (request.get_json(silent=True) or {}).get(email_field)
+                else:
+                    email = request.form.get(email_field)
+
+                retry_after = self.check(scope, request.remote_addr, email)
+                if not retry_after:
+                    return f(*args, **kwargs)
+
+                mensaje = f'Demasiados intentos. Vuelve a intentarlo en {retry_after} segundos.'
+                if template is None:
+                    response = jsonify({'success': False, 'message': mensaje})
+                else:
+                    flash(mensaje, 'danger')
+                    response = make_response(render_template(template))
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return decorated_function
+        return decorator
+
+    def get_stats(self):
+        with self._lock:
+            stats = {'allowed': dict(self.allowed), 'rejected': dict(self.rejected)}
+        stats.update({
+            'enabled': self.enabled,
+            'backend': type(self.store).__name__ if self.store else None,
+            'keys': self.store.size() if self.store else 0,
+            'rules': {scope: {kind: f'{limit}/{window}' for kind, (limit, window) in rules.items()}
+                      for scope, rules in self.rules.items()}
+        })
+        return stats
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,167 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from db_utils import db_pool
+from cache_utils import data_version
+from dashboard import FILTROS_FECHA, FilterError, parse_filter_date
+
+# Medidas aditivas por (comunidad, sexo, categoría, mes) y periodo de fecha_ingreso
+ROLLUP_SELECT = """
+    SELECT comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso,
+           TRUNC(fecha_ingreso, '{formato}') AS fecha_periodo,
+           COUNT(*) AS total,
+           COUNT(estancia_dias) AS n_estancia,
+           SUM(estancia_dias) AS suma_estancia,
+           SUM(coste_apr) AS coste_total,
+           COUNT(CASE WHEN dias_uci > 0 THEN 1 END) AS n_uci,
+           SUM(CASE WHEN dias_uci > 0 THEN dias_uci END) AS suma_uci,
+           SYSTIMESTAMP AS actualizado_en
+    FROM VISTA_DASHBOARD
+    WHERE 1=1{desde}
+    GROUP BY comunidad_atencion, sexo, categoria_diagnostico, mes_ingreso, TRUNC(fecha_ingreso, '{formato}')
+"""
+
+# Granularidad del periodo -> formato de TRUNC en Oracle
+FORMATOS = {'day': 'DD', 'month': 'MM'}
+
+class DashboardRollup:
+    """
+    Tabla resumen gestionada por la aplicación con los agregados del dashboard.
+    Se crea con CTAS sobre VISTA_DASHBOARD (hereda los tipos de la vista) y se
+    recalcula completa o solo a partir de una fecha; /api/data la consulta en
+    lugar de recorrer todos los ingresos.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.table = 'DASHBOARD_ROLLUP'
+        self.grain = 'day'
+        self.refresh_days = 62
+        self._lock = threading.Lock()
+        self.last_refresh = None
+
+    def init_app(self, app):
+        self.app = app
+        self.table = app.config['DASHBOARD_ROLLUP_TABLE']
+        self.grain = app.config['DASHBOARD_ROLLUP_GRAIN']
+        self.refresh_days = app.config['DASHBOARD_ROLLUP_REFRESH_DAYS']
+        if self.grain not in FORMATOS:
+            raise ValueError(f'DASHBOARD_ROLLUP_GRAIN no válido: {self.grain}')
+        app.cli.add_command(self._build_cli())
+
+    def _select(self, desde=False):
+        formato = FORMATOS[self.grain]
+        condicion = f" AND (fecha_ingreso >= TRUNC(:desde, '{formato}') OR fecha_ingreso IS NULL)"
+        return ROLLUP_SELECT.format(formato=formato, desde=condicion if desde else '')
+
+    def can_serve(self, filters):
+        """
+        True si los filtros de fecha coinciden con límites de periodo. Las fechas se
+        interpretan igual que en la consulta sobre la vista (parse_filter_date): una
+        con hora distinta de medianoche parte un día que el rollup solo tiene entero,
+        y con grano mensual tampoco vale un rango que empieza o acaba a mitad de mes.
+        Esos casos se resuelven en la vista.
+        Se asume fecha_ingreso sin componente horaria (el filtro <= compara a medianoche).
+        """
+        for nombre in FILTROS_FECHA:
+            if not filters.get(nombre):
+                continue
+            try:
+                fecha = parse_filter_date(filters[nombre])
+            except FilterError:
+                return False
+            if fecha.tzinfo is not None or fecha != datetime.combine(fecha.date(), datetime.min.time()):
+                return False
+            if self.grain == 'month':
+                if nombre == 'fecha_inicio' and fecha.day != 1:
+                    return False
+                if nombre == 'fecha_fin' and (fecha + timedelta(days=1)).day != 1:
+                    return False
+        return True
+
+    def create(self, conn):
+        """Crea y llena la tabla resumen (falla si ya existe)"""
+        cursor = conn.cursor()
+        cursor.execute(f'CREATE TABLE {self.table} AS {self._select()}')
+        cursor.execute(f'CREATE INDEX {self.table}_periodo_ix ON {self.table} (fecha_periodo)')
+        cursor.close()
+        self.last_refresh = {'mode': 'create', 'at': datetime.now().isoformat()}
+
+    def refresh(self, conn, desde=None):
+        """
+        Recalcula el rollup en una única transacción: completo (desde=None) o solo
+        los periodos a partir de desde y las filas sin fecha. Las lecturas
+        concurrentes ven la versión anterior hasta el COMMIT.
+        Returns: dict - filas borradas/insertadas y duración
+        """
+        with self._lock:
+            start = time.perf_counter()
+            cursor = conn.cursor()
+            try:
+                if desde is None:
+                    cursor.execute(f'DELETE FROM {self.table}')
+                    borradas = cursor.rowcount
+                    cursor.execute(f'INSERT INTO {self.table} {self._select()}')
+                else:
+                    cursor.execute(
+                        f"DELETE FROM {self.table} WHERE fecha_periodo >= TRUNC(:desde, '{FORMATOS[self.grain]}')"
+                        " OR fecha_periodo IS NULL",
+                        desde=desde
+                    )
+                    borradas = cursor.rowcount
+                    cursor.execute(f'INSERT INTO {self.table} {self._select(desde=True)}', desde=desde)
+                insertadas = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+            self.last_refresh = {
+                'mode': 'full' if desde is None else 'incremental',
+                'since': desde.isoformat() if desde is not None else None,
+                'deleted': borradas,
+                'inserted': insertadas,
+                'seconds': round(time.perf_counter() - start, 3),
+                'at': datetime.now().isoformat()
+            }
+            return self.last_refresh
+
+    def get_stats(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*), MAX(actualizado_en) FROM {self.table}')
+        filas, actualizado = cursor.fetchone()
+        cursor.close()
+        return {
+            'table': self.table,
+            'grain': self.grain,
+            'rows': filas,
+            'updated_at': actualizado.isoformat() if actualizado else None,
+            'last_refresh': self.last_refresh
+        }
+
+    def _build_cli(self):
+        """Comandos `flask rollup create` y `flask rollup refresh [--full] [--days N]`"""
+        grupo = AppGroup('rollup', help='Tabla resumen del dashboard')
+
+        @grupo.command('create', help='Crea y llena la tabla resumen')
+        def create_command():
+            self.create(db_pool.get_connection())
+            click.echo(f'{self.table} creada')
+
+        @grupo.command('refresh', help='Recalcula la tabla resumen')
+        @click.option('--full', is_flag=True, help='Recalcular todos los periodos')
+        @click.option('--days', type=int, default=None, help='Días hacia atrás a recalcular')
+        def refresh_command(full, days):
+            desde = None if full else datetime.now() - timedelta(days=days or self.refresh_days)
+            resultado = self.refresh(db_pool.get_connection(), desde)
+            # Los workers comparan esta versión en cada consulta a sus cachés
+            data_version.bump()
+            click.echo(resultado)
+
+        return grupo
+
+dashboard_rollup = DashboardRollup()
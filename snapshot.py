@@ -0,0 +1,452 @@
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import oracledb
+import click
+from flask.cli import AppGroup
+from db_utils import db_pool
+from cache_utils import data_version
+from dashboard import FILTROS_FECHA, FilterError, decode_cursor, encode_cursor, parse_filter_date
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+SNAPSHOT_QUERY = 'SELECT * FROM VISTA_DASHBOARD ORDER BY fecha_ingreso ASC NULLS LAST, id ASC'
+
+# Filtros de igualdad -> columna del snapshot (los de fecha se tratan aparte)
+COLUMNAS_IGUALDAD = [
+    ('comunidad', 'COMUNIDAD_ATENCION'),
+    ('sexo', 'SEXO'),
+    ('categoria', 'CATEGORIA_DIAGNOSTICO'),
+]
+
+class _ColumnaNoEntera(Exception):
+    """Una columna NUMBER sin precisión que se guardaba como int64 trae decimales"""
+
+    def __init__(self, columnas):
+        super().__init__(', '.join(columnas))
+        self.columnas = columnas
+
+class DashboardSnapshot:
+    """
+    Copia local en columnas (Arrow IPC) de VISTA_DASHBOARD para servir /api/data y
+    /api/table sin Oracle. El fichero se reemplaza de forma atómica al refrescar y
+    cada worker lo mapea en memoria, así todos comparten las mismas páginas.
+    Requiere pyarrow (dependencia opcional, solo con DASHBOARD_SNAPSHOT_ENABLED).
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.path = None
+        self.refresh_seconds = 900
+        self.arraysize = 5000
+        self._lock = threading.Lock()
+        self._table = None
+        self._mtime = None
+        self._refreshing = False
+        self.last_refresh = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['DASHBOARD_SNAPSHOT_ENABLED']
+        self.path = app.config['DASHBOARD_SNAPSHOT_PATH'] or os.path.join(app.instance_path, 'dashboard.arrow')
+        self.refresh_seconds = app.config['DASHBOARD_SNAPSHOT_REFRESH_SECONDS']
+        self.arraysize = app.config['EXPORT_ARRAYSIZE']
+        app.cli.add_command(self._build_cli())
+
+    # ---------- Escritura ----------
+
+    @staticmethod
+    def _unconstrained_number(desc):
+        """NUMBER sin precisión (p. ej. ID ... GENERATED AS IDENTITY): precisión 0 y escala -127"""
+        return desc[1] is oracledb.DB_TYPE_NUMBER and not desc[4] and desc[5] in (0, -127)
+
+    @classmethod
+    def _arrow_type(cls, desc, enteros=False):
+        """
+        Tipo Arrow de una columna según cursor.description de oracledb. NUMBER con
+        escala 0 y hasta 18 dígitos es int64 (cabe sin pérdida); un NUMBER sin
+        precisión es int64 si enteros (sus valores son enteros) y si no float64,
+        igual que el resto. Los tipos no reconocidos se guardan como texto.
+        """
+        import pyarrow as pa
+
+        tipo, precision, escala = desc[1], desc[4], desc[5]
+        if cls._unconstrained_number(desc):
+            return pa.int64() if enteros else pa.float64()
+        if tipo is oracledb.DB_TYPE_NUMBER:
+            return pa.int64() if escala == 0 and 0 < (precision or 0) <= 18 else pa.float64()
+        tipos = {
+            oracledb.DB_TYPE_BINARY_DOUBLE: pa.float64(),
+            oracledb.DB_TYPE_BINARY_FLOAT: pa.float64(),
+            oracledb.DB_TYPE_BINARY_INTEGER: pa.int64(),
+            oracledb.DB_TYPE_BOOLEAN: pa.bool_(),
+            oracledb.DB_TYPE_DATE: pa.timestamp('us'),
+            oracledb.DB_TYPE_TIMESTAMP: pa.timestamp('us'),
+            oracledb.DB_TYPE_TIMESTAMP_LTZ: pa.timestamp('us'),
+            oracledb.DB_TYPE_TIMESTAMP_TZ: pa.timestamp('us'),
+            oracledb.DB_TYPE_RAW: pa.binary(),
+            oracledb.DB_TYPE_LONG_RAW: pa.binary(),
+        }
+        return tipos.get(tipo, pa.string())
+
+    @staticmethod
+    def _to_array(valores, tipo):
+        import pyarrow as pa
+        if tipo == pa.string():
+            return pa.array([None if v is None else str(v) for v in valores], type=tipo)
+        return pa.array(valores, type=tipo)
+
+    def write(self, cursor, path=None):
+        """
+        Vuelca la vista al fichero y lo publica con os.replace. El esquema se fija
+        con cursor.description y el primer lote, así cada lote de fetchmany se
+        escribe en cuanto llega y la memoria no crece con el número de filas.
+        Un NUMBER sin precisión se guarda como int64 si el primer lote solo trae
+        enteros (los ID salen como en Oracle, 123 y no 123.0); si un lote posterior
+        trae decimales, el volcado se repite con esa columna en float64.
+        Returns: int - filas escritas
+        """
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        flotantes = set()
+        while True:
+            try:
+                filas = self._write(cursor, f'{path}.{os.getpid()}.tmp', flotantes)
+                break
+            except _ColumnaNoEntera as e:
+                flotantes.update(e.columnas)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+        return filas
+
+    def _write(self, cursor, tmp_path, flotantes):
+        import pyarrow as pa
+
+        cursor.arraysize = self.arraysize
+        cursor.prefetchrows = self.arraysize + 1
+        cursor.execute(SNAPSHOT_QUERY)
+        rows = cursor.fetchmany()
+
+        campos, inciertas = [], []
+        for i, desc in enumerate(cursor.description):
+            enteros = False
+            if self._unconstrained_number(desc) and desc[0] not in flotantes:
+                enteros = all(row[i] is None or isinstance(row[i], int) for row in rows)
+                if enteros:
+                    inciertas.append(i)
+            campos.append((desc[0], self._arrow_type(desc, enteros)))
+        schema = pa.schema(campos)
+
+        filas = 0
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    while rows:
+                        fallidas = [schema[i].name for i in inciertas
+                                    if not all(row[i] is None or isinstance(row[i], int) and -2**63 <= row[i] < 2**63
+                                               for row in rows)]
+                        if fallidas:
+                            raise _ColumnaNoEntera(fallidas)
+                        columnas = [self._to_array([row[i] for row in rows], campo.type)
+                                    for i, campo in enumerate(schema)]
+                        writer.write_batch(pa.record_batch(columnas, schema=schema))
+                        filas += len(rows)
+                        rows = cursor.fetchmany()
+        except Exception:
+            # Un volcado a medias no se publica
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return filas
+
+    def refresh(self, conn):
+        """Regenera el snapshot desde Oracle. Returns: dict con filas y duración"""
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            filas = self.write(cursor)
+        finally:
+            cursor.close()
+        self.last_refresh = {
+            'rows': filas,
+            'seconds': round(time.perf_counter() - start, 3),
+            'at': datetime.now().isoformat()
+        }
+        # Los resultados cacheados en cualquier worker se calcularon sobre el snapshot anterior
+        data_version.bump()
+        return self.last_refresh
+
+    def _refresh_in_background(self):
+        """Un solo worker refresca (flock no bloqueante); el resto sigue con el fichero actual"""
+        try:
+            with open(f'{self.path}.lock', 'w') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return
+                # Otro worker pudo terminar mientras esperábamos
+                if not self._is_stale():
+                    return
+                with self.app.app_context():
+                    self.refresh(db_pool.get_connection())
+        except Exception:
+            self.app.logger.exception('Error al refrescar el snapshot del dashboard')
+        finally:
+            self._refreshing = False
+
+    def _is_stale(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.refresh_seconds
+        except OSError:
+            return True
+
+    # ---------- Lectura ----------
+
+    def get_table(self):
+        """
+        Tabla Arrow mapeada en memoria (None si aún no hay snapshot). Si el fichero
+        ha cambiado se vuelve a mapear; si ha caducado se refresca en segundo plano.
+        """
+        if not self.enabled:
+            return None
+
+        if self._is_stale() and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, name='dashboard-snapshot',
+                                     daemon=True).start()
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+        if mtime != self._mtime:
+            import pyarrow as pa
+            with self._lock:
+                if mtime != self._mtime:
+                    self._table = pa.ipc.open_file(pa.memory_map(self.path, 'r')).read_all()
+                    self._mtime = mtime
+        return self._table
+
+    @staticmethod
+    def can_serve(filters):
+        """
+        Las fechas del filtro deben poder interpretarse aquí igual que en Oracle
+        (parse_filter_date). Con zona horaria no se pueden comparar con la columna
+        sin zona del snapshot; esas, y las no válidas (400), se resuelven en Oracle.
+        """
+        for nombre in FILTROS_FECHA:
+            if filters.get(nombre):
+                try:
+                    if parse_filter_date(filters[nombre]).tzinfo is not None:
+                        return False
+                except FilterError:
+                    return False
+        return True
+
+    @staticmethod
+    def _mask(tabla, filters):
+        """Máscara de los filtros del dashboard con pyarrow.compute (None si no hay filtros)"""
+        import pyarrow.compute as pc
+
+        mascara = None
+        condiciones = []
+        for nombre, columna in COLUMNAS_IGUALDAD:
+            if filters.get(nombre):
+                condiciones.append(pc.equal(tabla[columna], filters[nombre]))
+        if filters.get('fecha_inicio'):
+            condiciones.append(pc.greater_equal(tabla['FECHA_INGRESO'], parse_filter_date(filters['fecha_inicio'])))
+        if filters.get('fecha_fin'):
+            condiciones.append(pc.less_equal(tabla['FECHA_INGRESO'], parse_filter_date(filters['fecha_fin'])))
+
+        for condicion in condiciones:
+            mascara = condicion if mascara is None else pc.and_(mascara, condicion)
+        # Los nulos en la comparación cuentan como no coincidentes, igual que en SQL
+        return None if mascara is None else pc.fill_null(mascara, False)
+
+    def filter_table(self, tabla, filters):
+        """Tabla con las filas que cumplen los filtros (todas sus columnas)"""
+        mascara = self._mask(tabla, filters)
+        return tabla if mascara is None else tabla.filter(mascara)
+
+    def filter_indices(self, tabla, filters):
+        """Posiciones de las filas que cumplen los filtros, sin copiar columnas (None = todas)"""
+        import pyarrow.compute as pc
+        mascara = self._mask(tabla, filters)
+        return None if mascara is None else pc.indices_nonzero(mascara)
+
+    def count(self, tabla, filters):
+        import pyarrow.compute as pc
+        mascara = self._mask(tabla, filters)
+        return tabla.num_rows if mascara is None else pc.sum(mascara).as_py() or 0
+
+    @staticmethod
+    def _rows(tabla, indices, inicio, cantidad):
+        """
+        Filas [inicio, inicio + cantidad) de la selección; solo se copian las de la
+        página. Se toman de cada lote del fichero: take sobre la tabla troceada
+        concatenaría antes las columnas completas.
+        """
+        import pyarrow as pa
+
+        if indices is None:
+            return tabla.slice(inicio, cantidad).to_pylist()
+        posiciones = indices.slice(inicio, cantidad).to_numpy().astype(np.int64)
+        lotes = tabla.to_batches()
+        comienzos = np.cumsum([0] + [lote.num_rows for lote in lotes])
+        numeros = np.searchsorted(comienzos, posiciones, side='right') - 1
+        filas = []
+        for numero in np.unique(numeros):
+            locales = posiciones[numeros == numero] - comienzos[numero]
+            filas.extend(lotes[numero].take(pa.array(locales)).to_pylist())
+        return filas
+
+    @staticmethod
+    def _numeric(columna):
+        """Columna como float64; los textos no numéricos pasan a nulo (como pd.to_numeric coerce)"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        if pa.types.is_integer(columna.type) or pa.types.is_floating(columna.type) or pa.types.is_decimal(columna.type):
+            return pc.cast(columna, pa.float64())
+        return pa.chunked_array([pa.array(pd.to_numeric(columna.to_pandas(), errors='coerce'), type=pa.float64())])
+
+    @staticmethod
+    def _counts(columna, ordenar_por_clave=False):
+        import pyarrow.compute as pc
+        conteos = {}
+        for item in pc.value_counts(columna).to_pylist():
+            if item['values'] is not None:
+                conteos[item['values']] = item['counts']
+        if ordenar_por_clave:
+            return dict(sorted(conteos.items()))
+        return dict(sorted(conteos.items(), key=lambda item: item[1], reverse=True))
+
+    def aggregate(self, tabla, filters):
+        """Mismo diccionario que aggregate_dataframe, calculado sobre el snapshot"""
+        import pyarrow.compute as pc
+
+        tabla = self.filter_table(tabla, filters)
+        if tabla.num_rows == 0:
+            return None
+        columnas = set(tabla.column_names)
+
+        pacientes_uci = 0
+        dias_uci_promedio = 0
+        ingresos_uci_dict = {}
+        if 'DIAS_UCI' in columnas:
+            dias = self._numeric(tabla['DIAS_UCI'])
+            con_uci = dias.filter(pc.greater(dias, 0), null_selection_behavior='drop')
+            pacientes_uci = len(con_uci)
+            if pacientes_uci:
+                dias_uci_promedio = pc.mean(con_uci).as_py() or 0
+            ingresos_uci_dict = {'Sin UCI': tabla.num_rows - pacientes_uci, 'Con UCI': pacientes_uci}
+
+        estancia_promedio = 0
+        if 'ESTANCIA_DIAS' in columnas:
+            estancia_promedio = pc.mean(self._numeric(tabla['ESTANCIA_DIAS'])).as_py() or 0
+
+        coste_total = 0
+        if 'COSTE_APR' in columnas:
+            coste_total = pc.sum(self._numeric(tabla['COSTE_APR'])).as_py() or 0
+
+        return {
+            'comunidades': self._counts(tabla['COMUNIDAD_ATENCION']) if 'COMUNIDAD_ATENCION' in columnas else {},
+            'sexos': self._counts(tabla['SEXO']) if 'SEXO' in columnas else {},
+            'categorias': self._counts(tabla['CATEGORIA_DIAGNOSTICO']) if 'CATEGORIA_DIAGNOSTICO' in columnas else {},
+            'ingresos_por_mes': self._counts(tabla['MES_INGRESO'], True) if 'MES_INGRESO' in columnas else {},
+            'estancia_promedio': float(estancia_promedio),
+            'coste_total': float(coste_total),
+            'ingresos_uci': ingresos_uci_dict,
+            'pacientes_uci': pacientes_uci,
+            'dias_uci_promedio': float(dias_uci_promedio)
+        }
+
+    def page(self, tabla, filters, page, per_page):
+        """Página por desplazamiento. Returns: (items, total)"""
+        indices = self.filter_indices(tabla, filters)
+        total = tabla.num_rows if indices is None else len(indices)
+        return self._rows(tabla, indices, (page - 1) * per_page, per_page), total
+
+    def keyset_page(self, tabla, filters, per_page, token=None):
+        """
+        Página por cursor con los mismos cursores que fetch_keyset_page. El snapshot
+        ya está ordenado por (fecha_ingreso NULLS LAST, id), así que las filas
+        posteriores a la clave son un sufijo y las anteriores un prefijo.
+        Returns: (items, next_cursor, prev_cursor)
+        """
+        import pyarrow.compute as pc
+
+        indices = self.filter_indices(tabla, filters)
+        fechas, ids = tabla['FECHA_INGRESO'], tabla['ID']
+        if indices is not None:
+            # Solo las dos columnas de la clave, no la tabla filtrada completa
+            fechas, ids = fechas.take(indices), ids.take(indices)
+        total = len(fechas)
+
+        if token:
+            fecha, id_, direccion = decode_cursor(token)
+            if direccion == 'next':
+                if fecha is None:
+                    despues = pc.and_(pc.is_null(fechas), pc.greater(ids, id_))
+                else:
+                    despues = pc.or_kleene(
+                        pc.or_kleene(pc.greater(fechas, fecha), pc.is_null(fechas)),
+                        pc.and_kleene(pc.equal(fechas, fecha), pc.greater(ids, id_))
+                    )
+                inicio = total - (pc.sum(pc.fill_null(despues, False)).as_py() or 0)
+                fin = inicio + per_page
+            else:
+                if fecha is None:
+                    antes = pc.or_(pc.is_valid(fechas), pc.less(ids, id_))
+                else:
+                    antes = pc.or_kleene(
+                        pc.less(fechas, fecha),
+                        pc.and_kleene(pc.equal(fechas, fecha), pc.less(ids, id_))
+                    )
+                fin = pc.sum(pc.fill_null(antes, False)).as_py() or 0
+                inicio = max(fin - per_page, 0)
+        else:
+            inicio, fin = 0, per_page
+
+        filas = self._rows(tabla, indices, inicio, fin - inicio)
+        if not filas:
+            return filas, None, None
+
+        tiene_siguiente = inicio + len(filas) < total
+        tiene_anterior = inicio > 0
+        primera, ultima = filas[0], filas[-1]
+        next_cursor = encode_cursor(ultima['FECHA_INGRESO'], ultima['ID'], 'next') if tiene_siguiente else None
+        prev_cursor = encode_cursor(primera['FECHA_INGRESO'], primera['ID'], 'prev') if tiene_anterior else None
+        return filas, next_cursor, prev_cursor
+
+    def get_stats(self):
+        tabla = self._table
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'rows': tabla.num_rows if tabla is not None else None,
+            'file_mtime': datetime.fromtimestamp(self._mtime).isoformat() if self._mtime else None,
+            'stale': self._is_stale() if self.enabled else None,
+            'last_refresh': self.last_refresh
+        }
+
+    def _build_cli(self):
+        """Comando `flask snapshot refresh` (p. ej. desde cron)"""
+        grupo = AppGroup('snapshot', help='Snapshot columnar del dashboard')
+
+        @grupo.command('refresh', help='Regenera el snapshot desde VISTA_DASHBOARD')
+        def refresh_command():
+            click.echo(self.refresh(db_pool.get_connection()))
+
+        return grupo
+
+dashboard_snapshot = DashboardSnapshot()
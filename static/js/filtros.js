@@ -0,0 +1,32 @@
+// Rellena los desplegables de filtros desde /api/filtros (cacheado con ETag)
+function etiquetaSexo(s) {
+    if (s === 'M' || s === 'Masculino' || s === 'Hombre') return '👨 ' + s;
+    if (s === 'F' || s === 'Femenino' || s === 'Mujer') return '👩 ' + s;
+    return '⚧️ ' + s;
+}
+
+function rellenarSelect(id, valores, etiqueta = v => v) {
+    const select = document.getElementById(id);
+    if (!select) return;
+    valores.forEach(valor => {
+        const option = document.createElement('option');
+        option.value = valor;
+        option.textContent = etiqueta(valor);
+        select.appendChild(option);
+    });
+}
+
+function cargarFiltros() {
+    return fetch('/api/filtros')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                console.error('Error al cargar filtros:', data.error);
+                return;
+            }
+            rellenarSelect('comunidad', data.comunidades || []);
+            rellenarSelect('sexo', data.sexos || [], etiquetaSexo);
+            rellenarSelect('categoria', data.categorias || []);
+        })
+        .catch(error => console.error('Error al cargar filtros:', error));
+}
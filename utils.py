@@ -1,21 +1,17 @@
-import bcrypt
 import secrets
 import string
 from datetime import datetime, timedelta
 import re
 from flask import current_app
+from hashing import password_hasher
 
 def hash_password(password):
-    """Hashea una contraseña usando bcrypt con salt automático"""
-    salt = bcrypt.gensalt(rounds=12)  # 12 rondas para seguridad
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    """Hashea una contraseña usando bcrypt con salt automático (coste BCRYPT_ROUNDS, fuera del hilo de la petición)"""
+    return password_hasher.hash(password)
 
 def verify_password(password, password_hash):
     """Verifica una contraseña contra su hash"""
-    try:
-        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
-    except:
-        return False
+    return password_hasher.verify(password, password_hash)
 
 def validate_password(password):
     """